@@ -1,8 +1,11 @@
 from __future__ import absolute_import, division, print_function
 
 import math
+import numpy as np
 from logging import debug, info, warning, error, critical
 from bcam.util import dbgfname
+from bcam import util
+from bcam import profiling
 
 def inch_to_mm(i):
     return i*25.4
@@ -97,6 +100,105 @@ def linearized_path_aabb(path):
 
     return AABB(xmin, ymin, xmax, ymax)
 
+def linearized_path_to_segments(path):
+    """Packs a linearized path into an (n, 4) array of [sx, sy, ex, ey] rows."""
+    segments = np.empty((len(path), 4))
+    for i, e in enumerate(path):
+        segments[i] = (e.start[0], e.start[1], e.end[0], e.end[1])
+    return segments
+
+def segments_aabb(segments):
+    """Returns the AABB of an (n, 4) array of [sx, sy, ex, ey] rows."""
+    xs = segments[:, 0::2]
+    ys = segments[:, 1::2]
+    return AABB(xs.min(), ys.min(), xs.max(), ys.max())
+
+def arc_sweeps(startangles, endangles, turnaround):
+    """Signed sweeps of arcs, counterclockwise unless turned around."""
+    sa = np.asarray(startangles, dtype=float)
+    ea = np.asarray(endangles, dtype=float)
+    ccw = np.where(sa > ea, ea+2*math.pi, ea)-sa
+    cw = np.where(ea > sa, sa+2*math.pi, sa)-ea
+    return np.where(turnaround, -cw, ccw)
+
+def arc_segment_counts(radii, sweeps, tolerance):
+    """Chords needed per arc to stay within tolerance of it.
+
+    A chord spanning angle a lies r*(1-cos(a/2)) away from the arc at its
+    middle, so the largest angle one chord may span is 2*acos(1-tol/r).
+
+    """
+    r = np.maximum(np.asarray(radii, dtype=float), 1e-12)
+    max_angle = 2*np.arccos(np.clip(1-tolerance/r, -1, 1))
+    n = np.ceil(np.abs(sweeps)/np.maximum(max_angle, 1e-12)-1e-9)
+    return np.maximum(n, 1).astype(int)
+
+def linearize_arcs(centers, radii, startangles, sweeps, tolerance):
+    """Vertices of the chord polylines of many arcs, computed at once.
+
+    Returns (pts, bounds), arc k is the polyline pts[bounds[k]:bounds[k+1]].
+
+    """
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+    radii = np.asarray(radii, dtype=float)
+    sweeps = np.asarray(sweeps, dtype=float)
+    counts = arc_segment_counts(radii, sweeps, tolerance)+1
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+    step = np.arange(bounds[-1])-np.repeat(bounds[:-1], counts)
+    a = (np.repeat(startangles, counts)+
+         step/np.repeat(counts-1, counts)*np.repeat(sweeps, counts))
+    r = np.repeat(radii, counts)
+    pts = np.repeat(centers, counts, axis=0)+r[:, None]*np.column_stack((np.cos(a), np.sin(a)))
+    return pts, bounds
+
+def linearize_segments(starts, ends, curved, centers, radii, startangles, sweeps, tolerance):
+    """Linearizes a sequence of lines and arcs into segments.
+
+    Per element columns go in, curved marks arcs and circles.  Chords of
+    each arc begin and end exactly at the arc's ends, so linearized chains
+    stay connected.  Returns an (n, 4) array of [sx, sy, ex, ey] rows in
+    element order and the number of rows of every element.
+
+    """
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+    curved = np.asarray(curved, dtype=bool)
+    counts = np.ones(len(curved), dtype=int)
+    segments = None
+    if curved.any():
+        pts, bounds = linearize_arcs(np.asarray(centers)[curved], np.asarray(radii)[curved],
+                                     np.asarray(startangles)[curved], np.asarray(sweeps)[curved],
+                                     tolerance)
+        pts[bounds[:-1]] = starts[curved]
+        pts[bounds[1:]-1] = ends[curved]
+        counts[curved] = np.diff(bounds)-1
+        first = np.cumsum(counts)-counts
+        segments = np.empty((counts.sum(), 4))
+        # every vertex but the last of an arc starts a chord
+        chord_starts = np.ones(len(pts), dtype=bool)
+        chord_starts[bounds[1:]-1] = False
+        k = np.nonzero(chord_starts)[0]
+        arc_counts = counts[curved]
+        dest = np.repeat(first[curved], arc_counts)+(np.arange(arc_counts.sum())-np.repeat(np.cumsum(arc_counts)-arc_counts, arc_counts))
+        segments[dest, :2] = pts[k]
+        segments[dest, 2:] = pts[k+1]
+    else:
+        first = np.arange(len(curved))
+        segments = np.empty((len(curved), 4))
+    line = ~curved
+    segments[first[line], :2] = starts[line]
+    segments[first[line], 2:] = ends[line]
+    profiling.count("segments linearized", len(segments))
+    return segments, counts
+
+def find_true_runs(mask):
+    """Returns (first, last+1) index pairs of consecutive True runs in mask."""
+    padded = np.concatenate(([0], np.asarray(mask, dtype=np.int8), [0]))
+    edges = np.diff(padded)
+    starts = np.nonzero(edges == 1)[0]
+    ends = np.nonzero(edges == -1)[0]
+    return list(zip(starts.tolist(), ends.tolist()))
+
 def find_center_of_mass(path):
     x = path[0].start[0]
     y = path[0].start[1]
@@ -121,7 +223,8 @@ class AABB(object):
 
     """
     def __init__(self, sx, sy, ex, ey):
-        debug("AABB sx, sy, ex, ey: "+str(sx)+" "+str(sy)+" "+str(ex)+" "+str(ey))
+        if util.tracing:
+            debug("AABB sx, sy, ex, ey: %s %s %s %s", sx, sy, ex, ey)
         self.left = min(sx, ex)
         self.right = max(sx, ex)
         self.top = max(sy, ey)
@@ -166,6 +269,45 @@ class AABB(object):
 def pt_to_pt_dist(p1, p2):
     return math.sqrt((p1[0]-p2[0])**2+(p1[1]-p2[1])**2)
 
+class PointHash(object):
+    """Hash map keyed by points quantized to eps.
+
+    Points closer than eps always land in the same or in adjacent buckets,
+    so a lookup only has to check the 3x3 buckets around the query point.
+
+    """
+    def __init__(self, eps):
+        self.eps = eps
+        self.buckets = {}
+
+    def __key(self, pt):
+        return (int(math.floor(pt[0]/self.eps)), int(math.floor(pt[1]/self.eps)))
+
+    def add(self, pt, value):
+        key = self.__key(pt)
+        if key not in self.buckets:
+            self.buckets[key] = []
+        self.buckets[key].append((pt, value))
+
+    def remove(self, pt, value):
+        bucket = self.buckets[self.__key(pt)]
+        for i, (p, v) in enumerate(bucket):
+            if v == value:
+                del bucket[i]
+                return
+
+    def find(self, pt):
+        """Returns (distance, value) of all entries closer than eps to pt."""
+        kx, ky = self.__key(pt)
+        found = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for p, v in self.buckets.get((kx+dx, ky+dy), ()):
+                    d = pt_to_pt_dist(p, pt)
+                    if d < self.eps:
+                        found.append((d, v))
+        return found
+
 class CircleUtils(object):
     def __init__(self, center, radius, uses_inner_space=False):
         self.center = center
@@ -252,7 +394,8 @@ class ArcUtils(object):
 
     def distance_to_pt(self, pt):
         a = math.atan2(pt[1]-self.center[1], pt[0]-self.center[0])
-        debug("Distance to pt atan, start, end: "+str(a)+" "+str(self.sa)+" "+str(self.ea))
+        if util.tracing:
+            debug("Distance to pt atan, start, end: %s %s %s", a, self.sa, self.ea)
         if self.check_angle_in_range(a):
             dist = pt_to_pt_dist(pt, self.center)-self.radius
         else:
@@ -333,7 +476,7 @@ class ArcUtils(object):
             if len(checked_intersections)>0:
                 return checked_intersections
         else:
-            debug("  Not calc util:", other_element.__class__.__name__)
+            debug("  Not calc util: %s", other_element.__class__.__name__)
         return None
 
 
@@ -464,7 +607,7 @@ class LineUtils(object):
         elif other_element.__class__.__name__ == "ArcUtils":
             return oe.find_intersection(self)
         else:
-            debug("  Not calc util:", other_element.__class__.__name__)
+            debug("  Not calc util: %s", other_element.__class__.__name__)
 
         return None
 
@@ -480,3 +623,659 @@ class LineUtils(object):
 
     def __reproject_pt(self, pt, sina, cosa):
         return (pt[0]*cosa-pt[1]*sina, pt[0]*sina+pt[1]*cosa)
+
+
+def pts_to_segments_dist(pts, segments):
+    """Returns distances between pts[i] and segments[i] for every i."""
+    sx = segments[:, 0]
+    sy = segments[:, 1]
+    dx = segments[:, 2]-sx
+    dy = segments[:, 3]-sy
+    px = pts[:, 0]-sx
+    py = pts[:, 1]-sy
+    l2 = dx**2+dy**2
+    l2[l2 < 0.0001] = np.inf
+    t = np.clip((px*dx+py*dy)/l2, 0.0, 1.0)
+    return np.sqrt((px-t*dx)**2+(py-t*dy)**2)
+
+
+class SegmentIndex(object):
+    """Spatial index over the segments of a linearized path.
+
+    Segments are binned into a uniform grid by their AABBs, each non-empty
+    grid cell becomes a bucket bounded by the union of its segments' AABBs.
+    A query looks up the cells in growing rings around each point, until
+    the next ring can't be closer than what was found or than max_dist.
+    Points that would need more than max_rings rings, far away from every
+    segment, bound the distance to every bucket instead (from below by the
+    bucket AABB, from above by a point lying on a bucket segment) and only
+    measure the segments of buckets that can still hold the answer.
+
+    Grids of points are queried in square tiles, every point of a tile is
+    only measured against the segments that can be nearest to some point
+    of the tile.
+
+    """
+    chunk_size = 1<<20
+    grid_tile = 16
+
+    def __init__(self, path, cell_size=None):
+        if isinstance(path, np.ndarray):
+            self.segments = path
+        else:
+            self.segments = linearized_path_to_segments(path)
+        s = self.segments
+        n = len(s)
+        xmin = np.minimum(s[:, 0], s[:, 2])
+        xmax = np.maximum(s[:, 0], s[:, 2])
+        ymin = np.minimum(s[:, 1], s[:, 3])
+        ymax = np.maximum(s[:, 1], s[:, 3])
+        self.left = xmin.min()
+        self.bottom = ymin.min()
+        extent = max(xmax.max()-self.left, ymax.max()-self.bottom, 1e-6)
+        if cell_size == None:
+            # aim at about 2*sqrt(n) buckets along the drawn lines
+            length = np.hypot(s[:, 2]-s[:, 0], s[:, 3]-s[:, 1]).sum()
+            cell_size = max(length/(2*math.sqrt(n)), extent/1000.0)
+        self.cell_size = cell_size
+        self.nx = int(extent//cell_size)+1
+
+        cx0 = ((xmin-self.left)//cell_size).astype(int)
+        cx1 = ((xmax-self.left)//cell_size).astype(int)
+        cy0 = ((ymin-self.bottom)//cell_size).astype(int)
+        cy1 = ((ymax-self.bottom)//cell_size).astype(int)
+        w = cx1-cx0+1
+        counts = w*(cy1-cy0+1)
+        seg_ids = np.repeat(np.arange(n), counts)
+        k = np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts, counts)
+        w = np.repeat(w, counts)
+        cell = ((np.repeat(cx0, counts)+k%w)*(self.nx+1)+
+                np.repeat(cy0, counts)+k//w)
+        order = np.argsort(cell, kind="mergesort")
+        cell = cell[order]
+        self.bucket_segments = seg_ids[order]
+        first = np.concatenate(([True], cell[1:] != cell[:-1]))
+        self.bucket_start = np.nonzero(first)[0]
+        self.bucket_key = cell[self.bucket_start]
+        # rings up to max_rings look at about a quarter as many cells as
+        # there are buckets, points further out scan the buckets
+        self.max_rings = int(math.sqrt(len(self.bucket_start)))//4
+        # cells with a bucket at most max_rings cells away
+        near = np.zeros((self.nx, self.nx), dtype=bool)
+        near[self.bucket_key//(self.nx+1), self.bucket_key%(self.nx+1)] = True
+        for axis in (0, 1):
+            c = np.cumsum(np.insert(near, 0, False, axis=axis), axis=axis, dtype=int)
+            lo = np.clip(np.arange(self.nx)-self.max_rings, 0, self.nx)
+            hi = np.clip(np.arange(self.nx)+self.max_rings+1, 0, self.nx)
+            near = np.take(c, hi, axis=axis)-np.take(c, lo, axis=axis) > 0
+        self.near_buckets = near
+        self.bucket_count = np.diff(np.append(self.bucket_start, len(cell)))
+
+        bs = self.bucket_segments
+        self.bucket_aabb = np.column_stack((np.minimum.reduceat(xmin[bs], self.bucket_start),
+                                            np.minimum.reduceat(ymin[bs], self.bucket_start),
+                                            np.maximum.reduceat(xmax[bs], self.bucket_start),
+                                            np.maximum.reduceat(ymax[bs], self.bucket_start)))
+        self.bucket_pt = s[bs[self.bucket_start], :2]
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __chunks(self, n_pts):
+        step = max(1, self.chunk_size//len(self.bucket_start))
+        for i in range(0, n_pts, step):
+            yield slice(i, i+step)
+
+    def __expand(self, pi, bi):
+        # turns (point, bucket) pairs into (point, segment) pairs
+        counts = self.bucket_count[bi]
+        k = np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts, counts)
+        si = self.bucket_segments[np.repeat(self.bucket_start[bi], counts)+k]
+        return np.repeat(pi, counts), si
+
+    def __ring(self, r):
+        # cell offsets r cells away
+        if r == 0:
+            return np.zeros((1, 2), dtype=int)
+        k = np.arange(-r, r+1)
+        side = np.arange(-r+1, r)
+        return np.vstack((np.column_stack((k, np.full(len(k), -r))),
+                          np.column_stack((k, np.full(len(k), r))),
+                          np.column_stack((np.full(len(side), -r), side)),
+                          np.column_stack((np.full(len(side), r), side))))
+
+    def __ring_buckets(self, cells, r):
+        # (point, bucket) pairs of the non-empty cells r cells around cells
+        c = cells[:, None, :]+self.__ring(r)[None]
+        inside = ((c >= 0) & (c < self.nx)).all(axis=2)
+        pi, oi = np.nonzero(inside)
+        keys = c[pi, oi, 0]*(self.nx+1)+c[pi, oi, 1]
+        bi = np.minimum(np.searchsorted(self.bucket_key, keys), len(self.bucket_key)-1)
+        hit = self.bucket_key[bi] == keys
+        return pi[hit], bi[hit]
+
+    def __rings(self, pts, max_dist):
+        # (point, bucket) pairs out of growing rings, the best distances
+        # found and the points the rings didn't settle
+        cs = self.cell_size
+        cells = np.floor((pts-(self.left, self.bottom))/cs).astype(int)
+        # rings closer than r0 are off the grid
+        r0 = np.maximum(np.maximum(-cells, cells-(self.nx-1)), 0).max(axis=1)
+        clamped = np.clip(cells, 0, self.nx-1)
+        near = (r0 <= self.max_rings) & self.near_buckets[clamped[:, 0], clamped[:, 1]]
+        best = np.full(len(pts), np.inf)
+        active = np.nonzero(near)[0]
+        pis = [np.zeros(0, dtype=int)]
+        bis = [np.zeros(0, dtype=int)]
+        for r in range(self.max_rings+1):
+            if len(active) == 0:
+                break
+            pi, bi = self.__ring_buckets(cells[active], r)
+            pi = active[pi]
+            pis.append(pi)
+            bis.append(bi)
+            if max_dist is None:
+                if len(pi) > 0:
+                    # the closest bucket of the ring bounds the distance
+                    lower = self.__lower(pts[pi], bi)
+                    lmin = self.__min_per_pt(pi, lower, len(pts))
+                    closest = np.nonzero((lower == lmin[pi]) & (lower < best[pi]**2))[0]
+                    closest = closest[np.unique(pi[closest], return_index=True)[1]]
+                    ppi, si = self.__expand(pi[closest], bi[closest])
+                    d = pts_to_segments_dist(pts[ppi], self.segments[si])
+                    best = np.minimum(best, self.__min_per_pt(ppi, d, len(pts)))
+                # the next ring is at least r cells away
+                active = active[best[active] >= r*cs]
+            else:
+                active = active[max_dist[active] >= r*cs]
+        # buckets of far points are at least max_rings cells away
+        settled = near.copy()
+        if max_dist is not None:
+            settled|= max_dist < self.max_rings*cs
+        settled[active] = False
+        pi = np.concatenate(pis)
+        bi = np.concatenate(bis)
+        upper = best if max_dist is None else max_dist
+        keep = settled[pi] & (self.__lower(pts[pi], bi) <= (upper[pi]+1e-9)**2)
+        return pi[keep], bi[keep], best, np.nonzero(~settled)[0]
+
+    def __lower(self, pts, bi):
+        # squared distances from pts to the AABBs of buckets bi
+        b = self.bucket_aabb[bi]
+        dx = np.maximum(np.maximum(b[:, 0]-pts[:, 0], pts[:, 0]-b[:, 2]), 0)
+        dy = np.maximum(np.maximum(b[:, 1]-pts[:, 1], pts[:, 1]-b[:, 3]), 0)
+        return dx**2+dy**2
+
+    def __scan(self, pts, upper):
+        # (point, bucket) pairs of every bucket that may be closer than upper
+        b = self.bucket_aabb
+        px = pts[:, 0, None]
+        py = pts[:, 1, None]
+        dx = np.maximum(np.maximum(b[:, 0]-px, px-b[:, 2]), 0)
+        dy = np.maximum(np.maximum(b[:, 1]-py, py-b[:, 3]), 0)
+        lower = dx**2+dy**2
+        unknown = np.isinf(upper)
+        if np.any(unknown):
+            # the closest bucket gives an upper bound for the distance
+            pi, si = self.__expand(np.nonzero(unknown)[0], lower[unknown].argmin(axis=1))
+            d = pts_to_segments_dist(pts[pi], self.segments[si])
+            upper = np.minimum(upper, self.__min_per_pt(pi, d, len(pts)))
+        # slack keeps rounding from dropping the bucket that holds the answer
+        upper = (upper+1e-9)**2
+        return np.nonzero(lower <= upper[:, None])
+
+    def __candidates(self, pts, max_dist=None):
+        # returns (point, segment) index pairs worth measuring, sorted by
+        # point, max_dist is one for all points or one per point
+        if max_dist is not None:
+            max_dist = np.broadcast_to(np.asarray(max_dist, dtype=float), (len(pts),))
+        pi, bi, best, far = self.__rings(pts, max_dist)
+        if len(far) > 0:
+            upper = best[far] if max_dist is None else max_dist[far]
+            fpi, fbi = self.__scan(pts[far], upper)
+            pi = np.concatenate((pi, far[fpi]))
+            bi = np.concatenate((bi, fbi))
+        order = np.argsort(pi, kind="mergesort")
+        return self.__expand(pi[order], bi[order])
+
+    def __min_per_pt(self, pi, d, n_pts):
+        dist = np.full(n_pts, np.inf)
+        if len(pi) > 0:
+            starts = np.nonzero(np.concatenate(([True], pi[1:] != pi[:-1])))[0]
+            dist[pi[starts]] = np.minimum.reduceat(d, starts)
+        return dist
+
+    def nearest_to_pts(self, pts):
+        """Returns (segment index, distance) arrays of the nearest segments."""
+        pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+        nearest = np.empty(len(pts), dtype=int)
+        dist = np.empty(len(pts))
+        for c in self.__chunks(len(pts)):
+            p = pts[c]
+            pi, si = self.__candidates(p)
+            d = pts_to_segments_dist(p[pi], self.segments[si])
+            dmin = self.__min_per_pt(pi, d, len(p))
+            hits = np.nonzero(d == dmin[pi])[0]
+            pts_hit, first = np.unique(pi[hits], return_index=True)
+            nearest[c][pts_hit] = si[hits[first]]
+            dist[c] = dmin
+        return nearest, dist
+
+    def nearest(self, pt):
+        """Returns (segment index, distance) of the segment nearest to pt."""
+        nearest, dist = self.nearest_to_pts([pt])
+        return int(nearest[0]), float(dist[0])
+
+    def distances_to_pts(self, pts):
+        """Returns the distance from each of pts to the closest segment."""
+        return self.nearest_to_pts(pts)[1]
+
+    def distances_to_grid(self, xs, ys):
+        """Returns the distances from the points of the grid xs by ys to the
+        closest segment, indexed by x then y.
+        """
+        size = self.grid_tile
+        tx, ty, centers, h = grid_tiles(xs, ys, size)
+        n = len(self.segments)
+        # the segment nearest to a point of a tile is at most reach away
+        # from the tile center
+        reach = self.distances_to_pts(centers)+2*h
+        ti, si = self.__candidates(centers, reach)
+        keep = pts_to_segments_dist(centers[ti], self.segments[si]) <= reach[ti]+1e-9
+        key = np.unique(ti[keep]*n+si[keep])
+        ti = key//n
+        si = key%n
+        bounds = np.searchsorted(ti, np.arange(len(centers)+1))
+        dist = np.empty((len(centers), size*size))
+        step = max(1, self.chunk_size//(size*size))
+        t0 = 0
+        while t0 < len(centers):
+            # whole tiles of about step (tile, segment) pairs at a time
+            t1 = max(t0+1, np.searchsorted(bounds, bounds[t0]+step, "right")-1)
+            t1 = min(t1, len(centers))
+            c = slice(bounds[t0], bounds[t1])
+            shape = (c.stop-c.start, size, size)
+            px = np.broadcast_to(tx[ti[c]//len(ty)][:, :, None], shape)
+            py = np.broadcast_to(ty[ti[c]%len(ty)][:, None, :], shape)
+            pts = np.column_stack((px.ravel(), py.ravel()))
+            d = pts_to_segments_dist(pts, np.repeat(self.segments[si[c]], size*size, axis=0))
+            dist[t0:t1] = np.minimum.reduceat(d.reshape(-1, size*size), bounds[t0:t1]-c.start, axis=0)
+            t0 = t1
+        dist = dist.reshape(len(tx), len(ty), size, size).transpose(0, 2, 1, 3)
+        return dist.reshape(len(tx)*size, len(ty)*size)[:len(xs), :len(ys)]
+
+    def pts_within(self, pts, r):
+        """Returns a boolean array, True for each of pts closer than r to a segment."""
+        pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+        within = np.zeros(len(pts), dtype=bool)
+        for c in self.__chunks(len(pts)):
+            p = pts[c]
+            pi, si = self.__candidates(p, r)
+            d = pts_to_segments_dist(p[pi], self.segments[si])
+            within[c][pi[d <= r]] = True
+        return within
+
+    def any_within(self, pt, r):
+        """Tests if any segment is at most r away from pt."""
+        return bool(self.pts_within([pt], r)[0])
+
+
+def grid_tiles(xs, ys, size):
+    """Splits the grid xs by ys into tiles of size by size points.
+
+    Returns the x and y coordinates of the points of every column and row
+    of tiles, the last ones padded by repeating the last coordinate, the
+    tile centers, row by row, and their half diagonals.
+
+    """
+    ix = np.minimum(np.arange(-(-len(xs)//size)*size), len(xs)-1)
+    iy = np.minimum(np.arange(-(-len(ys)//size)*size), len(ys)-1)
+    tx = np.asarray(xs, dtype=float)[ix].reshape(-1, size)
+    ty = np.asarray(ys, dtype=float)[iy].reshape(-1, size)
+    cx = (tx[:, 0]+tx[:, -1])/2.0
+    cy = (ty[:, 0]+ty[:, -1])/2.0
+    hx = np.abs(tx[:, -1]-tx[:, 0])/2.0
+    hy = np.abs(ty[:, -1]-ty[:, 0])/2.0
+    centers = np.column_stack((np.repeat(cx, len(cy)), np.tile(cy, len(cx))))
+    h = np.hypot(np.repeat(hx, len(hy)), np.tile(hy, len(hx)))
+    return tx, ty, centers, h
+
+
+class PolygonUtils(object):
+    """Batch point queries against a closed linearized path.
+
+    Segments are binned into horizontal bands (scanlines), so every probe
+    point is only tested against the segments spanning its band.  All tests
+    within a band are done at once with NumPy.
+
+    """
+    chunk_size = 1<<18
+
+    def __init__(self, path):
+        if isinstance(path, np.ndarray):
+            self.segments = path
+        else:
+            self.segments = linearized_path_to_segments(path)
+        s = self.segments
+        ymin = np.minimum(s[:, 1], s[:, 3])
+        ymax = np.maximum(s[:, 1], s[:, 3])
+        self.bottom = ymin.min()
+        self.top = ymax.max()
+        self.n_bands = max(1, int(math.sqrt(len(s))))
+        self.band_height = (self.top-self.bottom)/self.n_bands
+        if self.band_height == 0:
+            self.band_height = 1.0
+        self.bands = []
+        for b in range(self.n_bands):
+            lo = self.bottom+b*self.band_height
+            hi = lo+self.band_height
+            self.bands.append(self.segments[(ymax >= lo) & (ymin <= hi)])
+        self.index = SegmentIndex(self.segments)
+
+    def __chunks(self, n_pts, n_segments):
+        step = max(1, self.chunk_size//max(1, n_segments))
+        for i in range(0, n_pts, step):
+            yield slice(i, i+step)
+
+    def __winding(self, pts, segments):
+        sx = segments[:, 0]
+        sy = segments[:, 1]
+        ex = segments[:, 2]
+        ey = segments[:, 3]
+        px = pts[:, 0, None]
+        py = pts[:, 1, None]
+        is_left = (ex-sx)*(py-sy)-(px-sx)*(ey-sy)
+        up = (sy <= py) & (ey > py) & (is_left > 0)
+        down = (sy > py) & (ey <= py) & (is_left < 0)
+        return up.sum(axis=1)-down.sum(axis=1)
+
+    def winding_numbers(self, pts):
+        """Returns the winding number of the path around each of pts."""
+        pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+        wn = np.zeros(len(pts), dtype=int)
+        band = np.floor((pts[:, 1]-self.bottom)/self.band_height).astype(int)
+        band[pts[:, 1] == self.top] = self.n_bands-1
+        band[(band < 0) | (band >= self.n_bands)] = -1
+        for b in np.unique(band):
+            if b < 0:
+                continue
+            idx = np.nonzero(band == b)[0]
+            segments = self.bands[b]
+            if len(segments) == 0:
+                continue
+            for c in self.__chunks(len(idx), len(segments)):
+                wn[idx[c]] = self.__winding(pts[idx[c]], segments)
+        return wn
+
+    def get_area(self):
+        """Returns the signed area, positive for counter-clockwise paths."""
+        s = self.segments
+        return 0.5*(s[:, 0]*s[:, 3]-s[:, 2]*s[:, 1]).sum()
+
+    def pts_inside(self, pts):
+        """Returns a boolean array, True for each of pts inside the path."""
+        return self.winding_numbers(pts) != 0
+
+    def pt_inside(self, pt):
+        return bool(self.pts_inside([pt])[0])
+
+    def signed_distances_to_pts(self, pts):
+        """Returns distances to the path, negated for points outside of it."""
+        pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+        dist = self.distances_to_pts(pts)
+        dist[~self.pts_inside(pts)] *= -1
+        return dist
+
+    def distances_to_pts(self, pts):
+        """Returns the distance from each of pts to the closest segment."""
+        return self.index.distances_to_pts(pts)
+
+    def signed_distances_to_grid(self, xs, ys):
+        """signed_distances_to_pts of the points of the grid xs by ys,
+        indexed by x then y.
+        """
+        dist = self.index.distances_to_grid(xs, ys)
+        # the path can only come between neighbours along a column if
+        # they're closer to it than to each other, everywhere else the
+        # points inside are the ones after a point inside
+        dy = np.abs(np.diff(ys))
+        changes = np.ones(dist.shape, dtype=bool)
+        changes[:, 1:] = dist[:, :-1]+dist[:, 1:] <= dy+1e-9
+        ci, cj = np.nonzero(changes)
+        inside = np.zeros(dist.shape, dtype=bool)
+        inside[ci, cj] = self.pts_inside(np.column_stack((np.asarray(xs)[ci], np.asarray(ys)[cj])))
+        last = np.maximum.accumulate(np.where(changes, np.arange(len(ys)), 0), axis=1)
+        inside = np.take_along_axis(inside, last, axis=1)
+        dist[~inside] *= -1
+        return dist
+
+    def pts_close(self, pts, r):
+        """Returns a boolean array, True for each of pts within r of the path."""
+        return self.index.pts_within(pts, r)
+
+
+def _mk_cell_links():
+    # For every marching squares cell case and center value lists the
+    # (from edge, to edge) contour segments in the cell.  Corners and edges
+    # are counted counter-clockwise from the bottom left corner and the bottom
+    # edge, a segment leaves through the edge where an inside corner is
+    # followed by an outside one, so the inside stays on the left.
+    cell_links = {}
+    for case in range(16):
+        corners = [(case>>k)&1 for k in range(4)]
+        crossings = [(k, corners[k]) for k in range(4) if corners[k] != corners[(k+1)%4]]
+        n = len(crossings)
+        for center_inside in (False, True):
+            links = []
+            for k, (edge, leaving) in enumerate(crossings):
+                if leaving:
+                    partner = crossings[(k+1)%n if center_inside else (k-1)%n][0]
+                    links.append((edge, partner))
+            cell_links[(case, center_inside)] = links
+    return cell_links
+
+_cell_links = _mk_cell_links()
+
+def find_iso_contours(field, xs, ys, level):
+    """Extracts the closed contours where a sampled field crosses level.
+
+    field is sampled at xs (first axis) by ys (second axis), and is expected
+    to be below level along the whole grid border, so every contour is
+    closed.  Contours are marched through the grid cells (marching squares)
+    and returned as (n, 2) arrays of points oriented counter-clockwise around
+    the area above level.
+
+    """
+    inside = (field > level).astype(np.uint8)
+    case = (inside[:-1, :-1] | (inside[1:, :-1]<<1) |
+            (inside[1:, 1:]<<2) | (inside[:-1, 1:]<<3))
+    center = (field[:-1, :-1]+field[1:, :-1]+field[1:, 1:]+field[:-1, 1:])/4.0 > level
+    cells = (case != 0) & (case != 15)
+    ii, jj = np.nonzero(cells)
+
+    # edge keys: (0, i, j) horizontal edge from (i, j), (1, i, j) vertical one
+    links = {}
+    for i, j, c, m in zip(ii.tolist(), jj.tolist(), case[cells].tolist(), center[cells].tolist()):
+        edges = ((0, i, j), (1, i+1, j), (0, i, j+1), (1, i, j))
+        for a, b in _cell_links[(c, m)]:
+            links[edges[a]] = edges[b]
+
+    contours = []
+    while links:
+        first, nxt = links.popitem()
+        chain = [first]
+        while nxt != first:
+            chain.append(nxt)
+            nxt = links.pop(nxt)
+        keys = np.array(chain)
+        kind = keys[:, 0]
+        i0 = keys[:, 1]
+        j0 = keys[:, 2]
+        i1 = i0+(kind == 0)
+        j1 = j0+(kind == 1)
+        f0 = field[i0, j0]
+        f1 = field[i1, j1]
+        t = (level-f0)/(f1-f0)
+        x = xs[i0]+t*(xs[i1]-xs[i0])
+        y = ys[j0]+t*(ys[j1]-ys[j0])
+        contours.append(np.column_stack((x, y)))
+    return contours
+
+def simplify_polyline(pts, tolerance, closed=False):
+    """Drops polyline vertices that deviate less than tolerance (Douglas-Peucker).
+
+    For closed polylines the first point is kept and the closing segment
+    back to it is implied.
+
+    """
+    pts = np.asarray(pts, dtype=float)
+    if closed:
+        pts = np.vstack((pts, pts[:1]))
+    n = len(pts)
+    if n < 3:
+        return pts[:-1] if closed else pts
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n-1)]
+    while stack:
+        first, last = stack.pop()
+        if last-first < 2:
+            continue
+        s = pts[first]
+        d = pts[last]-s
+        v = pts[first+1:last]-s
+        l2 = d[0]**2+d[1]**2
+        if l2 < 1e-24:
+            dist = np.hypot(v[:, 0], v[:, 1])
+        else:
+            # distance to the segment, so points that run past its ends
+            # (a path doubling back on itself) are kept
+            t = np.clip((v[:, 0]*d[0]+v[:, 1]*d[1])/l2, 0, 1)
+            dist = np.hypot(v[:, 0]-t*d[0], v[:, 1]-t*d[1])
+        i = int(dist.argmax())
+        if dist[i] > tolerance:
+            i += first+1
+            keep[i] = True
+            stack.append((first, i))
+            stack.append((i, last))
+    pts = pts[keep]
+    return pts[:-1] if closed else pts
+
+def decimate_segments(segments, tolerance):
+    """Polylines within tolerance of an (n, 4) segment array, for display.
+
+    Runs of connected segments become polylines simplified to tolerance,
+    runs that fit in a box of tolerance collapse to their middle vertex.
+
+    """
+    segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+    if len(segments) == 0:
+        return []
+    gaps = np.nonzero(np.any(np.abs(segments[1:, :2]-segments[:-1, 2:]) > 1e-9, axis=1))[0]+1
+    bounds = np.concatenate(([0], gaps, [len(segments)]))
+    polylines = []
+    for first, last in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        pts = np.vstack((segments[first:last, :2], segments[last-1:last, 2:]))
+        lo = pts.min(axis=0)
+        hi = pts.max(axis=0)
+        if np.all(hi-lo <= tolerance):
+            polylines.append(((lo+hi)/2).reshape(1, 2))
+        else:
+            polylines.append(simplify_polyline(pts, tolerance))
+    return polylines
+
+
+def _circumcenters(a, b, c):
+    bx, by = b[..., 0]-a[..., 0], b[..., 1]-a[..., 1]
+    cx, cy = c[..., 0]-a[..., 0], c[..., 1]-a[..., 1]
+    d = 2*(bx*cy-by*cx)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ux = (cy*(bx**2+by**2)-by*(cx**2+cy**2))/d
+        uy = (bx*(cx**2+cy**2)-cx*(bx**2+by**2))/d
+    return np.stack((a[..., 0]+ux, a[..., 1]+uy), axis=-1)
+
+def _fits_arc(pts, tolerance, max_radius, max_step):
+    c = _circumcenters(pts[0], pts[len(pts)//2], pts[-1])
+    if not np.all(np.isfinite(c)):
+        return None
+    v = pts-c
+    dist = np.hypot(v[:, 0], v[:, 1])
+    r = dist[0]
+    if r > max_radius or np.abs(dist-r).max() > tolerance:
+        return None
+    a = np.arctan2(v[:, 1], v[:, 0])
+    da = np.diff(a)
+    da = (da+math.pi)%(2*math.pi)-math.pi
+    ccw = np.all(da > 0)
+    if not (ccw or np.all(da < 0)):
+        return None
+    if abs(da.sum()) >= math.pi:
+        return None
+    # an arc bulges out of each chord by its sagitta, long chords are only
+    # accepted when they stay within tolerance of it
+    if np.abs(da).max() > max_step and (r*(1-np.cos(da/2))).max() > tolerance:
+        return None
+    return c, bool(ccw)
+
+def fit_arcs(pts, tolerance, min_segments=3, max_radius=10000, max_step=0.2):
+    """Finds runs of polyline vertices that lie on circular arcs.
+
+    Returns a list of (first, last, center, ccw) tuples, each covering
+    pts[first:last+1] with every vertex within tolerance of the arc.
+    Chords may span up to max_step radians (arcs linearized for offsetting
+    are restored), longer ones must stay within tolerance themselves.
+    Arcs span less than half a turn, so they can be written with an R word.
+
+    """
+    pts = np.asarray(pts, dtype=float)
+    n = len(pts)
+    if n < min_segments+1:
+        return []
+    # cheap test on every window of four points to find where arcs may start
+    a, b, c, d = pts[:-3], pts[1:-2], pts[2:-1], pts[3:]
+    cc = _circumcenters(a, b, c)
+    r = np.hypot(*(a-cc).T)
+    with np.errstate(invalid="ignore"):
+        seeds = np.abs(np.hypot(*(d-cc).T)-r) <= tolerance
+    u, v, w = b-a, c-b, d-c
+    t1 = u[:, 0]*v[:, 1]-u[:, 1]*v[:, 0]
+    t2 = v[:, 0]*w[:, 1]-v[:, 1]*w[:, 0]
+    seeds &= (t1*t2 > 0)
+    seed_idx = np.nonzero(seeds)[0]
+
+    arcs = []
+    pos = 0
+    for i in seed_idx.tolist():
+        if i < pos or i+min_segments >= n:
+            continue
+        fit = _fits_arc(pts[i:i+min_segments+1], tolerance, max_radius, max_step)
+        if fit is None:
+            continue
+        lo = i+min_segments
+        hi = None
+        step = min_segments
+        while True:
+            j = lo+step
+            if j >= n:
+                j = n-1
+                if j == lo:
+                    break
+            f = _fits_arc(pts[i:j+1], tolerance, max_radius, max_step)
+            if f is None:
+                hi = j
+                break
+            lo, fit = j, f
+            if j == n-1:
+                break
+            step*= 2
+        if hi is not None:
+            while hi-lo > 1:
+                j = (lo+hi)//2
+                f = _fits_arc(pts[i:j+1], tolerance, max_radius, max_step)
+                if f is None:
+                    hi = j
+                else:
+                    lo, fit = j, f
+        arcs.append((i, lo, fit[0], fit[1]))
+        pos = lo
+    return arcs
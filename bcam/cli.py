@@ -0,0 +1,287 @@
+from __future__ import absolute_import, division, print_function
+
+from logging import debug, info, warning, error, critical
+import logging
+from bcam.util import dbgfname
+from bcam import util
+from bcam import profiling
+from bcam import toolpath_cache
+from bcam import project
+
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+from bcam.state import State
+from bcam.path import Path
+from bcam.tool_operation import TOEnum, TOResult
+from bcam.tool_op_drill import TODrill
+from bcam.tool_op_exact_follow import TOExactFollow
+from bcam.tool_op_offset_follow import TOOffsetFollow
+from bcam.tool_op_pocketing import TOPocketing
+from bcam.gcode_writer import GCodeWriter, gen_program
+from bcam.travel_optimizer import TravelOptimizer
+
+# headless G-code generation, nothing here may pull in gtk or cairo
+
+usage = """Recipe format (JSON):
+
+  {"tool": {"diameter": 3, "feedrate": 200, "default_height": 5, "tolerance": 0.01,
+            "compression_tolerance": 0.01},
+   "material": {"thickness": 3},
+   "optimize_travel": true,
+   "operations": [
+     {"type": "drill", "depth": 3, "max_diameter": 3.5},
+     {"type": "pocket", "select": "holes", "depth": 1, "strategy": "contour"},
+     {"type": "offset follow", "select": "outer", "offset": 1.5}
+   ]}
+
+Operation types are drill, exact follow, offset follow and pocket.  Drills
+go into points and into circles up to max_diameter.  The other operations
+work on the contours of the remaining elements, "select" picks all, closed,
+open, holes or outer ones.  Depth defaults to the material thickness.
+
+--profile writes the time spent in named spans (pocketing, offset follow,
+connected paths, write gcode, ...) and counters of the work done (segments
+linearized, points tested, gcode lines and bytes) as JSON, summed over all
+jobs and for every job.
+
+--cache-dir keeps offset and pocket toolpaths by the geometry and settings
+they are computed from, jobs sharing those with earlier runs skip the work.
+When the directory grows past --cache-size megabytes (256 by default) the
+toolpaths used least recently are removed.  The directory can also be
+deleted at any time.
+"""
+
+input_extensions = ["dxf", "drl", "xln", "exc", "bcam"]
+tool_keys = ["diameter", "feedrate", "default_height", "tolerance", "compression_tolerance"]
+
+def load_state(file_path):
+    dbgfname()
+    ext = os.path.splitext(file_path)[1][1:].strip().lower()
+    if ext == "bcam":
+        # saved toolpaths are used as they are, G-code comes out without
+        # recomputing anything
+        return State(project.read_step_data(file_path)["state"])
+
+    state = State()
+    if ext == "dxf":
+        from bcam.loader_dxf import DXFLoader
+        state.add_paths(DXFLoader().load(file_path))
+    else:
+        from bcam.loader_excellon import ExcellonLoader
+        state.add_paths(ExcellonLoader().load(file_path))
+    return state
+
+def is_drill_target(e, max_diameter):
+    if e.joinable or not e.operations[TOEnum.drill]:
+        return False
+    if type(e).__name__ == "ECircle":
+        return max_diameter == None or e.radius*2 <= max_diameter
+    return True
+
+def select_contours(contours, select):
+    if select == "closed":
+        return [c for c in contours if c.get_closed()]
+    if select == "open":
+        return [c for c in contours if not c.get_closed()]
+    if select == "holes":
+        return [c for c in contours if c.get_closed() and c.is_hole()]
+    if select == "outer":
+        return [c for c in contours if c.get_closed() and not c.is_hole()]
+    return contours
+
+def apply_recipe(state, recipe):
+    dbgfname()
+    tool = state.settings.tool
+    for k, v in recipe.get("tool", {}).items():
+        if k not in tool_keys:
+            raise ValueError("unknown tool setting: "+k)
+        setattr(tool, k, v)
+    if "thickness" in recipe.get("material", {}):
+        state.settings.material.thickness = recipe["material"]["thickness"]
+    thickness = state.settings.material.get_thickness()
+
+    ops = recipe.get("operations", [])
+    drill_sizes = [op.get("max_diameter") for op in ops if op["type"] == TOEnum.drill]
+    # circles that get drilled are not contours of their own
+    max_drill = None
+    if len(drill_sizes)>0 and None not in drill_sizes:
+        max_drill = max(drill_sizes)
+    elements = [e for p in state.paths for e in p.elements]
+    drill_targets = []
+    if len(drill_sizes)>0:
+        drill_targets = [e for e in elements if is_drill_target(e, max_drill)]
+    targets = set(drill_targets)
+    rest = [e for e in elements if e not in targets and (e.joinable or type(e).__name__ == "ECircle")]
+    contours = []
+    if len(rest)>0:
+        contours = Path(state, rest, "path", state.settings.get_def_lt().name).mk_contours()
+        for i, c in enumerate(contours):
+            c.name = c.name+" "+str(i)
+    state.paths = contours+[Path(state, [e], "drill "+str(i), state.settings.get_def_lt().name) for i, e in enumerate(drill_targets)]
+
+    for op in ops:
+        depth = op.get("depth", thickness)
+        typ = op["type"]
+        if typ == TOEnum.drill:
+            for e in drill_targets:
+                if is_drill_target(e, op.get("max_diameter")):
+                    drl_op = TODrill(state, index=len(state.tool_operations))
+                    if drl_op.apply(e, depth):
+                        state.tool_operations.append(drl_op)
+            continue
+        for c in select_contours(contours, op.get("select", "all")):
+            index = len(state.tool_operations)
+            if typ == TOEnum.exact_follow:
+                to = TOExactFollow(state, index=index, depth=depth)
+                ok = to.apply(c)
+            elif typ == TOEnum.offset_follow:
+                to = TOOffsetFollow(state, index=index, depth=depth)
+                to.offset = op.get("offset", tool.diameter/2.0)
+                ok = to.apply(c)
+            elif typ == TOEnum.pocket:
+                to = TOPocketing(state, index=index, depth=depth)
+                to.strategy = op.get("strategy", to.strategy)
+                ok = to.apply_now(c) == TOResult.ok
+            else:
+                raise ValueError("unknown operation type: "+typ)
+            if ok and to.draw_list:
+                state.tool_operations.append(to)
+
+    if recipe.get("optimize_travel", True):
+        before, after = TravelOptimizer(state).optimize()
+        debug("  travel: %s -> %s", before, after)
+
+def run_job(job):
+    """Runs one job, returns (src, dst, seconds, stats, error, measured).
+
+    measured holds the profile of this job only and, when tracing, its per
+    function timings, so that the parent can sum up those of its workers.
+
+    """
+    src, dst, recipe = job
+    t = time.time()
+    util.reset_trace_stats()
+    profiling.reset()
+    try:
+        with profiling.span("job"):
+            state = load_state(src)
+            if recipe != None:
+                apply_recipe(state, recipe)
+            f = open(dst, "w")
+            writer = GCodeWriter(f)
+            writer.write_all(gen_program(state))
+            f.close()
+    except Exception as e:
+        return (src, dst, time.time()-t, None, str(e), job_measurements())
+    return (src, dst, time.time()-t, (len(state.tool_operations), writer.lines_written), None, job_measurements())
+
+def job_measurements():
+    measured = {"profile": profiling.snapshot(), "trace": None}
+    if util.tracing:
+        measured["trace"] = dict((name, list(stats)) for name, stats in util.trace_stats.items())
+    return measured
+
+def find_jobs(inputs, output_dir, recipe):
+    jobs = []
+    for i in inputs:
+        if os.path.isdir(i):
+            files = sorted(os.path.join(i, n) for n in os.listdir(i)
+                           if os.path.splitext(n)[1][1:].lower() in input_extensions)
+        else:
+            files = [i]
+        for src in files:
+            dst = os.path.splitext(src)[0]+".ngc"
+            if output_dir != None:
+                dst = os.path.join(output_dir, os.path.basename(dst))
+            jobs.append((src, dst, recipe))
+    return jobs
+
+def write_profile(path, job_profiles):
+    profiling.reset()
+    for p in job_profiles.values():
+        profiling.merge(p)
+    report = profiling.snapshot()
+    report.pop("last", None)
+    report["jobs"] = job_profiles
+    out = json.dumps(report, indent=2, sort_keys=True)
+    if path == "-":
+        print(out)
+    else:
+        f = open(path, "w")
+        f.write(out)
+        f.close()
+
+def init_worker(tracing, cache_dir, cache_size):
+    util.set_tracing(tracing)
+    toolpath_cache.cache.set_directory(cache_dir, int(cache_size*(1<<20)))
+
+def mk_parser():
+    parser = argparse.ArgumentParser(prog="bcam-batch", description="Generates G-code from DXF, Excellon and BCAM project files without a GUI.", epilog=usage, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="input files or directories of jobs")
+    parser.add_argument("-r", "--recipe", help="JSON recipe of tool operations, required for DXF and Excellon input")
+    parser.add_argument("-o", "--output-dir", help="where to write .ngc files, next to the input by default")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="worker processes, one per CPU by default")
+    parser.add_argument("--log", action="store_true", help="debug logging")
+    parser.add_argument("--profile", metavar="FILE", help="write spans and counters of all jobs as JSON, - for stdout")
+    parser.add_argument("--cache-dir", metavar="DIR", help="keep computed toolpaths here and reuse them in later runs")
+    parser.add_argument("--cache-size", metavar="MB", type=float, default=256, help="remove the least recently used toolpaths past this size")
+    return parser
+
+def run(argv=None):
+    args = mk_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.log else logging.WARNING)
+    init_worker(args.log, args.cache_dir, args.cache_size)
+
+    recipe = None
+    if args.recipe != None:
+        f = open(args.recipe)
+        recipe = json.loads(f.read())
+        f.close()
+    if args.output_dir != None and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    jobs = find_jobs(args.inputs, args.output_dir, recipe)
+    t = time.time()
+    if args.jobs == 1 or len(jobs) < 2:
+        results = (run_job(j) for j in jobs)
+        pool = None
+    else:
+        pool = Pool(args.jobs if args.jobs > 0 else None, init_worker, (args.log, args.cache_dir, args.cache_size))
+        results = pool.imap_unordered(run_job, jobs)
+
+    failed = 0
+    trace_stats = {}
+    job_profiles = {}
+    for src, dst, dt, stats, err, measured in results:
+        job_profiles[src] = measured["profile"]
+        if measured["trace"] != None:
+            for name, (calls, total) in measured["trace"].items():
+                s = trace_stats.setdefault(name, [0, 0.0])
+                s[0]+= calls
+                s[1]+= total
+        if err != None:
+            failed+= 1
+            print("FAIL %s: %s (%.2fs)" % (src, err, dt))
+        else:
+            print("ok   %s -> %s: %i operations, %i lines (%.2fs)" % (src, dst, stats[0], stats[1], dt))
+        sys.stdout.flush()
+    if pool != None:
+        pool.close()
+        pool.join()
+    print("%i jobs, %i failed, %.2fs" % (len(jobs), failed, time.time()-t))
+    if args.profile != None:
+        write_profile(args.profile, job_profiles)
+    if args.log:
+        util.reset_trace_stats()
+        util.merge_trace_stats(trace_stats)
+        for l in util.trace_report():
+            debug("  %s", l)
+    return 1 if failed > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(run())
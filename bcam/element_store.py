@@ -0,0 +1,550 @@
+from __future__ import absolute_import, division, print_function
+
+import base64
+import math
+import weakref
+import zlib
+import numpy as np
+
+from bcam import elements
+from bcam.calc_utils import (AABB, LineUtils, ArcUtils, arc_sweeps,
+                             linearize_segments)
+from bcam.tool_operation import TOEnum
+from bcam import profiling
+
+from logging import debug, info, warning, error, critical
+from bcam.util import dbgfname
+
+
+class EKind(object):
+    line = 0
+    arc = 1
+    circle = 2
+    point = 3
+
+kinds = {"ELine": EKind.line,
+         "EArc": EKind.arc,
+         "ECircle": EKind.circle,
+         "EPoint": EKind.point}
+
+
+class ElementStore(object):
+    """Columnar storage of path elements.
+
+    Every element is a row of NumPy columns (kind, start, end, center,
+    radius, angles, flags, color and line type), elements of a path are a
+    sequence of row indices.  Rows never move, so a sequence of indices
+    stays valid for as long as it lives and paths share rows instead of
+    copying them.  Rows no sequence and no view refers to any more are
+    reused, see collect.  Element objects are flyweight views of a row,
+    created on access and kept for as long as anybody holds them, so the
+    same row always gives the same object.  Every change bumps version,
+    selection changes bump selection_version, whoever keeps something
+    derived from the rows can tell it's stale.  The version the geometry
+    of each row last changed in is kept in changed, so a copy of some
+    rows can tell it's stale without comparing them.
+
+    """
+    def __init__(self, capacity=64):
+        self.n = 0
+        self.version = 0
+        self.selection_version = 0
+        self.colors = [None]
+        self.lts = [None]
+        self.__color_index = {}
+        self.__views = weakref.WeakValueDictionary()
+        self.__buffers = weakref.WeakSet()
+        self.free = []
+        self.__alloc(capacity)
+
+    def __alloc(self, capacity):
+        old = None
+        if self.n > 0:
+            old = (self.kind, self.start, self.end, self.center, self.radius,
+                   self.startangle, self.endangle, self.turnaround,
+                   self.selected, self.color, self.lt, self.changed)
+        self.kind = np.zeros(capacity, np.int8)
+        self.start = np.zeros((capacity, 2))
+        self.end = np.zeros((capacity, 2))
+        self.center = np.zeros((capacity, 2))
+        self.radius = np.zeros(capacity)
+        self.startangle = np.zeros(capacity)
+        self.endangle = np.zeros(capacity)
+        self.turnaround = np.zeros(capacity, bool)
+        self.selected = np.zeros(capacity, bool)
+        self.color = np.zeros(capacity, np.int32)
+        self.lt = np.zeros(capacity, np.int16)
+        self.changed = np.zeros(capacity, np.int64)
+        if old != None:
+            new = (self.kind, self.start, self.end, self.center, self.radius,
+                   self.startangle, self.endangle, self.turnaround,
+                   self.selected, self.color, self.lt, self.changed)
+            for o, c in zip(old, new):
+                c[:self.n] = o[:self.n]
+
+    def __len__(self):
+        return self.n
+
+    def nbytes(self):
+        columns = (self.kind, self.start, self.end, self.center, self.radius,
+                   self.startangle, self.endangle, self.turnaround,
+                   self.selected, self.color, self.lt)
+        return sum(c[:self.n].nbytes for c in columns)
+
+    def __mk_color_index(self, color):
+        if color == None:
+            return 0
+        key = tuple(color)
+        i = self.__color_index.get(key)
+        if i == None:
+            i = len(self.colors)
+            self.colors.append(key)
+            self.__color_index[key] = i
+        return i
+
+    def __mk_lt_index(self, lt):
+        for i, l in enumerate(self.lts):
+            if l is lt:
+                return i
+        self.lts.append(lt)
+        return len(self.lts)-1
+
+    def touch(self, rows):
+        """Bumps version, marking the geometry of rows as changed in it."""
+        self.version+= 1
+        self.changed[rows] = self.version
+
+    def buffer(self, capacity):
+        """A new IndexBuffer, whose rows are kept for as long as it lives."""
+        buf = IndexBuffer(capacity)
+        self.__buffers.add(buf)
+        return buf
+
+    def collect(self):
+        """Frees the rows no index buffer and no view refers to.
+
+        Returns the number of free rows.
+
+        """
+        used = np.zeros(self.n, bool)
+        for buf in list(self.__buffers):
+            used[buf.array[:buf.used]] = True
+        used[list(self.__views.keys())] = True
+        # lowest rows are reused first
+        self.free = np.nonzero(~used)[0][::-1].tolist()
+        profiling.count("element store rows freed", len(self.free))
+        return len(self.free)
+
+    def reserve(self, count):
+        """Makes room for count more rows, reusing freed ones if enough are."""
+        if len(self.free)+len(self.kind)-self.n >= count:
+            return
+        self.collect()
+        needed = self.n+count-len(self.free)
+        if needed > len(self.kind):
+            self.__alloc(max(needed, len(self.kind)*2))
+
+    def add(self, e):
+        """Copies a standalone element into a free row, returns its index.
+
+        Call reserve first, rows aren't collected here, since rows added
+        for a sequence that isn't built yet would look unused.
+
+        """
+        if len(self.free) > 0:
+            i = self.free.pop()
+        else:
+            if self.n == len(self.kind):
+                self.__alloc(len(self.kind)*2)
+            i = self.n
+            self.n+= 1
+        kind = kinds[type(e).__name__]
+        self.kind[i] = kind
+        if kind == EKind.point:
+            self.center[i] = e.center[:2]
+            self.start[i] = e.center[:2]
+            self.end[i] = e.center[:2]
+        else:
+            self.start[i] = e.start[:2]
+            self.end[i] = e.end[:2]
+        if kind == EKind.arc or kind == EKind.circle:
+            self.center[i] = e.center[:2]
+            self.radius[i] = e.radius
+        if kind == EKind.arc:
+            self.startangle[i] = e.startangle
+            self.endangle[i] = e.endangle
+            self.turnaround[i] = e.is_turnaround
+        self.selected[i] = e.selected
+        self.color[i] = self.__mk_color_index(e.color)
+        self.lt[i] = self.__mk_lt_index(e.lt)
+        self.touch(i)
+        return i
+
+    def index_of(self, e):
+        if getattr(e, "_store", None) is self:
+            return e._i
+        return self.add(e)
+
+    def view(self, i):
+        v = self.__views.get(i)
+        if v == None:
+            v = object.__new__(view_classes[self.kind[i]])
+            v._store = self
+            v._i = i
+            self.__views[i] = v
+        return v
+
+    def seq(self, elements):
+        """Returns elements as an ElementSeq of this store.
+
+        Views of this store keep their rows, anything else is copied in.
+
+        """
+        if isinstance(elements, ElementSeq) and elements.store is self:
+            return elements
+        return ElementSeq(self).plus(elements)
+
+
+# Columns rows can be edited in place through, everything else of a row is
+# fixed once it's added or only used for display (selected).
+geometry_columns = ("start", "end", "center", "radius", "startangle", "endangle", "turnaround")
+
+class RowSnapshot(object):
+    """Copy of the geometry of some rows of a store, to put back later."""
+    def __init__(self, store, rows):
+        self.store = store
+        self.rows = np.unique(rows)
+        self.version = store.version
+        self.columns = [getattr(store, c)[self.rows].copy() for c in geometry_columns]
+
+    def matches(self):
+        s = self.store
+        if s.version == self.version:
+            return True
+        # only rows changed since the copy was checked can differ from it
+        dirty = np.nonzero(s.changed[self.rows] > self.version)[0]
+        if len(dirty) > 0:
+            profiling.count("snapshot rows compared", len(dirty))
+            rows = self.rows[dirty]
+            for c, v in zip(geometry_columns, self.columns):
+                if not np.array_equal(getattr(s, c)[rows], v[dirty]):
+                    return False
+        self.version = s.version
+        return True
+
+    def restore(self):
+        for c, v in zip(geometry_columns, self.columns):
+            getattr(self.store, c)[self.rows] = v
+        self.store.touch(self.rows)
+        self.version = self.store.version
+
+def snapshot_rows(v):
+    """RowSnapshots of the store rows a sequence or a list of views refers to."""
+    if isinstance(v, ElementSeq):
+        return [RowSnapshot(v.store, v.indices)]
+    rows = {}
+    for e in v:
+        store = getattr(e, "_store", None)
+        if store != None:
+            rows.setdefault(id(store), (store, []))[1].append(e._i)
+    return [RowSnapshot(store, idx) for store, idx in rows.values()]
+
+
+class IndexBuffer(object):
+    def __init__(self, capacity):
+        self.array = np.zeros(capacity, np.int64)
+        self.used = 0
+
+
+class ElementSeq(object):
+    """Immutable sequence of ElementStore rows, the elements of a path.
+
+    Appending returns a new sequence, which shares the index buffer with
+    the old one whenever the old one was its last user, so building a path
+    element by element costs amortized constant time.
+
+    """
+    def __init__(self, store, buf=None, n=0):
+        self.store = store
+        self.__buf = buf if buf != None else store.buffer(0)
+        self.__n = n
+
+    @property
+    def indices(self):
+        return self.__buf.array[:self.__n]
+
+    def plus(self, elements):
+        elements = list(elements)
+        store = self.store
+        store.reserve(len([e for e in elements if getattr(e, "_store", None) is not store]))
+        idx = [store.index_of(e) for e in elements]
+        n = self.__n+len(idx)
+        buf = self.__buf
+        if buf.used != self.__n or n > len(buf.array):
+            buf = store.buffer(max(n*2, 16))
+            buf.array[:self.__n] = self.indices
+        buf.array[self.__n:n] = idx
+        buf.used = n
+        return ElementSeq(self.store, buf, n)
+
+    def without(self, elements):
+        drop = [e._i for e in elements if getattr(e, "_store", None) is self.store]
+        return self.__from_indices(self.indices[~np.isin(self.indices, drop)])
+
+    def __from_indices(self, idx):
+        buf = self.store.buffer(len(idx))
+        buf.array[:] = idx
+        buf.used = len(idx)
+        return ElementSeq(self.store, buf, len(idx))
+
+    def __len__(self):
+        return self.__n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.__from_indices(self.indices[i])
+        return self.store.view(int(self.indices[i]))
+
+    def __iter__(self):
+        view = self.store.view
+        for i in self.indices.tolist():
+            yield view(i)
+
+    def __contains__(self, e):
+        if getattr(e, "_store", None) is not self.store:
+            return False
+        return bool(np.any(self.indices == e._i))
+
+    def __eq__(self, other):
+        if isinstance(other, ElementSeq) and other.store is self.store:
+            return np.array_equal(self.indices, other.indices)
+        if not isinstance(other, (ElementSeq, list, tuple)):
+            return False
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return str(list(self))
+
+    def aabbs(self):
+        """Returns bounding boxes of all elements as (left, bottom, right, top) rows."""
+        s = self.store
+        idx = self.indices
+        kind = s.kind[idx]
+        lo = np.minimum(s.start[idx], s.end[idx])
+        hi = np.maximum(s.start[idx], s.end[idx])
+        r = s.radius[idx][:, None]
+        c = s.center[idx]
+
+        round_ = (kind == EKind.circle)
+        lo[round_] = (c-r)[round_]
+        hi[round_] = (c+r)[round_]
+        dot = (kind == EKind.point)
+        lo[dot] = c[dot]-1
+        hi[dot] = c[dot]+1
+
+        # arcs reach further than their ends where they cross an axis
+        arc = np.nonzero(kind == EKind.arc)[0]
+        if len(arc) > 0:
+            sa = s.startangle[idx[arc]]
+            sweep = (s.endangle[idx[arc]]-sa)%(2*math.pi)
+            for k, (dx, dy) in enumerate([(1, 0), (0, 1), (-1, 0), (0, -1)]):
+                crosses = (k*math.pi/2-sa)%(2*math.pi) <= sweep
+                ext = c[arc]+r[arc]*[dx, dy]
+                sel = arc[crosses]
+                lo[sel] = np.minimum(lo[sel], ext[crosses])
+                hi[sel] = np.maximum(hi[sel], ext[crosses])
+        return np.hstack((lo, hi))
+
+    def get_aabb(self):
+        if self.__n == 0:
+            return None
+        b = self.aabbs()
+        return AABB(b[:, 0].min(), b[:, 1].min(), b[:, 2].max(), b[:, 3].max())
+
+    def transform(self, offset=None, scale=None, rotation=None):
+        """Rotates (degrees), scales and then moves the elements in place."""
+        s = self.store
+        idx = np.unique(self.indices)
+        s.touch(idx)
+        pts = [s.start, s.end, s.center]
+        if rotation != None and rotation != 0:
+            a = math.radians(rotation)
+            m = np.array([[math.cos(a), math.sin(a)], [-math.sin(a), math.cos(a)]])
+            for p in pts:
+                p[idx] = p[idx].dot(m)
+            s.startangle[idx] += a
+            s.endangle[idx] += a
+        if scale != None:
+            for p in pts:
+                p[idx] *= scale[:2]
+            s.radius[idx] *= scale[0]
+        if offset != None:
+            for p in pts:
+                p[idx] += offset[:2]
+
+    def linearize_to_segments(self, tolerance):
+        """Vectorized linearize_to_segments over the store's columns."""
+        s = self.store
+        idx = self.indices[s.kind[self.indices] != EKind.point]
+        kind = s.kind[idx]
+        circle = (kind == EKind.circle)
+        sweeps = arc_sweeps(s.startangle[idx], s.endangle[idx], s.turnaround[idx])
+        sweeps[circle] = math.pi*2
+        startangles = np.where(circle, 0.0, s.startangle[idx])
+        return linearize_segments(s.start[idx], s.end[idx], kind != EKind.line,
+                                  s.center[idx], s.radius[idx], startangles,
+                                  sweeps, tolerance)[0]
+
+
+def pt_column(name):
+    def get(self):
+        pt = getattr(self._store, name)[self._i]
+        return (float(pt[0]), float(pt[1]))
+    def set(self, pt):
+        getattr(self._store, name)[self._i] = pt[:2]
+        self._store.touch(self._i)
+    return property(get, set)
+
+def float_column(name):
+    def get(self):
+        return float(getattr(self._store, name)[self._i])
+    def set(self, v):
+        getattr(self._store, name)[self._i] = v
+        self._store.touch(self._i)
+    return property(get, set)
+
+def bool_column(name, counter="version"):
+    def get(self):
+        return bool(getattr(self._store, name)[self._i])
+    def set(self, v):
+        getattr(self._store, name)[self._i] = v
+        if counter == "version":
+            self._store.touch(self._i)
+        else:
+            setattr(self._store, counter, getattr(self._store, counter)+1)
+    return property(get, set)
+
+def get_color(self):
+    return self._store.colors[self._store.color[self._i]]
+
+def get_lt(self):
+    return self._store.lts[self._store.lt[self._i]]
+
+
+class ElementView(object):
+    """Flyweight element backed by a row of an ElementStore."""
+    __slots__ = ()
+    selected = bool_column("selected", "selection_version")
+    color = property(get_color)
+    lt = property(get_lt)
+
+    def detach(self):
+        """Returns a standalone copy of the element."""
+        return mk_element(type(self).__name__, self.serialize(), self.lt)
+
+    def __reduce_ex__(self, protocol):
+        # views travel to worker processes as standalone elements
+        return (mk_element, (type(self).__name__, self.serialize(), self.lt))
+
+def mk_element(name, data, lt):
+    return getattr(elements, name)(data=data, lt=lt)
+
+# Packed elements are rows of kind, start, end, center, radius, angles,
+# turnaround and color, NaN color for elements without one.
+packed_columns = 14
+
+def encode_elements(seq):
+    """Packs elements into a compact ASCII blob, for project files."""
+    rows = np.zeros((len(seq), packed_columns), dtype="<f8")
+    for i, e in enumerate(seq):
+        name = type(e).__name__
+        row = rows[i]
+        row[0] = kinds[name]
+        if name == "EPoint":
+            row[5:7] = e.center[:2]
+        else:
+            row[1:3] = e.start[:2]
+            row[3:5] = e.end[:2]
+        if name in ("EArc", "ECircle"):
+            row[5:7] = e.center[:2]
+            row[7] = e.radius
+        if name == "EArc":
+            row[8] = e.startangle
+            row[9] = e.endangle
+            row[10] = e.is_turnaround
+        row[11:14] = e.color if e.color != None else np.nan
+    return base64.b64encode(zlib.compress(rows.tobytes())).decode("ascii")
+
+def decode_elements(blob, lt):
+    """Fresh elements with line type lt out of an encode_elements blob."""
+    rows = np.frombuffer(zlib.decompress(base64.b64decode(blob)), dtype="<f8")
+    out = []
+    for row in rows.reshape(-1, packed_columns).tolist():
+        kind = int(row[0])
+        color = None if math.isnan(row[11]) else row[11:14]
+        if kind == EKind.line:
+            e = elements.ELine(tuple(row[1:3]), tuple(row[3:5]), lt, color)
+        elif kind == EKind.arc:
+            e = elements.EArc(lt=lt, data={"center": tuple(row[5:7]), "radius": row[7],
+                                           "startangle": row[8], "endangle": row[9],
+                                           "turnaround": bool(row[10]), "color": color})
+            # exact ends keep chains connected
+            e.start = tuple(row[1:3])
+            e.end = tuple(row[3:5])
+        elif kind == EKind.circle:
+            e = elements.ECircle(lt=lt, data={"center": tuple(row[5:7]), "radius": row[7], "color": color})
+        else:
+            e = elements.EPoint(tuple(row[5:7]), lt, color)
+        out.append(e)
+    return out
+
+# The views carry the names of the element classes they stand for, element
+# types are told apart by name all over the code.
+
+class ELine(ElementView, elements.ELine):
+    __slots__ = ("_store", "_i")
+    start = pt_column("start")
+    end = pt_column("end")
+
+    def get_normalized_end_normal(self):
+        return LineUtils(self.start, self.end).get_normalized_end_normal()
+
+    def get_normalized_start_normal(self):
+        return LineUtils(self.start, self.end).get_normalized_start_normal()
+
+class EArc(ElementView, elements.EArc):
+    __slots__ = ("_store", "_i")
+    start = pt_column("start")
+    end = pt_column("end")
+    center = pt_column("center")
+    radius = float_column("radius")
+    startangle = float_column("startangle")
+    endangle = float_column("endangle")
+    is_turnaround = bool_column("turnaround")
+
+    def get_normalized_end_normal(self):
+        return ArcUtils(self.center, self.radius, self.startangle, self.endangle, self.is_turnaround).get_normalized_end_normal()
+
+    def get_normalized_start_normal(self):
+        return ArcUtils(self.center, self.radius, self.startangle, self.endangle, self.is_turnaround).get_normalized_start_normal()
+
+class ECircle(ElementView, elements.ECircle):
+    __slots__ = ("_store", "_i")
+    start = pt_column("start")
+    end = pt_column("end")
+    center = pt_column("center")
+    radius = float_column("radius")
+
+class EPoint(ElementView, elements.EPoint):
+    __slots__ = ("_store", "_i")
+    center = pt_column("center")
+
+view_classes = {EKind.line: ELine,
+                EKind.arc: EArc,
+                EKind.circle: ECircle,
+                EKind.point: EPoint}
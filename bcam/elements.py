@@ -1,8 +1,10 @@
 from __future__ import absolute_import, division, print_function
 
 import math
+import numpy as np
 from bcam.calc_utils import (AABB, CircleUtils, LineUtils, ArcUtils, PointUtils,
-                             vect_len, mk_vect)
+                             vect_len, mk_vect, arc_sweeps, linearize_arcs,
+                             linearize_segments)
 from bcam.tool_operation import TOEnum
 
 from logging import debug, info, warning, error, critical
@@ -11,22 +13,28 @@ from bcam.util import dbgfname
 
 import json
 
+class Capabilities(dict):
+    """Read-only table of the tool operations an element class supports.
+
+    Every element class has one table shared by all of its instances.
+
+    """
+    def __init__(self, *supported):
+        super(Capabilities, self).__init__((op, op in supported) for op in (TOEnum.drill, TOEnum.exact_follow, TOEnum.offset_follow, TOEnum.pocket))
+
+    def __readonly(self, *args, **kwargs):
+        raise TypeError("element capabilities are shared by the whole class")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __readonly
+
 class Element(object):
+    __slots__ = ("selected", "lt", "color", "__weakref__")
+    operations = Capabilities()
+    joinable = False
+
     def __init__(self, lt):
         self.selected = False
         self.lt = lt
-        self.operations = {TOEnum.drill: False,
-                           TOEnum.exact_follow: False,
-                           TOEnum.offset_follow: False}
-
-    def draw_element(self, ctx):
-        pass
-
-    def draw_first(self, ctx):
-        pass
-
-    def draw(self, ctx):
-        pass
 
     def distance_to_pt(self, pt):
         return 1000
@@ -43,9 +51,6 @@ class Element(object):
     def deserialize(self, data):
         pass
 
-    def set_color(self, ctx):
-        ctx.set_source_rgb(self.color[0], self.color[1], self.color[2])
-
     def set_selected(self):
         self.selected = True
 
@@ -56,15 +61,6 @@ class Element(object):
         self.selected = not self.selected
         return self.selected
 
-    def set_lt(self, ctx):
-        if self.lt != None:
-            if self.selected:
-                self.lt.set_selected_lt(ctx)
-            else:
-                self.lt.set_lt(ctx)
-                self.set_color(ctx)
-                
-
     def get_normalized_end_normal(self):
         return None
 
@@ -72,6 +68,10 @@ class Element(object):
         return None
 
 class ELine(Element):
+    __slots__ = ("start", "end", "start_normal", "end_normal")
+    operations = Capabilities(TOEnum.exact_follow, TOEnum.offset_follow)
+    joinable = True
+
     def __init__(self, start=None, end=None, lt=None, color=None, data=None):
         super(ELine, self).__init__(lt)
         if data == None:
@@ -80,9 +80,6 @@ class ELine(Element):
             self.color = color
         else:
             self.deserialize(data)
-        self.joinable = True
-        self.operations[TOEnum.exact_follow] = True
-        self.operations[TOEnum.offset_follow] = True
         self.start_normal = None
         self.end_normal = None
 
@@ -94,19 +91,6 @@ class ELine(Element):
         self.end = data["end"]
         self.color = data["color"]
 
-    def draw_first(self, ctx):
-        ctx.move_to(self.start[0], self.start[1])
-        ctx.line_to(self.end[0], self.end[1])
-
-    def draw_element(self, ctx):
-        ctx.move_to(self.start[0], self.start[1])
-        ctx.line_to(self.end[0], self.end[1])
-    
-    def draw(self, ctx):
-        self.set_lt(ctx)
-        self.draw_first(ctx)
-        ctx.stroke()
-
     def distance_to_pt(self, pt):
         lu = LineUtils(self.start, self.end)
         return lu.distance_to_pt(pt)
@@ -137,6 +121,11 @@ class ELine(Element):
         return "<ELine ("+str(self.start)+", "+str(self.end)+")>\r\n"
 
 class EArc(Element):
+    __slots__ = ("start", "end", "center", "radius", "startangle", "endangle",
+                 "is_turnaround", "start_normal", "end_normal")
+    operations = Capabilities(TOEnum.drill, TOEnum.exact_follow, TOEnum.offset_follow)
+    joinable = True
+
     def __init__(self, center=None, radius=None, startangle=None, endangle=None, lt=None, start=None, end=None, turnaround=False, color=None, data=None):
         super(EArc, self).__init__(lt)
         if data == None:
@@ -148,39 +137,21 @@ class EArc(Element):
                 self.init_from_angles(radius, startangle, endangle, center)
         else:
             self.deserialize(data)
-
-        self.joinable = True
-        self.operations[TOEnum.drill] = True
-        self.operations[TOEnum.exact_follow] = True
-        self.operations[TOEnum.offset_follow] = True
         self.start_normal = None
         self.end_normal = None
 
-    def to_line_sequence(self, precision):
-        dbgfname()
-        sa = self.startangle
-        ea = self.endangle
-        if sa > ea:
-            ea+=math.pi*2
-        da = (ea - sa)
-
-        n_steps = int(da/precision)
-        s_pt = (self.center[0]+math.cos(sa)*self.radius, self.center[1]+math.sin(sa)*self.radius)
-        debug("  splitting arc, start angle: "+str(sa)+" start_pt: "+str(s_pt))
-
-        converted_elements = []
-
-        for i in range(1,n_steps):
-            a = sa+i*0.1
-            e_pt = (self.center[0]+math.cos(a)*self.radius, self.center[1]+math.sin(a)*self.radius)
-            ne = ELine(s_pt, e_pt, self.lt, self.color)
-            debug("  angle: "+str(a)+" line: "+str(s_pt)+" "+str(e_pt))
-            s_pt = e_pt
-            converted_elements.append(ne)
-        e_pt = self.end
-        ne = ELine(s_pt, e_pt, self.lt, self.color)
-        converted_elements.append(ne)
-        return converted_elements
+    def get_sweep(self):
+        return float(arc_sweeps(self.startangle, self.endangle, self.is_turnaround))
+
+    def to_polyline(self, tolerance):
+        """Returns vertices of chords staying within tolerance (mm) of the arc."""
+        pts, bounds = linearize_arcs(self.center[:2], self.radius, self.startangle, self.get_sweep(), tolerance)
+        pts[0] = self.start[:2]
+        pts[-1] = self.end[:2]
+        return pts
+
+    def to_line_sequence(self, tolerance):
+        return polyline_to_lines(self.to_polyline(tolerance), self.lt, self.color)
 
     def init_from_pt(self, start, end, center):
         self.center = center
@@ -207,25 +178,11 @@ class EArc(Element):
         self.is_turnaround = data["turnaround"]
         self.color = data["color"]
 
-    def draw_element(self, ctx):
-        if self.is_turnaround:
-            ctx.arc(self.center[0], self.center[1], self.radius, self.endangle, self.startangle)
-        else:
-            ctx.arc(self.center[0], self.center[1], self.radius, self.startangle, self.endangle)
-    
-    def draw(self, ctx):
-        self.set_lt(ctx)
-        self.draw_element(ctx)
-        ctx.stroke()
-
-    def draw_first(self, ctx):
-        self.draw_element(ctx)
-
     def turnaround(self):
         debug("In EArc.turnaround")
-        debug("  arc turnaround, start: "+str(self.start)+" end: "+str(self.end))
+        debug("  arc turnaround, start: %s end: %s", self.start, self.end)
         arc = EArc(self.center, self.radius, start = self.end, end = self.start, lt = self.lt, turnaround = not self.is_turnaround)
-        debug("  new arc, start: "+str(arc.start)+" end: "+str(arc.end))
+        debug("  new arc, start: %s end: %s", arc.start, arc.end)
         return arc
 
     def distance_to_pt(self, pt):
@@ -257,6 +214,9 @@ class EArc(Element):
         return "<EArc ("+str(self.start)+", "+str(self.end)+", ta: "+str(self.is_turnaround)+")>\r\n"
 
 class ECircle(Element):
+    __slots__ = ("start", "end", "center", "radius")
+    operations = Capabilities(TOEnum.drill)
+
     def __init__(self, center=None, radius=None, lt=None, color=None, data=None):
         if data == None:
             self.center = center
@@ -266,8 +226,6 @@ class ECircle(Element):
             self.deserialize(data)
 
         super(ECircle, self).__init__(lt)
-        self.joinable = False
-        self.operations[TOEnum.drill] = True
         self.start = [self.center[0]+self.radius, self.center[1]]
         self.end = [self.center[0]+self.radius, self.center[1]]
 
@@ -280,40 +238,15 @@ class ECircle(Element):
         self.center = data["center"]
         self.color = data["color"]
 
-    def draw_element(self, ctx):
-        ctx.arc(self.center[0], self.center[1], self.radius, 0, math.pi*2)
+    def to_polyline(self, tolerance):
+        """Returns vertices of a closed chord polyline within tolerance (mm)."""
+        pts, bounds = linearize_arcs(self.center[:2], self.radius, 0.0, math.pi*2, tolerance)
+        pts[0] = self.start[:2]
+        pts[-1] = self.end[:2]
+        return pts
 
-    def draw_first(self, ctx):
-        self.draw_element(ctx)
-        
-    def draw(self, ctx):
-        self.set_lt(ctx)
-        self.draw_element(ctx)
-        ctx.stroke()
-
-    def to_line_sequence(self, precision):
-        dbgfname()
-        sa = 0.0
-        ea = math.pi*2
-        da = (ea - sa)
-
-        n_steps = int(da/precision)
-        s_pt = (self.center[0]+math.cos(sa)*self.radius, self.center[1]+math.sin(sa)*self.radius)
-        debug("  splitting arc, start angle: "+str(sa)+" start_pt: "+str(s_pt))
-
-        converted_elements = []
-
-        for i in range(1,n_steps):
-            a = sa+i*0.1
-            e_pt = (self.center[0]+math.cos(a)*self.radius, self.center[1]+math.sin(a)*self.radius)
-            ne = ELine(s_pt, e_pt, self.lt, self.color)
-            debug("  angle: "+str(a)+" line: "+str(s_pt)+" "+str(e_pt))
-            s_pt = e_pt
-            converted_elements.append(ne)
-        e_pt = self.end
-        ne = ELine(s_pt, e_pt, self.lt, self.color)
-        converted_elements.append(ne)
-        return converted_elements
+    def to_line_sequence(self, tolerance):
+        return polyline_to_lines(self.to_polyline(tolerance), self.lt, self.color)
 
     def distance_to_pt(self, pt):
         cu = CircleUtils(self.center, self.radius)
@@ -327,6 +260,9 @@ class ECircle(Element):
         return "<ECircle (center: "+str(self.center)+", r: "+str(self.radius)+")>\r\n"
 
 class EPoint(Element):
+    __slots__ = ("center",)
+    operations = Capabilities(TOEnum.drill)
+
     def __init__(self, center=None, lt=None, color=None, data=None):
         if data == None:
             self.center = center
@@ -335,8 +271,6 @@ class EPoint(Element):
             self.deserialize(data)
 
         super(EPoint, self).__init__(lt)
-        self.joinable = False
-        self.operations[TOEnum.drill] = True
 
     def serialize(self):
         return {'type': 'epoint', 'center': self.center, 'color': self.color}
@@ -345,17 +279,6 @@ class EPoint(Element):
         self.center = data["center"]
         self.color = data["color"]
 
-    def draw_element(self, ctx):
-        ctx.rectangle(self.center[0]-0.1, self.center[1]-0.1, 0.2, 0.2)
-
-    def draw_first(self, ctx):
-        self.draw_element(ctx)
-        
-    def draw(self, ctx):
-        self.set_lt(ctx)
-        self.draw_element(ctx)
-        ctx.stroke()
-
     def distance_to_pt(self, pt):
         pu = PointUtils(self.center)
         return pu.distance_to_pt(pt)
@@ -366,3 +289,58 @@ class EPoint(Element):
         
     def __repr__(self):
         return "<EPoint (center: "+str(self.center)+")>\r\n"
+
+def polyline_to_lines(pts, lt=None, color=None):
+    pts = [tuple(p) for p in pts.tolist()]
+    return [ELine(s, e, lt, color) for s, e in zip(pts, pts[1:])]
+
+def linearize_elements(elements, tolerance):
+    """Converts arcs and circles of an element sequence into lines.
+
+    Chords stay within tolerance (mm) of the arcs they replace.
+
+    """
+    linearized = []
+    for e in elements:
+        if type(e).__name__ == "EArc":
+            linearized += e.to_line_sequence(tolerance)
+        elif type(e).__name__ == "ECircle":
+            linearized += e.to_line_sequence(tolerance)
+        elif type(e).__name__ == "ELine":
+            linearized.append(e)
+    return linearized
+
+def linearize_to_segments(elements, tolerance):
+    """Linearizes lines, arcs and circles into an (n, 4) segment array.
+
+    All chord vertices are computed in one go, chords stay within
+    tolerance (mm) of their arcs.  Points are left out.
+
+    """
+    if hasattr(elements, "linearize_to_segments"):
+        return elements.linearize_to_segments(tolerance)
+    elements = [e for e in elements if type(e).__name__ != "EPoint"]
+    n = len(elements)
+    starts = np.empty((n, 2))
+    ends = np.empty((n, 2))
+    curved = np.zeros(n, dtype=bool)
+    centers = np.zeros((n, 2))
+    radii = np.zeros(n)
+    startangles = np.zeros(n)
+    sweeps = np.zeros(n)
+    for i, e in enumerate(elements):
+        starts[i] = e.start[:2]
+        ends[i] = e.end[:2]
+        name = type(e).__name__
+        if name == "EArc":
+            curved[i] = True
+            centers[i] = e.center[:2]
+            radii[i] = e.radius
+            startangles[i] = e.startangle
+            sweeps[i] = e.get_sweep()
+        elif name == "ECircle":
+            curved[i] = True
+            centers[i] = e.center[:2]
+            radii[i] = e.radius
+            sweeps[i] = math.pi*2
+    return linearize_segments(starts, ends, curved, centers, radii, startangles, sweeps, tolerance)[0]
@@ -13,10 +13,14 @@ from bcam.tool_op_drill import TODrill
 from bcam.tool_op_exact_follow import TOExactFollow
 from bcam.tool_op_offset_follow import TOOffsetFollow
 from bcam.tool_op_pocketing import TOPocketing
-from bcam.calc_utils import AABB, OverlapEnum
+from bcam.calc_utils import AABB
 from bcam.path import Path
+from bcam.selection import Selection
 from bcam.project import project
 from bcam.generalized_setting import TOSTypes
+from bcam.gcode_writer import GCodeWriter, gen_program
+from bcam.travel_optimizer import TravelOptimizer
+from bcam import profiling
 
 from logging import debug, info, warning, error, critical
 from bcam.util import dbgfname
@@ -66,17 +70,22 @@ class EVEnum(object):
     update_progress = "update_progress"
     undo_click = "undo_click"
     redo_click = "redo_click"
+    join_contours_click = "join_contours_click"
+    optimize_travel_click = "optimize_travel_click"
 
 class EventProcessor(object):
     ee = EVEnum()
     event_list = []
-    selected_elements = []
+    selected_elements = Selection()
     selected_path = None
     selected_tool_operation = None
     left_press_start = None
     pointer_position = None
     shift_pressed = False
     ctrl_pressed = False
+    profile_generation = 0
+    # repaint everything rather than more element areas than this
+    max_damage_areas = 64
 
     def __init__(self):
         Singleton.ee = self.ee
@@ -123,10 +132,12 @@ class EventProcessor(object):
             self.ee.update_progress: self.update_progress,
             self.ee.undo_click: self.undo_click,
             self.ee.redo_click: self.redo_click,
+            self.ee.join_contours_click: self.join_contours_click,
+            self.ee.optimize_travel_click: self.optimize_travel_click,
         }
 
     def reset(self):
-        self.selected_elements = []
+        self.selected_elements = Selection()
         self.selected_path = None
         self.selected_tool_operation = None
         self.left_press_start = None
@@ -144,6 +155,9 @@ class EventProcessor(object):
                 dbgfname()
                 warning("  Unknown event:"+str(e)+" args: "+str(args))
                 warning("  Please report")
+        if profiling.generation != self.profile_generation:
+            self.profile_generation = profiling.generation
+            self.mw.profile_label.set_text(profiling.summary())
 
     def load_click(self, args):
         mimes = [("Drawings (*.dxf)", "Application/dxf", "*.dxf"),
@@ -219,7 +233,7 @@ class EventProcessor(object):
 
     def update_tool_operations_list(self, args):
         dbgfname()
-        debug("  args: "+str(args))
+        debug("  args: %s", args)
         if Singleton.state.tool_operations != None:
             self.mw.clear_list(self.mw.tp_gtklist)
             for p in Singleton.state.tool_operations:
@@ -231,7 +245,7 @@ class EventProcessor(object):
 
     def load_file(self, args):
         dbgfname()
-        debug("  load file: "+str(args))
+        debug("  load file: %s", args)
         ext = os.path.splitext(args[0])[1][1:].strip()
         if (ext == "dxf"):
             dxfloader = DXFLoader()
@@ -244,59 +258,52 @@ class EventProcessor(object):
         project.push_state(Singleton.state, "load_file")
         self.mw.widget.update()
         feedrate = Singleton.state.settings.tool.get_feedrate()
-        debug("  feedrate: "+str(feedrate))
+        debug("  feedrate: %s", feedrate)
 
     def save_file(self, args):
         dbgfname()
-        debug("  save file: "+str(args))
+        debug("  save file: %s", args)
         file_path = args[0]
         if os.path.splitext(file_path)[1][1:].strip() != "ngc":
             file_path+=".ngc"
-        out = ""
-        out+=Singleton.state.settings.default_pp.set_metric()
-        out+=Singleton.state.settings.default_pp.set_absolute()
-        feedrate = Singleton.state.settings.tool.get_feedrate()
-        debug("  feedrate: "+str(feedrate))
-        out+=Singleton.state.settings.default_pp.set_feedrate(feedrate)
-        out+= Singleton.state.settings.default_pp.move_to_rapid([0, 0, Singleton.state.settings.tool.default_height])
-        for p in Singleton.state.tool_operations:
-            out+=p.get_gcode()
-        out+= Singleton.state.settings.default_pp.move_to_rapid([0, 0, Singleton.state.settings.tool.default_height])
-        f = open(file_path, "w")
-        f.write(out)
-        f.close()
+        with profiling.span("save file"):
+            f = open(file_path, "w")
+            GCodeWriter(f).write_all(gen_program(Singleton.state))
+            f.close()
 
     def load_project(self, args):
         dbgfname()
-        debug("  load project: "+str(args))
+        debug("  load project: %s", args)
         project_path = args[0]
         project.load(project_path)
         self.mw.update_right_vbox()
 
     def save_project(self, args):
         dbgfname()
-        debug("  save project: "+str(args))
+        debug("  save project: %s", args)
         project_path = args[0]
         project.save(project_path)
 
     def screen_left_press(self, args):
         dbgfname()
-        debug("  press at:"+str(args))
+        debug("  press at:%s", args)
         offset = Singleton.state.get_offset()
         scale = Singleton.state.get_scale()
         cx = (args[0][0]-offset[0])/scale[0]
         cy = (args[0][1]-offset[1])/scale[1]
         self.left_press_start = (cx, cy)
         self.pointer_position = (cx, cy)
-        self.mw.widget.update()
+        self.mw.widget.update([self.select_box_area()])
 
     def screen_left_release(self, args):
         dbgfname()
-        debug("  release at: "+str(args))
+        debug("  release at: %s", args)
         offset = Singleton.state.get_offset()
         scale = Singleton.state.get_scale()
         cx = (args[0][0]-offset[0])/scale[0]
         cy = (args[0][1]-offset[1])/scale[1]
+        areas = None
+        box = self.select_box_area()
         self.pointer_position = (cx, cy)
         if (self.left_press_start!=None):
             if Singleton.state.paths == None:
@@ -306,47 +313,32 @@ class EventProcessor(object):
             # just a click
             dx = abs(cx-self.left_press_start[0])
             dy = abs(cy-self.left_press_start[1])
-            debug("  dx, dy: "+str(dx)+" "+str(dy))
+            debug("  dx, dy: %s %s", dx, dy)
             if dx<1 and dy<1:
-                for p in Singleton.state.paths:
-                    for e in p.elements:
-                        if (e.distance_to_pt((cx, cy))<1):
-                            if self.shift_pressed:
-                                if not e in self.selected_elements:
-                                    e.set_selected()
-                                    self.selected_elements.append(e)
-                            else:
-                                if e in self.selected_elements:
-                                    self.selected_elements.remove(e)
-                                    e.unset_selected()
-                                else:
-                                    self.deselect_all(None)
-                                    e.set_selected()
-                                    self.selected_elements.append(e)
+                toggled = []
+                for e in Singleton.state.get_spatial_index().near((cx, cy), 1):
+                    if self.shift_pressed:
+                        if self.selected_elements.add(e):
+                            toggled.append(e)
+                    else:
+                        if not self.selected_elements.remove(e):
+                            self.deselect_all(None)
+                            self.selected_elements.add(e)
+                        toggled.append(e)
+                # repaint the clicked elements and where the box was
+                areas = self.element_areas(toggled)
+                if areas != None:
+                    areas.append(box)
                             
             # selection with a box
             else:
-                ex = cx
-                ey = cy
-                sx = self.left_press_start[0]
-                sy = self.left_press_start[1]
-                select_aabb = AABB(sx, sy, ex, ey)
+                select_aabb = AABB(self.left_press_start[0], self.left_press_start[1], cx, cy)
                 if not self.shift_pressed:
                     self.deselect_all(None)
-                for p in Singleton.state.paths:
-                    for e in p.elements:
-                        if not e in self.selected_elements:
-                            e_aabb = e.get_aabb()
-                            if (e_aabb != None):
-                                debug("  e: "+str(e_aabb))
-                                debug("  select:"+str(select_aabb))
-                                
-                                overlap = select_aabb.aabb_in_aabb(e_aabb)
-                                debug("  overlap:"+str(overlap))
-                                if (overlap != OverlapEnum.no_overlap) and (overlap != OverlapEnum.fully_lays_inside):
-                                    e.set_selected()
-                                    self.selected_elements.append(e)
-        self.mw.widget.update()
+                for e in Singleton.state.get_spatial_index().touching_box(select_aabb.left, select_aabb.bottom,
+                                                                          select_aabb.right, select_aabb.top):
+                    self.selected_elements.add(e)
+        self.mw.widget.update(areas)
         self.left_press_start=None
         
     def pointer_motion(self, args):
@@ -354,53 +346,110 @@ class EventProcessor(object):
         scale = Singleton.state.get_scale()
         cx = (args[0][0]-offset[0])/scale[0]
         cy = (args[0][1]-offset[1])/scale[1]
+        box = self.select_box_area()
         self.pointer_position = (cx, cy)
         self.mw.cursor_pos_label.set_text("cur: %.3f:%.3f"%(cx, cy))
-        self.mw.widget.update()
+        if box != None:
+            # only the selection box changes on screen
+            self.mw.widget.update([box, self.select_box_area()])
 
     def drill_tool_click(self, args):
         dbgfname()
-        debug("  drill tool click:"+str(args))
-        debug("  "+str(self.selected_elements))
+        debug("  drill tool click:%s", args)
+        debug("  %s", self.selected_elements)
         for e in self.selected_elements:
-            debug("  thickness:"+str(Singleton.state.get_settings().get_material().get_thickness()))
+            debug("  thickness:%s", Singleton.state.get_settings().get_material().get_thickness())
             drl_op = TODrill(Singleton.state, index=len(Singleton.state.tool_operations))
             if drl_op.apply(e, Singleton.state.get_settings().get_material().get_thickness()):
                 Singleton.state.tool_operations.append(drl_op)
                 self.push_event(self.ee.update_tool_operations_list, (None))
                 project.push_state(Singleton.state, "drill_tool_click")
-        debug("  "+str(Singleton.state.tool_operations))
+        debug("  %s", Singleton.state.tool_operations)
         self.mw.widget.update()
 
     def join_elements(self, args):
         dbgfname()
         sp = Singleton.state.paths
         if self.selected_elements!=None:
-            debug("  selected: "+str(self.selected_elements))
-            p = Path(Singleton.state, self.selected_elements, "path", Singleton.state.settings.get_def_lt().name)
+            debug("  selected: %s", self.selected_elements)
+            p = Path(Singleton.state, list(self.selected_elements), "path", Singleton.state.settings.get_def_lt().name)
             connected = p.mk_connected_path()
-            debug("  connected elements: "+str(connected))
+            debug("  connected elements: %s", connected)
             if connected != None:
                 connected.name = connected.name+" "+str(len(sp))
                 self.deselect_all(None)
-                for e in connected.elements:
-                    for i, p in enumerate(sp):
-                        if e in sp[i].elements:
-                            sp[i].elements.remove(e)
+                for p in sp:
+                    p.elements = p.elements.without(connected.elements)
                 sp.append(connected)
                 self.push_event(self.ee.update_paths_list, (None))
                 #project.push_state(Singleton.state, "join_elements")
                 return connected
         return None
 
+    def join_contours_click(self, args):
+        dbgfname()
+        sp = Singleton.state.paths
+        elements = list(self.selected_elements)
+        if len(elements) == 0:
+            elements = [e for p in sp for e in p.elements]
+        if len(elements) == 0:
+            return
+        p = Path(Singleton.state, elements, "path", Singleton.state.settings.get_def_lt().name)
+        contours = p.mk_contours()
+        debug("  contours: %s", len(contours))
+        self.deselect_all(None)
+        joined = set()
+        for c in contours:
+            joined.update(c.elements)
+        for path in sp:
+            path.elements = path.elements.without(joined)
+        Singleton.state.paths = [path for path in sp if len(path.elements)>0]
+        for c in contours:
+            c.name = c.name+" "+str(len(Singleton.state.paths))
+            Singleton.state.paths.append(c)
+        self.push_event(self.ee.update_paths_list, (None))
+        project.push_state(Singleton.state, "join_contours_click")
+        self.mw.widget.update()
+
+    def optimize_travel_click(self, args):
+        dbgfname()
+        if len(Singleton.state.tool_operations) == 0:
+            return
+        before, after = TravelOptimizer(Singleton.state).optimize()
+        info("Estimated rapid travel: %.1f mm before, %.1f mm after" % (before, after))
+        self.mw.progress_label.set_text("rapid travel: %.1f mm, was %.1f mm" % (after, before))
+        self.push_event(self.ee.update_tool_operations_list, (None))
+        project.push_state(Singleton.state, "optimize_travel_click")
+        self.mw.widget.update()
+
     def deselect_all(self, args):
-        for e in self.selected_elements:
-            e.toggle_selected()
-        self.selected_elements = []
+        areas = self.element_areas(self.selected_elements.clear())
         if (self.selected_tool_operation != None):
             self.selected_tool_operation.unset_selected()
+            areas = None
         self.selected_tool_operation = None
-        self.mw.widget.update()
+        self.mw.widget.update(areas)
+
+    def select_box_area(self):
+        """Screen area of the selection box, None when there's no box."""
+        if self.left_press_start == None:
+            return None
+        s = self.left_press_start
+        p = self.pointer_position
+        return Singleton.state.screen_area(min(s[0], p[0]), min(s[1], p[1]),
+                                           max(s[0], p[0]), max(s[1], p[1]))
+
+    def element_areas(self, elements):
+        """Screen areas of elements, None when it's cheaper to repaint everything."""
+        if len(elements) > self.max_damage_areas:
+            return None
+        areas = []
+        for e in elements:
+            box = e.get_aabb()
+            if box != None:
+                lw = max(e.lt.lw, e.lt.selected_lw) if e.lt != None else 0
+                areas.append(Singleton.state.screen_area(box.left, box.bottom, box.right, box.top, lw))
+        return areas
 
     def shift_press(self, args):
         self.shift_pressed = True
@@ -424,9 +473,7 @@ class EventProcessor(object):
                 if p.name == name:
                     self.selected_path = p
                     for e in p.elements:
-                        if not e in self.selected_elements:
-                            e.set_selected()
-                            self.selected_elements.append(e)
+                        self.selected_elements.add(e)
         self.mw.widget.update()
 
     def tool_operations_list_selection_changed(self, args):
@@ -444,9 +491,9 @@ class EventProcessor(object):
 
     def exact_follow_tool_click(self, args):
         dbgfname()
-        debug("  exact follow tool click: "+str(args))
+        debug("  exact follow tool click: %s", args)
         connected = self.join_elements(None)
-        debug("  selected path: "+str(self.selected_path))
+        debug("  selected path: %s", self.selected_path)
         if connected != None:
             path_follow_op = TOExactFollow(Singleton.state, index=len(Singleton.state.tool_operations), depth=Singleton.state.get_settings().get_material().get_thickness())
             if path_follow_op.apply(connected):
@@ -457,10 +504,10 @@ class EventProcessor(object):
 
     def offset_follow_tool_click(self, args):
         dbgfname()
-        debug("  offset follow tool click: "+str(args))
+        debug("  offset follow tool click: %s", args)
         connected = self.join_elements(None)
-        debug("  selected path: "+str(self.selected_path))
-        debug("  connected: "+str(connected))
+        debug("  selected path: %s", self.selected_path)
+        debug("  connected: %s", connected)
         if connected != None:
             path_follow_op = TOOffsetFollow(Singleton.state, index=len(Singleton.state.tool_operations), depth=Singleton.state.get_settings().get_material().get_thickness())
             if path_follow_op.apply(connected):
@@ -484,6 +531,7 @@ class EventProcessor(object):
                         Singleton.state.tool_operations.append(pocket_op)
                         project.push_state(Singleton.state, "pocket_tool_click")
                         self.push_event(self.ee.update_tool_operations_list, (None))
+                        self.mw.widget.update()
                 elif result == TOResult.repeat:
                     Singleton.state.set_operation_in_progress(pocket_op)
                     self.push_event(self.ee.update_progress, True)
@@ -492,31 +540,31 @@ class EventProcessor(object):
             op = Singleton.state.get_operation_in_progress()
             #debug("  Operation in progress: "+str(op))
             if op != None:
-                if op.apply(None) == TOResult.repeat:
+                result = op.apply(None)
+                if result == TOResult.repeat:
                     self.push_event(self.ee.update_progress, True)
                     self.push_event(self.ee.pocket_tool_click, None)
                 else:
-                    if Singleton.state.get_tool_operation_by_name(op.display_name) == None:
+                    if result == TOResult.ok and Singleton.state.get_tool_operation_by_name(op.display_name) == None:
                         Singleton.state.tool_operations.append(op)
                         project.push_state(Singleton.state, "pocket_tool_click")
                         self.push_event(self.ee.update_tool_operations_list, (None))
+                    # repaints with the new toolpath
                     self.push_event(self.ee.update_progress, False)
                     Singleton.state.unset_operation_in_progress()
-        self.mw.widget.update()
 
     def update_progress(self, args):
         if args[0] == True:
             Singleton.state.spinner_frame+=1
             Singleton.state.spinner_frame %= (len(Singleton.state.spinner)*20)
             self.mw.progress_label.set_text("progress: "+Singleton.state.spinner[int(Singleton.state.spinner_frame/20)])
-            self.mw.widget.update()
         else:
             self.mw.progress_label.set_text("No task running")
             self.mw.widget.update()
 
     def update_settings(self, args):
         dbgfname()
-        debug("  settings update: "+str(args))
+        debug("  settings update: %s", args)
         setting = args[0][0]
         if setting.type == TOSTypes.float:
             new_value = args[0][1][0].get_value()
@@ -536,7 +584,7 @@ class EventProcessor(object):
         if len(Singleton.state.tool_operations)==0:
             return
         cur_idx = Singleton.state.tool_operations.index(self.selected_tool_operation)
-        debug("  cur idx: "+str(cur_idx))
+        debug("  cur idx: %s", cur_idx)
         if cur_idx == 0:
             return
         temp = self.selected_tool_operation
@@ -553,7 +601,7 @@ class EventProcessor(object):
         if len(Singleton.state.tool_operations)==0:
             return
         cur_idx = Singleton.state.tool_operations.index(self.selected_tool_operation)
-        debug("  cur idx: "+str(cur_idx))
+        debug("  cur idx: %s", cur_idx)
         if cur_idx == len(Singleton.state.tool_operations)-1:
             return
         temp = self.selected_tool_operation
@@ -599,16 +647,16 @@ class EventProcessor(object):
 
     def hscroll(self, args):
         dbgfname()
-        debug("  hscroll: "+str(args))
-        debug("  "+str(args[0][0].get_value()))
+        debug("  hscroll: %s", args)
+        debug("  %s", args[0][0].get_value())
         offset = Singleton.state.get_base_offset()
         Singleton.state.set_base_offset((-args[0][0].get_value(), offset[1]))
         self.mw.widget.update()
 
     def vscroll(self, args):
         dbgfname()
-        debug("  vscroll: "+str(args))
-        debug("  "+str(args[0][0].get_value()))
+        debug("  vscroll: %s", args)
+        debug("  %s", args[0][0].get_value())
         offset = Singleton.state.get_base_offset()
         Singleton.state.set_base_offset((offset[0], -args[0][0].get_value()))
         self.mw.widget.update()
@@ -647,9 +695,9 @@ class EventProcessor(object):
 
     def undo_click(self, args):
         dbgfname()
-        debug("  steps("+str(len(project.steps))+") before: "+str(project.steps))
+        debug("  steps(%s) before: %s", len(project.steps), project.steps)
         project.step_back()
-        debug("  steps("+str(len(project.steps))+") after: "+str(project.steps))
+        debug("  steps(%s) after: %s", len(project.steps), project.steps)
         
         self.push_event(self.ee.update_tool_operations_list, (None))
         self.push_event(self.ee.update_paths_list, (None))
@@ -657,9 +705,9 @@ class EventProcessor(object):
 
     def redo_click(self, args):
         dbgfname()
-        debug("  steps("+str(len(project.steps))+") before: "+str(project.steps))
+        debug("  steps(%s) before: %s", len(project.steps), project.steps)
         project.step_forward()
-        debug("  steps("+str(len(project.steps))+") after: "+str(project.steps))
+        debug("  steps(%s) after: %s", len(project.steps), project.steps)
         
         self.push_event(self.ee.update_tool_operations_list, (None))
         self.push_event(self.ee.update_paths_list, (None))
@@ -0,0 +1,65 @@
+from __future__ import absolute_import, division, print_function
+
+from logging import debug, info, warning, error, critical
+from bcam.util import traced
+from bcam import profiling
+from bcam.profiling import profiled
+
+def gen_program(state):
+    pp = state.settings.default_pp
+    tool = state.settings.tool
+    pp.reset()
+    state.settings.compressor.reset(tool.compression_tolerance)
+    yield pp.set_metric()
+    yield pp.set_absolute()
+    feedrate = tool.get_feedrate()
+    debug("  feedrate: %s", feedrate)
+    yield pp.set_feedrate(feedrate)
+    yield pp.move_to_rapid([0, 0, tool.default_height])
+    for p in state.tool_operations:
+        for chunk in p.gen_gcode():
+            yield chunk
+    yield pp.move_to_rapid([0, 0, tool.default_height])
+    compressor = state.settings.compressor
+    debug("  path compression removed %s of %s blocks", compressor.get_removed(), compressor.blocks_in)
+
+class GCodeWriter(object):
+    def __init__(self, f, buffer_size=1<<16):
+        self.f = f
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.bytes_written = 0
+        self.lines_written = 0
+
+    def write(self, chunk):
+        if not chunk:
+            return
+        self.buffer.append(chunk)
+        self.buffered += len(chunk)
+        self.lines_written += chunk.count("\n")
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffered > 0:
+            self.f.write("".join(self.buffer))
+            self.bytes_written += self.buffered
+            self.buffer = []
+            self.buffered = 0
+        self.f.flush()
+
+    @traced
+    @profiled("write gcode")
+    def write_all(self, chunks):
+        first = True
+        for chunk in chunks:
+            self.write(chunk)
+            if first and self.buffered > 0:
+                # push the header out right away, the rest may take a while
+                self.flush()
+                first = False
+        self.flush()
+        profiling.count("gcode lines", self.lines_written)
+        profiling.count("gcode bytes", self.bytes_written)
+        debug("  written %s lines, %s bytes", self.lines_written, self.bytes_written)
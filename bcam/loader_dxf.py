@@ -171,14 +171,16 @@ class DXFLoader(loader.SourceLoader):
                     if b.name == block_name:
                         for e in b:
                             if self.__is_basic(e):
-                                self.__basic_el(e, tp, offset, dxf.layers, b, scale, rotation)
+                                self.__basic_el(e, tp, None, dxf.layers, b)
                             else:
-                                debug("  Unknown type: "+str(e.dxftype))
-                                debug("  "+str(e))
+                                debug("  Unknown type: %s", e.dxftype)
+                                debug("  %s", e)
+                # the whole block is placed at once, over the store's columns
+                tp.elements.transform(offset, scale, rotation)
                 paths.append(tp)
             else:
-                debug("  Unknown type: "+str(e.dxftype))
-                debug("  "+str(e))
+                debug("  Unknown type: %s", e.dxftype)
+                debug("  %s", e)
         if len(p.elements)>0:
             paths.append(p)
 
@@ -15,6 +15,8 @@ from bcam.events import EVEnum, EventProcessor, ee, ep
 from bcam.main_window import MainWindow
 from bcam.singleton import Singleton
 from bcam import project, state
+from bcam import render_cairo
+from bcam import toolpath_cache
 
 class Screen(gtk.DrawingArea):
 
@@ -23,6 +25,9 @@ class Screen(gtk.DrawingArea):
     step = 0
     event_consumers = []
     active_event_consumer = None
+    # paths and operations are repainted out of retained display lists and tiles
+    scene = render_cairo.SceneCache()
+    grid = render_cairo.GridPattern()
 
     def periodic(self):
         ep.process()
@@ -31,8 +36,13 @@ class Screen(gtk.DrawingArea):
     def save_project(self, *args):
         pass
 
-    def update(self):
-        self.queue_draw()
+    def update(self, areas=None):
+        """Repaints the screen, or just areas (x, y, width, height) of it."""
+        if areas == None:
+            self.queue_draw()
+        else:
+            for a in areas:
+                self.queue_draw_area(*a)
 
     def scroll_event(self, widget, event):
         if event.direction == gtk.gdk.SCROLL_UP:
@@ -41,12 +51,12 @@ class Screen(gtk.DrawingArea):
             ep.push_event(ee.scroll_down, (None))
     
     def button_press_event(self, widget, event):
-        debug("button press: "+ str(event.button))
+        debug("button press: %s", event.button)
         if event.button == 1:
             ep.push_event(ee.screen_left_press, (event.x, event.y))
 
     def key_press_event(self, widget, event):
-        debug("key press:" + str(event.keyval))
+        debug("key press:%s", event.keyval)
         if event.keyval == 65307: # ESC
             ep.push_event(ee.deselect_all, (None))
         elif event.keyval == 65505: # shift
@@ -74,22 +84,18 @@ class Screen(gtk.DrawingArea):
         Singleton.state.set_screen_offset((self.allocation.width//2, self.allocation.height//2))
         
         offset = Singleton.state.get_offset()
-        scale = Singleton.state.get_scale()
+        # y goes up on screen, tiles and grid take the positive scale
+        scale = Singleton.state.scale
 
-        cr_gdk = self.window.cairo_create()
-        surface = cr_gdk.get_target()
-        cr_surf = cairo.ImageSurface(cairo.FORMAT_ARGB32, self.allocation.width, self.allocation.height)
-        cr = cairo.Context(cr_surf)
+        cr = self.window.cairo_create()
         
         # Restrict Cairo to the exposed area; avoid extra work
         cr.rectangle(event.area.x, event.area.y, event.area.width, event.area.height)
         cr.clip()
 
-        cr.set_source_rgb(0.0, 0.0, 0.0)
-        cr.rectangle(0, 0, self.allocation.width, self.allocation.height)
-        cr.fill()
+        self.grid.paint(cr, (self.allocation.width, self.allocation.height), offset, scale)
 
-        # grid drawing
+        # axes
         cr.set_line_width(1.0/Singleton.state.scale[0])
         cr.translate(offset[0], offset[1])
         cr.scale(Singleton.state.scale[0], -Singleton.state.scale[1])
@@ -103,74 +109,32 @@ class Screen(gtk.DrawingArea):
         cr.stroke()
         cr.identity_matrix()
 
-        cr.set_source_rgb(1.0, 1.0, 1.0)
-        step = 1.0
-        xsteps = self.allocation.width/Singleton.state.scale[0]/step
-        ysteps = self.allocation.height/Singleton.state.scale[1]/step
-        maxsteps = max(xsteps, ysteps)
-        mins = 40
-        maxs = 80
-        if (maxsteps < mins):
-            while (maxsteps < mins):
-                if (step//10 == 0):
-                    break
-                step//=10
-                xsteps = self.allocation.width/Singleton.state.scale[0]/step
-                ysteps = self.allocation.height/Singleton.state.scale[1]/step
-                maxsteps = max(xsteps, ysteps)
-        if (maxsteps > maxs):
-            while (maxsteps > maxs):
-                step*=10
-                xsteps = self.allocation.width/Singleton.state.scale[0]/step
-                ysteps = self.allocation.height/Singleton.state.scale[1]/step
-                maxsteps = max(xsteps, ysteps)
-
-        x = (offset[0]/Singleton.state.scale[0])%(step)
-        y = (offset[1]/Singleton.state.scale[1])%(step)
-        while (x*Singleton.state.scale[0]<self.allocation.width):
-            y = (offset[1]/Singleton.state.scale[1])%(step)
-            while (y*Singleton.state.scale[1]<self.allocation.height):
-                cr.rectangle(x*Singleton.state.scale[0], y*Singleton.state.scale[1], 1, 1)
-                cr.fill()
-                y += step
-            x += step
-        
-        if Singleton.state.paths!=None:
-            cr.translate(offset[0], offset[1])
-            cr.scale(Singleton.state.scale[0], -Singleton.state.scale[1])
-            for p in Singleton.state.paths:
-                p.draw(cr)
-            cr.identity_matrix()
-
-        if Singleton.state.tool_operations!=None:
-            cr.translate(offset[0], offset[1])
-            cr.scale(Singleton.state.scale[0], -Singleton.state.scale[1])
-            for o in Singleton.state.tool_operations:
-                o.draw(cr)
-            cr.identity_matrix()
+        self.scene.draw(cr, (event.area.x, event.area.y, event.area.width, event.area.height),
+                        offset, scale, Singleton.state.paths, Singleton.state.tool_operations)
 
         # draw selection box
         if ep.left_press_start != None:
             cr.translate(offset[0], offset[1])
             cr.scale(Singleton.state.scale[0], -Singleton.state.scale[1])
-            Singleton.state.settings.select_box_lt.set_lt(cr)
+            render_cairo.set_lt(cr, Singleton.state.settings.select_box_lt)
             w = ep.pointer_position[0] - ep.left_press_start[0]
             h = ep.pointer_position[1] - ep.left_press_start[1]
             cr.rectangle(ep.left_press_start[0], ep.left_press_start[1], w, h)
             cr.fill()
             cr.identity_matrix()
 
-        cr_gdk.set_source_surface(cr_surf)
-        cr_gdk.paint()
-
 mw = None
         
 # GTK mumbo-jumbo to show the widget in a window and quit when it's closed
 def run():
-    args = {"--log": {"is_set": util.NOT_SET, "has_option": util.NO_OPTION, "option": None}}
+    args = {"--log": {"is_set": util.NOT_SET, "has_option": util.NO_OPTION, "option": None},
+            "--cache-dir": {"is_set": util.NOT_SET, "has_option": util.HAS_OPTION, "option": None}}
     util.parse_args(args)
     if args["--log"]["is_set"]:
         logging.getLogger("").setLevel(logging.DEBUG)
+        util.set_tracing(True)
+    if args["--cache-dir"]["is_set"]:
+        toolpath_cache.cache.set_directory(args["--cache-dir"]["option"])
 
     global mw, ep
     state.State()
@@ -179,6 +143,9 @@ def run():
     ep.mw = mw
     project.project.push_state(Singleton.state, "initial state")
     mw.run()
+    if util.tracing:
+        for l in util.trace_report():
+            debug("  %s", l)
 
 if __name__ == "__main__":
     run()
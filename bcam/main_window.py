@@ -69,6 +69,9 @@ class MainWindow(object):
         self.progress_label = gtk.Label("")
         self.status_hbox.pack_start(self.progress_label, expand=False, fill=False)
 
+        self.profile_label = gtk.Label("")
+        self.status_hbox.pack_start(self.profile_label, expand=False, fill=False)
+
         self.__mk_right_vbox()
         self.hbox.pack_start(self.right_vbox, expand=False, fill=False, padding=0)
         gobject.timeout_add(10, self.widget.periodic)
@@ -138,12 +141,25 @@ class MainWindow(object):
 
         sep_undo_redo = gtk.SeparatorMenuItem()
 
+        self.join_contours_item = gtk.MenuItem("Join contours")
+        key, mod = gtk.accelerator_parse("<Control>J")
+        self.join_contours_item.add_accelerator("activate", agr, key, mod, gtk.ACCEL_VISIBLE)
+
+        sep_join = gtk.SeparatorMenuItem()
+
+        self.optimize_travel_item = gtk.MenuItem("Optimize travel")
+
         self.edit_menu.append(sep_undo_redo)
         self.edit_menu.append(self.undo_item)
         self.edit_menu.append(self.redo_item)
+        self.edit_menu.append(sep_join)
+        self.edit_menu.append(self.join_contours_item)
+        self.edit_menu.append(self.optimize_travel_item)
 
         self.undo_item.connect("activate", lambda *args: ep.push_event(ee.undo_click, args))
         self.redo_item.connect("activate", lambda *args: ep.push_event(ee.redo_click, args))
+        self.join_contours_item.connect("activate", lambda *args: ep.push_event(ee.join_contours_click, args))
+        self.optimize_travel_item.connect("activate", lambda *args: ep.push_event(ee.optimize_travel_click, args))
 
     def run(self):
         self.window.show_all()
@@ -233,10 +249,10 @@ class MainWindow(object):
     def set_item_selected(self, lst, idx):
         dbgfname()
         if len(lst.children()) > idx:
-            debug("  selecting %i"%(idx,))
+            debug("  selecting %i", idx)
             lst.select_child(lst.children()[idx])
         else:
-            debug("  len(lst.children()) = %i, idx = %i"%(len(lst.children()), idx))
+            debug("  len(lst.children()) = %i, idx = %i", len(lst.children()), idx)
 
     def add_item_to_list(self, lst, label_text, event):
         check_button = gtk.CheckButton("")
@@ -294,7 +310,7 @@ class MainWindow(object):
 
     def populate_box_with_settings(self, box, settings_lst):
         if settings_lst != None:
-            debug("  "+str(settings_lst))
+            debug("  %s", settings_lst)
             for s in settings_lst:
                 dct = {}
                 if s.type == TOSTypes.float:
@@ -1,16 +1,20 @@
 from __future__ import absolute_import, division, print_function
 
 from bcam.elements import *
-from bcam.calc_utils import pt_to_pt_dist
+from bcam.calc_utils import pt_to_pt_dist, PointHash, PolygonUtils
 from bcam.tool_operation import TOEnum
 
 from logging import debug, info, warning, error, critical
-from bcam.util import dbgfname
+from bcam.util import dbgfname, traced
+from bcam.profiling import profiled
 
 
 import json
+import numpy as np
 
 class Path(Element):
+    operations = Capabilities(TOEnum.exact_follow, TOEnum.offset_follow, TOEnum.pocket)
+
     def __init__(self, state, elements=None, name=None, lt_name=None, data=None):
 
         self.state = state
@@ -22,11 +26,11 @@ class Path(Element):
             self.lt_name = lt_name
         else:
             self.deserialize(data)
-        
+        self.closed = False
+        self.parent = None
+        self.nesting = 0
+
         super(Path, self).__init__(self.state.settings.get_lt(self.lt_name))
-        self.operations[TOEnum.exact_follow] = True
-        self.operations[TOEnum.offset_follow] = True
-        self.operations[TOEnum.pocket] = True
 
 
     def serialize(self):
@@ -69,52 +73,153 @@ class Path(Element):
                 self.ordered_elements.append(EPoint(lt=lt, data=e))
 
 
+    def get_elements(self):
+        return self.__elements
+
+    def set_elements(self, elements):
+        # elements live in the state's columnar store, see element_store
+        self.__elements = self.state.element_store.seq(elements if elements != None else [])
+
+    elements = property(get_elements, set_elements)
+
     def add_element(self, e):
-        self.elements.append(e)
+        self.__elements = self.__elements.plus([e])
 
-    def __find_adjacent_element(self, current, available, direction_fwd=True):
-        min_dist = pt_to_pt_dist(available[0].start, current.end)
-        min_dist_id = 0
-        min_order = {"turnaround": False, "offset": 1}
-        for i, e in enumerate(available):
-            orders = []
-            dists = []
-            if direction_fwd:
-                dists.append(pt_to_pt_dist(e.start, current.end))
-                orders.append({"turnaround": False, "offset": 1})
-                dists.append(pt_to_pt_dist(e.end, current.end))
-                orders.append({"turnaround": True, "offset": 1})
-            else:
-                dists.append(pt_to_pt_dist(e.end, current.start))
-                orders.append({"turnaround": False, "offset": -1})
-                dists.append(pt_to_pt_dist(e.start, current.start))
-                orders.append({"turnaround": True, "offset": -1})
-            md = min(dists)
-            if md<min_dist:
-                min_dist = md
-                min_dist_id = i
-                min_order = orders[dists.index(md)]
-        return min_dist, min_dist_id, min_order
-
-    def __append_element(self, min_dist_id, min_order, available, ordered_elements, ce):
-        i = min_dist_id
-        ce.append(available[i])
+    def get_aabb(self):
+        return self.__elements.get_aabb()
+
+    def __find_adjacent_element(self, current, endpoints, direction_fwd=True):
+        # nearest endpoint wins, ties go to the earlier element and then to
+        # the element which doesn't have to be turned around
+        best = None
+        if direction_fwd:
+            pt = current.end
+        else:
+            pt = current.start
+        for d, (i, is_end) in endpoints.find(pt):
+            turnaround = (is_end if direction_fwd else not is_end)
+            candidate = (d, i, turnaround)
+            if best == None or candidate < best:
+                best = candidate
+        if best == None:
+            return None, None
+        return best[1], {"turnaround": best[2], "offset": (1 if direction_fwd else -1)}
+
+    def __append_element(self, i, min_order, available, ordered_elements, ce):
+        e = available[i]
+        ce.append(e)
         if min_order["offset"] == 1:
             if min_order["turnaround"] == False:
-                available[i].start = ordered_elements[-1].end
-                ordered_elements.append(available[i])
+                e.start = ordered_elements[-1].end
+                ordered_elements.append(e)
             else:
-                available[i].end = ordered_elements[-1].end
-                ordered_elements.append(available[i].turnaround())
+                e.end = ordered_elements[-1].end
+                ordered_elements.append(e.turnaround())
         else:
             if min_order["turnaround"] == False:
-                available[i].end = ordered_elements[0].start
-                ordered_elements.insert(0, available[i])
+                e.end = ordered_elements[0].start
+                ordered_elements.insert(0, e)
             else:
-                available[i].start = ordered_elements[0].start
-                ordered_elements.insert(0, available[i].turnaround())
-        del available[i]
-
+                e.start = ordered_elements[0].start
+                ordered_elements.insert(0, e.turnaround())
+
+    @traced
+    @profiled("connected paths")
+    def mk_connected_paths(self):
+        """Chains joinable elements into connected paths.
+
+        Element endpoints are kept in a PointHash, so every lookup for an
+        adjacent element is done in constant time.  Chains grow forward while
+        possible, then backward, and a new chain is started from the first
+        unused element whenever a chain can't be grown any further.  Closed
+        chains are marked with set_closed.
+
+        """
+        available = [e for e in self.elements if e.joinable]
+        endpoints = PointHash(0.001)
+        for i, e in enumerate(available):
+            endpoints.add(tuple(e.start), (i, False))
+            endpoints.add(tuple(e.end), (i, True))
+
+        def take(i):
+            e = available[i]
+            endpoints.remove(tuple(e.start), (i, False))
+            endpoints.remove(tuple(e.end), (i, True))
+
+        paths = []
+        used = [False]*len(available)
+        for first in range(len(available)):
+            if used[first]:
+                continue
+            take(first)
+            used[first] = True
+            ce = [available[first]] # connected elements go here
+            ordered_elements = [available[first]]
+            while True:
+                i, order = self.__find_adjacent_element(ordered_elements[-1], endpoints)
+                if i == None:
+                    i, order = self.__find_adjacent_element(ordered_elements[0], endpoints, False)
+                if i == None:
+                    break
+                take(i)
+                used[i] = True
+                self.__append_element(i, order, available, ordered_elements, ce)
+
+            name = self.name+".sub"+(str(len(paths)) if len(paths)>0 else "")
+            p = Path(self.state, ce, name, self.state.settings.get_def_lt().name)
+            p.ordered_elements = ordered_elements
+            if pt_to_pt_dist(ordered_elements[0].start, ordered_elements[-1].end)<0.001:
+                p.set_closed()
+            paths.append(p)
+        debug("  chains: %i, closed: %i", len(paths), len([p for p in paths if p.get_closed()]))
+        return paths
+
+    @traced
+    def mk_contours(self):
+        """Splits the elements into all of their contours in one pass.
+
+        Returns the chains of mk_connected_paths plus a closed contour for
+        every circle.  Closed contours lying inside other closed contours get
+        the innermost of those as parent, contours nested an odd number of
+        times are holes.
+
+        """
+        contours = self.mk_connected_paths()
+        for e in self.elements:
+            if type(e).__name__ == "ECircle":
+                p = Path(self.state, [e], self.name+".sub"+str(len(contours)), self.state.settings.get_def_lt().name)
+                p.ordered_elements = [e]
+                p.set_closed()
+                contours.append(p)
+
+        closed = [p for p in contours if p.get_closed()]
+        if len(closed)<2:
+            return contours
+        tolerance = self.state.settings.tool.tolerance
+        polygons = [PolygonUtils(linearize_to_segments(p.ordered_elements, tolerance)) for p in closed]
+        areas = [abs(pu.get_area()) for pu in polygons]
+        samples = [p.ordered_elements[0].start for p in closed]
+        # index into closed of the smallest contour around each one so far
+        parents = [None]*len(closed)
+        for i, pu in enumerate(polygons):
+            inside = pu.pts_inside(samples)
+            for j in np.nonzero(inside)[0]:
+                if j == i or areas[j] >= areas[i]:
+                    continue
+                closed[j].nesting += 1
+                if parents[j] == None or areas[i] < areas[parents[j]]:
+                    parents[j] = i
+        for p, i in zip(closed, parents):
+            if i != None:
+                p.parent = closed[i]
+        debug("  contours: %i, holes: %i", len(contours), len([p for p in contours if p.is_hole()]))
+        return contours
+
+    def get_parent(self):
+        return self.parent
+
+    def is_hole(self):
+        return self.nesting%2 == 1
 
     def mk_connected_path(self):
         dbgfname()
@@ -125,57 +230,11 @@ class Path(Element):
             p = Path(self.state, [self.elements[0]], self.name+".path", self.state.settings.get_def_lt())
             p.ordered_elements = [self.elements[0]]
             return p
-        available = self.elements[:]
-        ce = [] # connected elements go here
-
-        not_joinables = []
-        for i, e in enumerate(available):
-            if not e.joinable:
-                not_joinables.append(i)
 
-        not_joinables.reverse()
-        for nj in not_joinables:
-            del available[nj]
-
-        available_len = len(available)
-
-        if available_len==0:
+        paths = self.mk_connected_paths()
+        if len(paths)==0:
             return None
-
-        #find first joinable
-        self.order = [0]
-        ce.append(available[0])
-        ordered_elements = [available[0]]
-        del available[0]
-
-        while True:
-            if len(available)==0:
-                break
-            cont = False
-            current = (ordered_elements[-1], ordered_elements[0])
-            min_dist, min_dist_id, min_order = self.__find_adjacent_element(current[0], available)
-            if (min_dist<0.001):
-                
-                self.__append_element(min_dist_id, min_order, available, ordered_elements, ce)
-                cont = True
-            if not cont:
-                min_dist, min_dist_id, min_order = self.__find_adjacent_element(current[1], available, False)
-                if (min_dist<0.001):
-                    self.__append_element(min_dist_id, min_order, available, ordered_elements, ce)
-                    cont = True
-
-            if not cont:
-                debug("  I`ve tried hard, but still no success, so break")
-                break
-
-        if abs(ce[0].start[0]-ce[-1].end[0])<0.001 and abs(ce[0].start[1]-ce[-1].end[1])<0.001:
-            pass # have to move joined path to separate subpath
-        debug("  available len: "+str(available_len)+" len(ce): "+str(len(ce)))
-        debug("  "+str(available))
-        #if available_len == len(ce):
-        p = Path(self.state, ce, self.name+".sub", self.state.settings.get_def_lt().name)
-        p.ordered_elements = ordered_elements
-        return p
+        return paths[0]
 
     def set_closed(self):
         self.closed = True
@@ -186,11 +245,5 @@ class Path(Element):
     def get_ordered_elements(self):
         return self.ordered_elements
 
-    def draw(self, ctx):
-        if self.display:
-            for e in self.elements:
-                e.draw(ctx)
-            ctx.stroke()
-
     def __repr__(self):
         return "<Path "+str(self.elements)+">"
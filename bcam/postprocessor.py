@@ -3,9 +3,35 @@ from __future__ import absolute_import, division, print_function
 from logging import debug, info, warning, error, critical
 from bcam.util import dbgfname
 
+import numpy as np
+
+# coordinates are emitted with three decimals, so they are quantized to
+# thousandths once and printed from a precomputed table of fractions
+fixed_scale = 1000
+fixed_fractions = [".%03d" % i for i in range(fixed_scale)]
+
+def quantize(pts):
+    return np.rint(np.asarray(pts, dtype=float)*fixed_scale).astype(np.int64)
+
+def fmt_fixed(q):
+    if q < 0:
+        q = -q
+        return "-"+str(q//fixed_scale)+fixed_fractions[q%fixed_scale]
+    return str(q//fixed_scale)+fixed_fractions[q%fixed_scale]
+
 class Postprocessor(object):
     def __init__(self):
-        pass
+        self.reset()
+
+    def reset(self):
+        # forget the modal state, the next move is emitted in full
+        self.position = [None, None, None]
+
+    def move_to_batch(self, pts):
+        return "".join([self.move_to(pt) for pt in pts])
+
+    def move_to_rapid_batch(self, pts):
+        return "".join([self.move_to_rapid(pt) for pt in pts])
 
     def mk_cw_arc(self, r, end):
         dbgfname()
@@ -57,7 +83,7 @@ class Postprocessor(object):
         debug("  set_absolute is not implemented")
         return None        
 
-    def move_to_rapid(self):
+    def move_to_rapid(self, pt):
         dbgfname()
         debug("  move_to_rapid is not implemented")
         return None
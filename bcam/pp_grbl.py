@@ -1,18 +1,45 @@
 from __future__ import absolute_import, division, print_function
 
-from bcam.postprocessor import Postprocessor
+from bcam.postprocessor import Postprocessor, quantize, fmt_fixed
 
-class PPGRBL(object):
+axes_words = ["X", "Y", "Z"]
+
+class PPGRBL(Postprocessor):
     def __init__(self):
-        pass
+        super(PPGRBL, self).__init__()
+
+    def __moves(self, code, pts):
+        # G00/G01 are modal in GRBL, so only the axes that change are
+        # written and moves that go nowhere are dropped
+        last = self.position
+        out = []
+        for q in quantize(pts).reshape(-1, 3).tolist():
+            words = ""
+            for a in range(3):
+                if q[a] != last[a]:
+                    words+= axes_words[a]+fmt_fixed(q[a])
+            if words != "":
+                out.append(code+" "+words+"\r\n")
+                last = q
+        self.position = last
+        return "".join(out)
+
+    def __arc(self, code, end, extra):
+        q = quantize(end).tolist()
+        self.position = q
+        return code+" X"+fmt_fixed(q[0])+"Y"+fmt_fixed(q[1])+"Z"+fmt_fixed(q[2])+extra+"\r\n"
 
     def move_to(self, pt):
-        out = "G01 X%.3fY%.3fZ%.3f\r\n" % (pt[0], pt[1], pt[2])
-        return out
+        return self.__moves("G01", [pt])
 
     def move_to_rapid(self, pt):
-        out = "G00 X%.3fY%.3fZ%.3f\r\n" % (pt[0], pt[1], pt[2])
-        return out
+        return self.__moves("G00", [pt])
+
+    def move_to_batch(self, pts):
+        return self.__moves("G01", pts)
+
+    def move_to_rapid_batch(self, pts):
+        return self.__moves("G00", pts)
 
     def set_feedrate(self, fr):
         out = "G94\r\n"
@@ -26,17 +53,15 @@ class PPGRBL(object):
         return "G90\r\n"
 
     def mk_cw_arc(self, r, end):
-        out = "G02 X%.3fY%.3fZ%.3f R%.3f\r\n" % (end[0], end[1], end[2], r)
-        return out
+        return self.__arc("G02", end, " R"+fmt_fixed(int(quantize(r))))
 
     def mk_ccw_arc(self, r, end):
-        out = "G03 X%.3fY%.3fZ%.3f R%.3f\r\n" % (end[0], end[1], end[2], r)
-        return out
+        return self.__arc("G03", end, " R"+fmt_fixed(int(quantize(r))))
 
     def mk_cw_ijk_arc(self, center, end):
-        out = "G02 X%.3fY%.3fZ%.3f I%.3fJ%.3fK%.3f\r\n" % (end[0], end[1], end[2], center[0], center[1], center[2])
-        return out
+        c = quantize(center).tolist()
+        return self.__arc("G02", end, " I"+fmt_fixed(c[0])+"J"+fmt_fixed(c[1])+"K"+fmt_fixed(c[2]))
 
     def mk_ccw_ijk_arc(self, center, end):
-        out = "G03 X%.3fY%.3fZ%.3f I%.3fJ%.3fK%.3f\r\n" % (end[0], end[1], end[2], center[0], center[1], center[2])
-        return out
+        c = quantize(center).tolist()
+        return self.__arc("G03", end, " I"+fmt_fixed(c[0])+"J"+fmt_fixed(c[1])+"K"+fmt_fixed(c[2]))
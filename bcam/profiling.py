@@ -0,0 +1,114 @@
+from __future__ import absolute_import, division, print_function
+
+import functools
+import json
+import time
+
+# Named spans time whole steps of toolpath generation, counters add up the
+# work done in them.  Both are always on, a span costs two time() calls and
+# a counter a dict update.  spans maps a name to [calls, total, max]
+# seconds.
+spans = {}
+counters = {}
+# the last outermost span: name, seconds and what it added to the counters
+last = None
+# bumped whenever a new last span is recorded, so views know to refresh
+generation = 0
+depth = 0
+
+
+class Span(object):
+    __slots__ = ("name", "t", "counters_before")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        global depth
+        if depth == 0:
+            self.counters_before = dict(counters)
+        depth+= 1
+        self.t = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        global depth, last, generation
+        dt = time.time()-self.t
+        depth-= 1
+        add_span(self.name, dt)
+        if depth == 0:
+            added = dict((k, v-self.counters_before.get(k, 0)) for k, v in counters.items()
+                         if v != self.counters_before.get(k, 0))
+            last = (self.name, dt, added)
+            generation+= 1
+        return False
+
+def span(name):
+    """Times the enclosed block as one call of span name."""
+    return Span(name)
+
+def profiled(name):
+    """Times every call of the decorated function as span name."""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with Span(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def add_span(name, dt):
+    s = spans.get(name)
+    if s == None:
+        spans[name] = [1, dt, dt]
+    else:
+        s[0]+= 1
+        s[1]+= dt
+        if dt > s[2]:
+            s[2] = dt
+
+def count(name, n=1):
+    counters[name] = counters.get(name, 0)+n
+
+def reset():
+    global last, generation
+    spans.clear()
+    counters.clear()
+    last = None
+    generation+= 1
+
+def snapshot():
+    """Plain dict of everything measured so far, ready for JSON."""
+    snap = {"spans": dict((name, {"calls": c, "total": t, "max": m})
+                          for name, (c, t, m) in spans.items()),
+            "counters": dict(counters)}
+    if last != None:
+        snap["last"] = {"name": last[0], "seconds": last[1], "counters": dict(last[2])}
+    return snap
+
+def merge(other):
+    """Adds a snapshot taken in another process."""
+    global last, generation
+    for name, s in other["spans"].items():
+        own = spans.setdefault(name, [0, 0.0, 0.0])
+        own[0]+= s["calls"]
+        own[1]+= s["total"]
+        own[2] = max(own[2], s["max"])
+    for name, n in other["counters"].items():
+        count(name, n)
+    if "last" in other:
+        l = other["last"]
+        last = (l["name"], l["seconds"], l["counters"])
+        generation+= 1
+
+def to_json():
+    return json.dumps(snapshot(), indent=2, sort_keys=True)
+
+def summary():
+    """One line about the last outermost span, for the status bar."""
+    if last == None:
+        return ""
+    name, dt, added = last
+    parts = ["%s: %.3fs" % (name, dt)]
+    parts+= ["%s %i" % (k, v) for k, v in sorted(added.items())]
+    return ", ".join(parts)
@@ -4,29 +4,150 @@ from bcam.path import Path
 from bcam.state import State
 from bcam import state
 from bcam.singleton import Singleton
+from bcam.element_store import ElementSeq, snapshot_rows
 
 from logging import debug, info, warning, error, critical
 from bcam.util import dbgfname
 
 import os
 import json
-from copy import deepcopy
+from operator import is_
+
+# Format 3 adds the computed toolpaths of operations, format 2 files still
+# load and get their toolpaths recomputed.
+format_version = 3
+supported_format_versions = (2, 3)
+
+def state_data(state, toolpaths=True):
+    data = state.serialize()
+    if toolpaths:
+        for to, to_data in zip(state.tool_operations, data["tool_operations"]):
+            toolpath = to.toolpath_data()
+            if toolpath != None:
+                to_data["toolpath"] = toolpath
+    return data
+
+def write(state, project_path, toolpaths=True):
+    """Saves state as a project, with the computed toolpaths unless told not to."""
+    f = open(project_path, 'w')
+    f.write(json.dumps({'format_version': format_version, 'step': {'state': state_data(state, toolpaths)}}))
+    f.close()
+
+def read_step_data(project_path):
+    f = open(project_path)
+    parsed_json = json.loads(f.read())
+    f.close()
+    if parsed_json["format_version"] not in supported_format_versions:
+        raise ValueError("unsupported project format: "+str(parsed_json["format_version"]))
+    return parsed_json["step"]
+
+class ObjectRecord(object):
+    """Shallow copy of the attributes of a state, path, operation or setting.
+
+    Lists and dicts are copied one level deep and the objects in them are
+    shared, so recording a path costs a pointer per element.  Elements are
+    edited in place in the element store, so the geometry of the store rows
+    the object refers to is copied too, and only the rows edited since
+    are compared with the copy later.  A step reuses the record of every
+    object that hasn't changed since the previous step.
+
+    """
+    def __init__(self, obj, skip=()):
+        self.obj = obj
+        self.skip = skip
+        self.attrs = {}
+        self.lists = set()
+        self.dicts = set()
+        self.snapshots = []
+        for k, v in obj.__dict__.items():
+            if k in skip:
+                continue
+            if isinstance(v, ElementSeq):
+                self.snapshots+= snapshot_rows(v)
+            elif type(v) is list:
+                self.lists.add(k)
+                self.snapshots+= snapshot_rows(v)
+                v = tuple(v)
+            elif type(v) is dict:
+                self.dicts.add(k)
+                v = dict(v)
+            self.attrs[k] = v
+
+    def matches(self):
+        d = self.obj.__dict__
+        if len(d)-len([k for k in self.skip if k in d]) != len(self.attrs):
+            return False
+        for k, v in self.attrs.items():
+            if k not in d:
+                return False
+            cur = d[k]
+            if k in self.lists:
+                if type(cur) is not list or len(cur) != len(v) or not all(map(is_, cur, v)):
+                    return False
+            elif k in self.dicts:
+                if type(cur) is not dict or len(cur) != len(v):
+                    return False
+                for dk, dv in v.items():
+                    if dk not in cur or cur[dk] is not dv:
+                        return False
+            elif cur is not v:
+                return False
+        for s in self.snapshots:
+            if not s.matches():
+                return False
+        return True
+
+    def restore(self):
+        for k, v in self.attrs.items():
+            if k in self.lists:
+                v = list(v)
+            elif k in self.dicts:
+                v = dict(v)
+            setattr(self.obj, k, v)
+        for s in self.snapshots:
+            s.restore()
 
 class Step(object):
-    def __init__(self, state=None, data=None):
+    def __init__(self, state=None, data=None, prev=None):
         self.dsc = ""
         if data == None:
             self.state=state
         else:
             self.deserialize(data)
-        self.serialized_state = self.state.serialize()
-
-    def unserialize(self):
-        # because we cant rely on self.state, but we can rely on self.serialized_state
-        self.deserialize(self.serialize())
-
-    def serialize(self):
-        return {'state': self.serialized_state}
+        self.records = self.__mk_records(prev)
+
+    def __tracked(self):
+        s = self.state
+        yield s, ("operation_in_progress", "spinner", "spinner_frame")
+        yield s.settings, ()
+        yield s.settings.tool, ("current_position",)
+        yield s.settings.material, ()
+        for p in s.paths:
+            yield p, ()
+        for to in s.tool_operations:
+            if to != None:
+                yield to, ("process", "parent")
+
+    def __mk_records(self, prev):
+        old = {}
+        if prev != None:
+            old = prev.records
+        records = {}
+        for obj, skip in self.__tracked():
+            r = old.get(id(obj))
+            if r == None or r.obj is not obj or not r.matches():
+                r = ObjectRecord(obj, skip)
+            records[id(obj)] = r
+        return records
+
+    def restore(self):
+        # only objects changed since this step are touched
+        restored = 0
+        for r in self.records.values():
+            if not r.matches():
+                r.restore()
+                restored+= 1
+        return restored
 
     def deserialize(self, data):
         self.state = State(data["state"])
@@ -53,30 +174,25 @@ class Project(object):
 
         self.path = project_path
 
-        debug("  loading project from "+str(project_path))
-        f = open(project_path)
-        data = f.read()
-        f.close()
-        parsed_json = json.loads(data)
+        debug("  loading project from %s", project_path)
+        try:
+            step_data = read_step_data(project_path)
+        except ValueError as e:
+            debug("  Can't load: %s", e)
+            return
         self.steps = []
-        if parsed_json["format_version"] == 2:
-            step = Step(data=parsed_json["step"])
-            self.steps.append(step)
-            Singleton.state.set(self.steps[-1].state)
-            ep.push_event(ee.update_tool_operations_list, (None))
-            ep.push_event(ee.update_paths_list, (None))
-            ep.mw.widget.update()
-        else:
-            debug("  Can't load, unsupported format")
+        step = Step(data=step_data)
+        self.steps.append(step)
+        Singleton.state.set(self.steps[-1].state)
+        ep.push_event(ee.update_tool_operations_list, (None))
+        ep.push_event(ee.update_paths_list, (None))
+        ep.mw.widget.update()
 
     def save(self, project_path):
         if os.path.splitext(project_path)[1][1:].strip() != "bcam":
             project_path+=".bcam"
 
-        # format 2
-        f = open(project_path, 'w')
-        f.write(json.dumps({'format_version': 2, 'step': self.steps[-1].serialize()}))
-        f.close()
+        write(Singleton.state, project_path)
         self.set_path(project_path)
         return True
 
@@ -85,28 +201,33 @@ class Project(object):
         if (self.step_index != -1):
             self.steps = self.steps[:self.step_index + 1]
             self.step_index = -1
-        self.steps.append(Step(state))
+        prev = None
+        if len(self.steps)>0:
+            prev = self.steps[-1]
+        self.steps.append(Step(state, prev=prev))
         self.steps[-1].dsc = description
         depth = 50
         if (len(self.steps)>depth):
             self.steps = self.steps[-depth:]
-        debug("  steps length:"+str(len(self.steps)))
+        debug("  steps length:%s", len(self.steps))
+
+    def __restore(self, step):
+        restored = step.restore()
+        debug("  restored %s of %s objects", restored, len(step.records))
+        if Singleton.state is not step.state:
+            Singleton.state.set(step.state)
 
     def step_back(self):
         dbgfname()
         if abs(self.step_index)<len(self.steps):
             self.step_index -= 1
-            s = self.steps[self.step_index]
-            s.unserialize()
-            Singleton.state.set(s.state);
+            self.__restore(self.steps[self.step_index])
 
     def step_forward(self):
         dbgfname()
         if self.step_index < -1:
             self.step_index += 1
-            s = self.steps[self.step_index]
-            s.unserialize()
-            Singleton.state.set(s.state);
+            self.__restore(self.steps[self.step_index])
 
 
 project = Project()
@@ -0,0 +1,511 @@
+from __future__ import absolute_import, division, print_function
+
+import math
+import cairo
+import numpy as np
+from collections import OrderedDict
+
+from bcam.tool_operation import TOEnum
+from bcam.elements import linearize_to_segments
+from bcam.calc_utils import decimate_segments
+from bcam import profiling
+
+from logging import debug, info, warning, error, critical
+from bcam.util import dbgfname
+
+# Everything that puts paths and tool operations on screen lives here, the
+# geometry and toolpath modules don't import cairo at all.
+
+def set_source(ctx, color):
+    if len(color) == 3:
+        ctx.set_source_rgb(color[0], color[1], color[2])
+    else:
+        ctx.set_source_rgba(color[0], color[1], color[2], color[3])
+
+def trace_line(ctx, e):
+    ctx.move_to(e.start[0], e.start[1])
+    ctx.line_to(e.end[0], e.end[1])
+
+def trace_arc(ctx, e):
+    if e.is_turnaround:
+        ctx.arc(e.center[0], e.center[1], e.radius, e.endangle, e.startangle)
+    else:
+        ctx.arc(e.center[0], e.center[1], e.radius, e.startangle, e.endangle)
+
+def trace_circle(ctx, e):
+    ctx.arc(e.center[0], e.center[1], e.radius, 0, math.pi*2)
+
+def trace_point(ctx, e):
+    ctx.rectangle(e.center[0]-0.1, e.center[1]-0.1, 0.2, 0.2)
+
+element_tracers = {"ELine": trace_line,
+                   "EArc": trace_arc,
+                   "ECircle": trace_circle,
+                   "EPoint": trace_point}
+
+def trace_element(ctx, e):
+    element_tracers[type(e).__name__](ctx, e)
+
+
+def grid_step(size, scale):
+    """Grid spacing (mm) for a widget of size, a power of ten giving 40 to 80 dots."""
+    step = 1.0
+    xsteps = size[0]/scale[0]/step
+    ysteps = size[1]/scale[1]/step
+    maxsteps = max(xsteps, ysteps)
+    mins = 40
+    maxs = 80
+    if (maxsteps < mins):
+        while (maxsteps < mins):
+            if (step//10 == 0):
+                break
+            step//=10
+            xsteps = size[0]/scale[0]/step
+            ysteps = size[1]/scale[1]/step
+            maxsteps = max(xsteps, ysteps)
+    if (maxsteps > maxs):
+        while (maxsteps > maxs):
+            step*=10
+            xsteps = size[0]/scale[0]/step
+            ysteps = size[1]/scale[1]/step
+            maxsteps = max(xsteps, ysteps)
+    return step
+
+class GridPattern(object):
+    """Black background with a white dot every grid step.
+
+    One cell of the grid is drawn into a surface that repeats, made again
+    only when the step or scale changes, so the whole grid is one paint.
+    Cells bigger than max_cell pixels have few dots on screen, those are
+    drawn directly.
+
+    """
+    max_cell = 512
+
+    def __init__(self):
+        self.key = None
+        self.pattern = None
+        self.ratio = None
+
+    def __mk_pattern(self, cell):
+        w, h = int(math.ceil(cell[0])), int(math.ceil(cell[1]))
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+        ctx = cairo.Context(surface)
+        ctx.set_source_rgb(0.0, 0.0, 0.0)
+        ctx.paint()
+        ctx.set_source_rgb(1.0, 1.0, 1.0)
+        ctx.rectangle(0, 0, 1, 1)
+        ctx.fill()
+        pattern = cairo.SurfacePattern(surface)
+        pattern.set_extend(cairo.EXTEND_REPEAT)
+        pattern.set_filter(cairo.FILTER_NEAREST)
+        profiling.count("grid patterns made")
+        return pattern, (w/cell[0], h/cell[1])
+
+    def paint(self, ctx, size, offset, scale):
+        """Paints the background of a widget of size, world origin at offset."""
+        step = grid_step(size, scale)
+        cell = (step*scale[0], step*scale[1])
+        if max(cell) > self.max_cell:
+            ctx.set_source_rgb(0.0, 0.0, 0.0)
+            ctx.paint()
+            ctx.set_source_rgb(1.0, 1.0, 1.0)
+            x = offset[0]%cell[0]
+            while x < size[0]:
+                y = offset[1]%cell[1]
+                while y < size[1]:
+                    ctx.rectangle(x, y, 1, 1)
+                    y+= cell[1]
+                x+= cell[0]
+            ctx.fill()
+            return
+        if self.key != (step, tuple(scale)):
+            self.key = (step, tuple(scale))
+            self.pattern, self.ratio = self.__mk_pattern(cell)
+        # dots sit on multiples of step in the world
+        fx, fy = self.ratio
+        self.pattern.set_matrix(cairo.Matrix(fx, 0, 0, fy, -offset[0]*fx, -offset[1]*fy))
+        ctx.set_source(self.pattern)
+        ctx.paint()
+
+
+# Retained rendering.  Paths and tool operations are recorded once into
+# display lists of cairo paths in world coordinates, the screen is a cache
+# of raster tiles made out of them.
+
+# arcs are flattened into curves as precise as at this zoom when recorded
+record_scale = 1000.0
+
+def set_round(ctx, round_):
+    if round_:
+        ctx.set_line_join(cairo.LINE_JOIN_ROUND)
+        ctx.set_line_cap(cairo.LINE_CAP_ROUND)
+    else:
+        ctx.set_line_join(cairo.LINE_JOIN_MITER)
+        ctx.set_line_cap(cairo.LINE_CAP_BUTT)
+
+def overlaps(e, rect):
+    return e[0] <= rect[2] and e[2] >= rect[0] and e[1] <= rect[3] and e[3] >= rect[1]
+
+class Trace(object):
+    """Cairo path of some elements in world coordinates and its extents.
+
+    Coarser paths for zoomed out views are decimated out of the elements
+    when first needed and kept by zoom level.
+
+    """
+    __slots__ = ("path", "extents", "elements", "lods")
+
+    def __init__(self, path, extents, elements):
+        self.path = path
+        self.extents = extents
+        self.elements = elements
+        self.lods = {}
+
+    def __lod(self, pixel, recorder):
+        level = int(math.floor(math.log(pixel, 2)))
+        path = self.lods.get(level)
+        if path == None:
+            tolerance = 2.0**level/2
+            for pts in decimate_segments(linearize_to_segments(self.elements, tolerance), tolerance):
+                if len(pts) == 1:
+                    recorder.rectangle(pts[0][0]-tolerance/2, pts[0][1]-tolerance/2, tolerance, tolerance)
+                    continue
+                recorder.move_to(pts[0][0], pts[0][1])
+                for x, y in pts[1:].tolist():
+                    recorder.line_to(x, y)
+            path = recorder.copy_path()
+            recorder.new_path()
+            self.lods[level] = path
+            profiling.count("paths decimated")
+        return path
+
+    def append_to(self, ctx, pixel, recorder):
+        """Adds the path to ctx at the detail pixel (world units) can show."""
+        e = self.extents
+        w = e[2]-e[0]
+        h = e[3]-e[1]
+        if w < pixel and h < pixel:
+            # sub-pixel, a dot does
+            ctx.rectangle(e[0], e[1], w, h)
+        elif self.elements != None and len(self.elements)*2*pixel > w+h:
+            # elements shorter than a couple of pixels on average
+            ctx.append_path(self.__lod(pixel, recorder))
+        else:
+            ctx.append_path(self.path)
+
+def set_style(ctx, style):
+    color, lw, round_, fill = style
+    set_source(ctx, color)
+    ctx.set_line_width(lw)
+    set_round(ctx, round_)
+
+def paint(ctx, style):
+    if style[3]:
+        ctx.fill()
+    else:
+        ctx.stroke()
+
+class DisplayList(object):
+    """Recorded cairo paths of one path or tool operation.
+
+    Items are (style, trace) pairs replayed in order, a style is (color,
+    line width, round, fill).  When batched, consecutive items of the same
+    style are painted at once.  signature tells what the list was recorded
+    from, refs keeps the objects whose ids are in it alive, so the ids
+    can't be reused.  Lists of paths also keep their items by chunk.
+
+    """
+    def __init__(self, obj, signature, refs, batched=True):
+        self.obj = obj
+        self.signature = signature
+        self.refs = refs
+        self.batched = batched
+        self.items = []
+        self.extents = None
+        self.chunks = None
+        self.selection = None
+        self.selection_version = None
+
+    def trace(self, ctx, style, elements=None):
+        """Takes the current path of ctx, extents are those stroked in style."""
+        set_style(ctx, style)
+        e = ctx.fill_extents() if style[3] else ctx.stroke_extents()
+        t = Trace(ctx.copy_path(), e, elements)
+        ctx.new_path()
+        if self.extents == None:
+            self.extents = e
+        else:
+            self.extents = (min(self.extents[0], e[0]), min(self.extents[1], e[1]),
+                            max(self.extents[2], e[2]), max(self.extents[3], e[3]))
+        return t
+
+    def intersects(self, rect):
+        return self.extents != None and overlaps(self.extents, rect)
+
+    def replay(self, ctx, rect, pixel, recorder):
+        """Paints the items within rect (left, bottom, right, top)."""
+        pending = None
+        for style, trace in self.items:
+            if not overlaps(trace.extents, rect):
+                continue
+            if pending != None and (style != pending or not self.batched):
+                paint(ctx, pending)
+                pending = None
+            if pending == None:
+                set_style(ctx, style)
+                pending = style
+            trace.append_to(ctx, pixel, recorder)
+        if pending != None:
+            paint(ctx, pending)
+
+# Elements are recorded in chunks, so big paths are culled and decimated
+# piece by piece.
+chunk_elements = 256
+
+def element_style(e, style):
+    # elements without a line type keep the style of the one before
+    if e.lt == None:
+        return style
+    if e.selected:
+        return (e.lt.selected_color, e.lt.selected_lw, False, False)
+    return (e.color if e.color != None else e.lt.color, e.lt.lw, False, False)
+
+def record_chunk(ctx, dl, elements):
+    # runs of elements drawn alike become one path
+    items = []
+    style = ((0, 0, 0), 2.0, False, False)
+    start = 0
+    for i, e in enumerate(elements):
+        s = element_style(e, style)
+        if i > start and s != style:
+            items.append((style, dl.trace(ctx, style, elements[start:i])))
+            start = i
+        style = s
+        ctx.new_sub_path()
+        trace_element(ctx, e)
+    if len(elements) > start:
+        items.append((style, dl.trace(ctx, style, elements[start:])))
+    profiling.count("chunks recorded")
+    return items
+
+def selection_bits(elements):
+    """Selection flags of elements packed into a row per chunk."""
+    selected = elements.store.selected[elements.indices]
+    padded = np.zeros(-(-len(selected)//chunk_elements)*chunk_elements, bool)
+    padded[:len(selected)] = selected
+    return np.packbits(padded.reshape(-1, chunk_elements), axis=1)
+
+def chunk_extents(items):
+    e = [t.extents for style, t in items]
+    if len(e) == 0:
+        return None
+    return (min(i[0] for i in e), min(i[1] for i in e), max(i[2] for i in e), max(i[3] for i in e))
+
+def record_path(ctx, dl, p):
+    # paths are recorded in chunks, so a changed selection is recorded
+    # again chunk by chunk, see refresh_path
+    if not p.display:
+        return
+    elements = p.elements
+    dl.chunks = [record_chunk(ctx, dl, elements[i:i+chunk_elements])
+                 for i in range(0, len(elements), chunk_elements)]
+    dl.items = [item for chunk in dl.chunks for item in chunk]
+    dl.selection = selection_bits(elements)
+    dl.selection_version = elements.store.selection_version
+
+def refresh_path(ctx, dl, p):
+    """Records the chunks whose selection changed again, returns their extents."""
+    elements = p.elements
+    if not p.display or dl.selection_version == elements.store.selection_version:
+        return []
+    dl.selection_version = elements.store.selection_version
+    bits = selection_bits(elements)
+    changed = np.nonzero(np.any(bits != dl.selection, axis=1))[0].tolist()
+    dl.selection = bits
+    damaged = []
+    for k in changed:
+        damaged.append(chunk_extents(dl.chunks[k]))
+        dl.chunks[k] = record_chunk(ctx, dl, elements[k*chunk_elements:(k+1)*chunk_elements])
+        damaged.append(chunk_extents(dl.chunks[k]))
+    if len(changed) > 0:
+        dl.items = [item for chunk in dl.chunks for item in chunk]
+    return damaged
+
+def follow_styles(op):
+    a = 1.0 if op.selected else 0.5
+    return [((1, 0, 0, a), op.tool.diameter, True, False),
+            ((0.8, 0.1, 0.1, a), op.tool.diameter*0.9, True, False)]
+
+def record_drill(ctx, dl, op):
+    a = 1.0 if op.selected else 0.5
+    outline = ((1, 0, 0, a), 0.1, False, False)
+    ctx.arc(op.center[0], op.center[1], op.tool.diameter/2.0, 0, 2*math.pi)
+    t = dl.trace(ctx, outline)
+    dl.items+= [(outline, t), (((0.8, 0.1, 0.1, a), 0.0, False, True), t)]
+
+def record_follow(ctx, dl, op):
+    if op.draw_list == None:
+        return
+    outline, fill = follow_styles(op)
+    traces = []
+    for i in range(0, len(op.draw_list), chunk_elements):
+        chunk = op.draw_list[i:i+chunk_elements]
+        for e in chunk:
+            trace_element(ctx, e)
+        traces.append(dl.trace(ctx, outline, chunk))
+    # both passes are batched into one stroke each
+    for style in (outline, fill):
+        dl.items+= [(style, t) for t in traces]
+
+def record_pocket(ctx, dl, op):
+    # pocket passes overlap, every one is stroked on its own
+    if op.draw_list == None:
+        return
+    dl.batched = False
+    outline, fill = follow_styles(op)
+    traces = []
+    for e in op.draw_list:
+        trace_element(ctx, e)
+        traces.append(dl.trace(ctx, outline, [e]))
+    for style in (outline, fill):
+        dl.items+= [(style, t) for t in traces]
+
+operation_recorders = {TOEnum.drill: record_drill,
+                       TOEnum.exact_follow: record_follow,
+                       TOEnum.offset_follow: record_follow,
+                       TOEnum.pocket: record_pocket}
+
+def record_tool_operation(ctx, dl, op):
+    if op.display:
+        operation_recorders[op.name](ctx, dl, op)
+
+def path_signature(p):
+    s = p.elements
+    return (p.display, id(s), len(s), s.store.version), s
+
+def operation_signature(op):
+    dl = op.draw_list
+    center = getattr(op, "center", None)
+    return ((op.display, op.selected, op.tool.diameter, id(dl),
+             len(dl) if dl != None else None,
+             tuple(center) if center != None else None), dl)
+
+class SceneCache(object):
+    """Retained rendering of the paths and tool operations of a state.
+
+    Display lists are recorded again only for objects whose signature
+    changed, and only the chunks of a path whose selection changed.  The
+    scene is rasterized at the current scale into transparent tiles
+    anchored to the world origin, so repaints, panning included, blit
+    tiles already drawn.  Changes drop just the tiles they touch, a new
+    scale or drawing order drops them all, the least recently used ones
+    go past max_tiles.
+
+    """
+    tile_size = 256
+
+    def __init__(self, max_tiles=128):
+        self.max_tiles = max_tiles
+        self.display_lists = {}
+        self.tiles = OrderedDict()
+        self.tiles_scale = None
+        self.order = None
+        self.damaged = []
+        self.recorder = cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1))
+        self.recorder.scale(record_scale, record_scale)
+
+    def update(self, paths, operations):
+        """Records what changed, returns the display lists in drawing order.
+
+        World extents of what changed pile up in damaged.
+
+        """
+        old = self.display_lists
+        self.display_lists = {}
+        lists = []
+        for objects, signature, record, refresh in ((paths, path_signature, record_path, refresh_path),
+                                                    (operations, operation_signature, record_tool_operation, None)):
+            for o in (objects if objects != None else []):
+                sig, refs = signature(o)
+                dl = old.pop(id(o), None)
+                if dl == None or dl.signature != sig:
+                    if dl != None:
+                        self.damaged.append(dl.extents)
+                    dl = DisplayList(o, sig, refs)
+                    record(self.recorder, dl, o)
+                    self.damaged.append(dl.extents)
+                    profiling.count("display lists recorded")
+                elif refresh != None:
+                    self.damaged+= refresh(self.recorder, dl, o)
+                self.display_lists[id(o)] = dl
+                lists.append(dl)
+        # gone
+        self.damaged+= [dl.extents for dl in old.values()]
+        return lists
+
+    def __drop_tiles(self, extents, scale):
+        t = self.tile_size
+        i1, i2 = math.floor(extents[0]*scale[0]/t), math.floor(extents[2]*scale[0]/t)
+        j1, j2 = math.floor(-extents[3]*scale[1]/t), math.floor(-extents[1]*scale[1]/t)
+        for i, j in list(self.tiles.keys()):
+            if i1 <= i <= i2 and j1 <= j <= j2:
+                del self.tiles[(i, j)]
+
+    def __render_tile(self, i, j, scale, lists):
+        t = self.tile_size
+        left, right = i*t/scale[0], (i+1)*t/scale[0]
+        bottom, top = -(j+1)*t/scale[1], -j*t/scale[1]
+        rect = (left, bottom, right, top)
+        visible = [dl for dl in lists if dl.intersects(rect)]
+        if len(visible) == 0:
+            return None
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, t, t)
+        ctx = cairo.Context(surface)
+        ctx.translate(-i*t, -j*t)
+        ctx.scale(scale[0], -scale[1])
+        for dl in visible:
+            dl.replay(ctx, rect, 1.0/scale[0], self.recorder)
+        profiling.count("tiles rendered")
+        return surface
+
+    def __tile(self, i, j, scale, lists):
+        if (i, j) in self.tiles:
+            surface = self.tiles.pop((i, j))
+        else:
+            surface = self.__render_tile(i, j, scale, lists)
+        self.tiles[(i, j)] = surface
+        while len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return surface
+
+    def draw(self, ctx, area, offset, scale, paths, operations):
+        """Paints paths and operations over area (x, y, width, height) of ctx.
+
+        ctx is in widget pixels, offset is where the world origin is on
+        the widget.
+
+        """
+        lists = self.update(paths, operations)
+        order = [id(dl.obj) for dl in lists]
+        if tuple(scale) != self.tiles_scale or order != self.order:
+            self.tiles.clear()
+            self.tiles_scale = tuple(scale)
+            self.order = order
+        else:
+            for e in self.damaged:
+                if e != None:
+                    self.__drop_tiles(e, scale)
+        self.damaged = []
+        t = self.tile_size
+        # whole pixels, tiles are blitted without resampling
+        ox = int(math.floor(offset[0]+0.5))
+        oy = int(math.floor(offset[1]+0.5))
+        x, y, w, h = [int(v) for v in area]
+        for i in range((x-ox)//t, (x+w-1-ox)//t+1):
+            for j in range((y-oy)//t, (y+h-1-oy)//t+1):
+                surface = self.__tile(i, j, scale, lists)
+                if surface != None:
+                    ctx.set_source_surface(surface, ox+i*t, oy+j*t)
+                    ctx.rectangle(ox+i*t, oy+j*t, t, t)
+                    ctx.fill()
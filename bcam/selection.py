@@ -0,0 +1,53 @@
+from __future__ import absolute_import, division, print_function
+
+from collections import OrderedDict
+
+from logging import debug, info, warning, error, critical
+from bcam.util import dbgfname
+
+
+class Selection(object):
+    """Selected elements in the order they were selected.
+
+    Membership is a hash lookup, so selecting many elements at once stays
+    linear.  Adding and removing set the elements' selected flags too.
+
+    """
+    def __init__(self):
+        self.__elements = OrderedDict()
+
+    def __contains__(self, e):
+        return e in self.__elements
+
+    def __iter__(self):
+        return iter(list(self.__elements.keys()))
+
+    def __len__(self):
+        return len(self.__elements)
+
+    def __repr__(self):
+        return "<Selection %s>" % (list(self.__elements.keys()),)
+
+    def add(self, e):
+        """Selects e, returns False if it already was."""
+        if e in self.__elements:
+            return False
+        e.set_selected()
+        self.__elements[e] = None
+        return True
+
+    def remove(self, e):
+        """Deselects e, returns False if it wasn't selected."""
+        if e not in self.__elements:
+            return False
+        del self.__elements[e]
+        e.unset_selected()
+        return True
+
+    def clear(self):
+        """Deselects everything, returns what was selected."""
+        elements = list(self.__elements.keys())
+        for e in elements:
+            e.unset_selected()
+        self.__elements.clear()
+        return elements
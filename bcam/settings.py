@@ -3,6 +3,7 @@ from __future__ import absolute_import, division, print_function
 from bcam.tool import Tool, ToolType
 from bcam.generalized_setting import TOSetting
 from bcam.pp_grbl import PPGRBL
+from bcam.toolpath_compressor import ToolpathCompressor
 
 class LineType(object):
     def __init__(self, lw=None, selected_lw=None, color=None, selected_color=None, name=None, data=None):
@@ -15,20 +16,6 @@ class LineType(object):
         else:
             self.deserialize(data)
 
-    def set_lt(self, ctx):
-        if len(self.color) == 3:
-            ctx.set_source_rgb(self.color[0], self.color[1], self.color[2])
-        else:
-            ctx.set_source_rgba(self.color[0], self.color[1], self.color[2], self.color[3])
-        ctx.set_line_width(self.lw)
-
-    def set_selected_lt(self, ctx):
-        if len(self.selected_color) == 3:
-            ctx.set_source_rgb(self.selected_color[0], self.selected_color[1], self.selected_color[2])
-        else:
-            ctx.set_source_rgba(self.selected_color[0], self.selected_color[1], self.selected_color[2], self.selected_color[3])
-        ctx.set_line_width(self.selected_lw)
-
     def serialize(self):
         return {"type": "linetype", "color": self.color, "selected_color": self.selected_color, "lw": self.lw, "selected_lw": self.selected_lw, "name": self.name}
 
@@ -77,6 +64,7 @@ class Settings(object):
 
         self.select_box_lt = LineType(1.0, 1.0, (0, 1, 0, 0.2), (0, 1, 0, 0.2), "select box lt")
         self.default_pp = PPGRBL()
+        self.compressor = ToolpathCompressor()
 
     def get_material(self):
         return self.material      
@@ -93,7 +81,7 @@ class Settings(object):
         return self.line_types["default"]
 
     def serialize(self):
-        return {"type": "settings", "material": self.material.serialize(), "linetypes": [l.serialize() for k, l in self.line_types.iteritems()], "tool": self.tool.serialize()}
+        return {"type": "settings", "material": self.material.serialize(), "linetypes": [l.serialize() for k, l in self.line_types.items()], "tool": self.tool.serialize()}
 
     def deserialize(self, data):
         self.material = Material(data["material"])
@@ -0,0 +1,161 @@
+from __future__ import absolute_import, division, print_function
+
+import math
+import numpy as np
+
+from bcam.element_store import EKind
+from bcam import profiling
+
+from logging import debug, info, warning, error, critical
+from bcam.util import dbgfname
+
+
+def distances_to_pt(store, rows, pt):
+    """Distances from pt to the elements in rows of store, like distance_to_pt.
+
+    Arcs only count within their sweep, inf otherwise.
+
+    """
+    kind = store.kind[rows]
+    d = np.full(len(rows), np.inf)
+    p = np.asarray(pt[:2], dtype=float)
+
+    line = np.nonzero(kind == EKind.line)[0]
+    if len(line) > 0:
+        s = store.start[rows[line]]
+        se = store.end[rows[line]]-s
+        sp = p-s
+        l2 = se[:, 0]**2+se[:, 1]**2
+        # degenerate lines are points
+        t = np.where(l2 < 0.0001, 0.0, (sp[:, 0]*se[:, 0]+sp[:, 1]*se[:, 1])/np.maximum(l2, 1e-300))
+        t = np.clip(t, 0, 1)
+        d[line] = np.hypot(sp[:, 0]-t*se[:, 0], sp[:, 1]-t*se[:, 1])
+
+    round_ = np.nonzero((kind == EKind.circle) | (kind == EKind.arc))[0]
+    if len(round_) > 0:
+        v = p-store.center[rows[round_]]
+        dist = np.abs(np.hypot(v[:, 0], v[:, 1])-store.radius[rows[round_]])
+        arc = kind[round_] == EKind.arc
+        sa = store.startangle[rows[round_]]
+        sweep = (store.endangle[rows[round_]]-sa)%(2*math.pi)
+        inside = (np.arctan2(v[:, 1], v[:, 0])-sa)%(2*math.pi) <= sweep
+        d[round_] = np.where(arc & ~inside, np.inf, dist)
+
+    dot = np.nonzero(kind == EKind.point)[0]
+    if len(dot) > 0:
+        v = p-store.center[rows[dot]]
+        d[dot] = np.hypot(v[:, 0], v[:, 1])
+    return d
+
+
+class SpatialIndex(object):
+    """Uniform grid over the elements of paths, for picking them on screen.
+
+    Every element goes into the cells its bounding box covers, cells are
+    sorted keys searched with searchsorted.  Elements spanning more than
+    max_cells cells are tested on every query instead.  An index is built
+    for a list of paths and tells when it no longer matches them, see
+    is_stale.
+
+    """
+    max_cells = 64
+
+    def __init__(self, paths, store):
+        self.store = store
+        self.seqs = [p.elements for p in paths]
+        self.version = store.version
+        self.paths = list(paths)
+        parts = [s.indices for s in self.seqs]
+        rows = np.concatenate(parts) if len(parts) > 0 else np.zeros(0, np.int64)
+        # a row shared by paths is one element
+        rows, first = np.unique(rows, return_index=True)
+        self.rows = rows[np.argsort(first)]
+        self.boxes = np.vstack([s.aabbs() for s in self.seqs if len(s) > 0]+[np.zeros((0, 4))])
+        self.boxes = self.boxes[np.sort(first)]
+        self.__build_grid()
+        profiling.count("spatial index elements", len(self.rows))
+
+    def is_stale(self, paths):
+        if self.version != self.store.version or len(paths) != len(self.paths):
+            return True
+        for p, old, s in zip(paths, self.paths, self.seqs):
+            if p is not old or p.elements is not s:
+                return True
+        return False
+
+    def __build_grid(self):
+        b = self.boxes
+        n = len(b)
+        if n == 0:
+            self.cell = 1.0
+            self.origin = np.zeros(2)
+            self.last_cell = np.zeros(2, np.int64)
+            self.keys = np.zeros(0, np.int64)
+            self.entries = np.zeros(0, np.int64)
+            self.big = np.zeros(0, np.int64)
+            return
+        size = np.maximum(b[:, 2]-b[:, 0], b[:, 3]-b[:, 1])
+        span = max(b[:, 2].max()-b[:, 0].min(), b[:, 3].max()-b[:, 1].min())
+        # about an element per cell, at most a few thousand cells a side
+        self.cell = max(float(np.median(size)), span/4096, 1e-6)
+        self.origin = b[:, :2].min(axis=0)
+        lo = self.__cells(b[:, :2])
+        hi = self.__cells(b[:, 2:])
+        self.last_cell = hi.max(axis=0)
+        nx = hi[:, 0]-lo[:, 0]+1
+        ny = hi[:, 1]-lo[:, 1]+1
+        counts = nx*ny
+        small = np.nonzero(counts <= self.max_cells)[0]
+        self.big = np.nonzero(counts > self.max_cells)[0]
+        counts = counts[small]
+        starts = np.cumsum(counts)-counts
+        k = np.arange(counts.sum())-np.repeat(starts, counts)
+        entries = np.repeat(small, counts)
+        cx = lo[entries, 0]+k%nx[entries]
+        cy = lo[entries, 1]+k//nx[entries]
+        keys = self.__keys(cx, cy)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.entries = entries[order]
+
+    def __cells(self, pts):
+        return np.floor((pts-self.origin)/self.cell).astype(np.int64)
+
+    def __keys(self, cx, cy):
+        return cx*(1 << 32)+cy
+
+    def __candidates(self, left, bottom, right, top):
+        lo = np.maximum(self.__cells(np.array([left, bottom])), 0)
+        hi = np.minimum(self.__cells(np.array([right, top])), self.last_cell)
+        if np.any(hi < lo):
+            return self.big
+        if (hi[0]-lo[0]+1)*(hi[1]-lo[1]+1) > len(self.keys):
+            return np.arange(len(self.rows))
+        found = [self.big]
+        for cx in range(int(lo[0]), int(hi[0])+1):
+            keys = self.__keys(cx, np.arange(lo[1], hi[1]+1))
+            a = np.searchsorted(self.keys, keys[0], "left")
+            b = np.searchsorted(self.keys, keys[-1], "right")
+            found.append(self.entries[a:b])
+        return np.unique(np.concatenate(found))
+
+    def near(self, pt, tolerance):
+        """Elements closer than tolerance to pt, in path order."""
+        c = self.__candidates(pt[0]-tolerance, pt[1]-tolerance, pt[0]+tolerance, pt[1]+tolerance)
+        if len(c) == 0:
+            return []
+        hit = c[distances_to_pt(self.store, self.rows[c], pt) < tolerance]
+        profiling.count("spatial index candidates", len(c))
+        return [self.store.view(int(i)) for i in self.rows[hit]]
+
+    def touching_box(self, left, bottom, right, top):
+        """Elements with a bounding box corner in the box, in path order."""
+        c = self.__candidates(left, bottom, right, top)
+        if len(c) == 0:
+            return []
+        b = self.boxes[c]
+        xs = ((b[:, 0] >= left) & (b[:, 0] <= right)) | ((b[:, 2] >= left) & (b[:, 2] <= right))
+        ys = ((b[:, 1] >= bottom) & (b[:, 1] <= top)) | ((b[:, 3] >= bottom) & (b[:, 3] <= top))
+        hit = c[xs & ys]
+        profiling.count("spatial index candidates", len(c))
+        return [self.store.view(int(i)) for i in self.rows[hit]]
@@ -1,6 +1,10 @@
 from __future__ import absolute_import, division, print_function
 
+import math
+
 from bcam.settings import Settings
+from bcam.element_store import ElementStore
+from bcam.spatial_index import SpatialIndex
 from bcam.singleton import Singleton
 
 from logging import debug, info, warning, error, critical
@@ -12,6 +16,8 @@ class State(object):
         self.operation_in_progress = None
         self.spinner = ['-', '\\', '|', '/']
         self.spinner_frame = 0
+        self.element_store = ElementStore()
+        self.spatial_index = None
 
         if data == None:
             self.settings = Settings()
@@ -43,6 +49,7 @@ class State(object):
 
     def set(self, state):
         self.settings = state.settings
+        self.element_store = state.element_store
         self.__total_offset = state.__total_offset
         self.__screen_offset = state.__screen_offset
         self.__base_offset = state.__base_offset
@@ -75,6 +82,33 @@ class State(object):
             self.__screen_offset = offset
             self.__total_offset = (self.__base_offset[0]+self.__screen_offset[0], self.__base_offset[1]+self.__screen_offset[1])
 
+    def screen_area(self, left, bottom, right, top, margin=0):
+        """Screen pixels (x, y, width, height) showing a world rectangle.
+
+        margin (mm) goes around it, for line widths, and a pixel more for
+        antialiasing.
+
+        """
+        offset = self.get_offset()
+        x1 = int(math.floor(offset[0]+(left-margin)*self.scale[0]))-1
+        x2 = int(math.ceil(offset[0]+(right+margin)*self.scale[0]))+1
+        y1 = int(math.floor(offset[1]-(top+margin)*self.scale[1]))-1
+        y2 = int(math.ceil(offset[1]-(bottom-margin)*self.scale[1]))+1
+        return (x1, y1, x2-x1, y2-y1)
+
+    def get_spatial_index(self):
+        """Spatial index of the elements of all paths, rebuilt once they change.
+
+        Loading, joining and deleting replace paths or their element
+        sequences, moving elements changes the store, either makes the
+        index stale.
+
+        """
+        index = self.spatial_index
+        if index == None or index.store is not self.element_store or index.is_stale(self.paths):
+            self.spatial_index = SpatialIndex(self.paths, self.element_store)
+        return self.spatial_index
+
     def add_paths(self, new_paths):
         self.paths+=new_paths
 
@@ -128,5 +162,5 @@ class State(object):
             elif to["type"] == "topocketing":
                 op = TOPocketing(state=self, data=to)
             else:
-                debug("  Unknown tool operation: "+str(to["type"]))
+                debug("  Unknown tool operation: %s", to["type"])
             self.tool_operations.append(op)
@@ -8,7 +8,7 @@ class ToolType(object):
     ball = "ball"
 
 class Tool(object):
-    def __init__(self, name=None, typ=None, diameter=3, step=0.1, feedrate=20, default_height=20, data=None):
+    def __init__(self, name=None, typ=None, diameter=3, step=0.1, feedrate=20, default_height=20, tolerance=0.01, compression_tolerance=0, data=None):
         if data == None:
             self.diameter = diameter
             self.step = step
@@ -16,6 +16,8 @@ class Tool(object):
             self.type = typ
             self.name = name
             self.default_height = default_height
+            self.tolerance = tolerance
+            self.compression_tolerance = compression_tolerance
         else:
             self.deserialize(data)
         self.current_position = [0,0,0]
@@ -27,6 +29,8 @@ class Tool(object):
         self.type = tool.type
         self.name = tool.name
         self.default_height = tool.default_height
+        self.tolerance = tool.tolerance
+        self.compression_tolerance = tool.compression_tolerance
 
     def get_feedrate(self):
         return self.feedrate
@@ -34,12 +38,20 @@ class Tool(object):
     def get_settings_list(self):
         settings_lst = [TOSetting("float", 0, None, self.diameter, "Diameter, mm: ", self.set_diameter_s),
                         TOSetting("float", 0, None, self.feedrate, "Feedrate, mm/min: ", self.set_feedrate_s),
-                        TOSetting("float", 0, None, self.default_height, "Safe height, mm:", self.set_default_height_s)]
+                        TOSetting("float", 0, None, self.default_height, "Safe height, mm:", self.set_default_height_s),
+                        TOSetting("float", 0, None, self.tolerance, "Path tolerance, mm:", self.set_tolerance_s),
+                        TOSetting("float", 0, None, self.compression_tolerance, "Compression tolerance, mm (0 is off):", self.set_compression_tolerance_s)]
         return settings_lst
 
     def set_default_height_s(self, setting):
         self.default_height = setting.new_value
 
+    def set_tolerance_s(self, setting):
+        self.tolerance = setting.new_value
+
+    def set_compression_tolerance_s(self, setting):
+        self.compression_tolerance = setting.new_value
+
     def set_diameter_s(self, setting):
         self.diameter = setting.new_value
 
@@ -47,7 +59,7 @@ class Tool(object):
         self.feedrate = setting.new_value
 
     def serialize(self):
-        return {"type": "tool", "diameter": self.diameter, "feedrate": self.feedrate, "default_height": self.default_height, "name": self.name, "tool_type": self.type, "step": self.step}
+        return {"type": "tool", "diameter": self.diameter, "feedrate": self.feedrate, "default_height": self.default_height, "name": self.name, "tool_type": self.type, "step": self.step, "tolerance": self.tolerance, "compression_tolerance": self.compression_tolerance}
 
     def deserialize(self, data):
         self.diameter = data["diameter"]
@@ -56,3 +68,7 @@ class Tool(object):
         self.name = data["name"]
         self.type = data["tool_type"]
         self.step = data["step"]
+        # projects saved before path compression existed
+        self.tolerance = data.get("tolerance", 0.01)
+        # older projects export the same G-code they always did
+        self.compression_tolerance = data.get("compression_tolerance", 0)
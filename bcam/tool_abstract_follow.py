@@ -2,132 +2,140 @@ from __future__ import absolute_import, division, print_function
 
 from bcam.tool_operation import ToolOperation
 from bcam.singleton import Singleton
+from bcam.calc_utils import PolygonUtils, pt_to_pt_dist
+from bcam.elements import linearize_to_segments
+from bcam.toolpath_cache import mk_key
+from bcam.element_store import encode_elements, decode_elements
 
 from logging import debug, info, warning, error, critical
-from bcam.util import dbgfname
+from bcam.util import dbgfname, traced
 
-import cairo
 
 class TOAbstractFollow(ToolOperation):
     def __init__(self, state):
         super(TOAbstractFollow, self).__init__(state)
         self.draw_list = []
 
-    def set_lt(self, ctx):
-        if self.selected:
-            self.set_selected_lt(ctx)
-        else:
-            ctx.set_source_rgba(1, 0, 0, 0.5)
-            ctx.set_line_width(self.tool.diameter)
-
-    def set_fill_lt(self, ctx):
-        if self.selected:
-            self.set_selected_fill_lt(ctx)
-        else:
-            ctx.set_source_rgba(0.8, 0.1, 0.1, 0.5)
-            ctx.set_line_width(self.tool.diameter*0.9)
-
-    def set_selected_lt(self, ctx):
-        ctx.set_source_rgba(1, 0, 0, 1.0)
-        ctx.set_line_width(self.tool.diameter)
-
-    def set_selected_fill_lt(self, ctx):
-        ctx.set_source_rgba(0.8, 0.1, 0.1, 1.0)
-        ctx.set_line_width(self.tool.diameter*0.9)
-
-    def __draw_elements(self, ctx):
-        if self.draw_list != None:
-            for e in self.draw_list:
-                e.draw_element(ctx)
-
-    def draw(self, ctx):
-        if self.display:
-            ctx.set_line_join(cairo.LINE_JOIN_ROUND)
-            ctx.set_line_cap(cairo.LINE_CAP_ROUND)
-            self.set_lt(ctx)
-            self.__draw_elements(ctx)
-            ctx.stroke()
-
-            self.set_fill_lt(ctx)
-            self.__draw_elements(ctx)
-            ctx.stroke()
-
     def try_load_path_by_name(self, name, state):
         dbgfname()
         p = Singleton.state.get_path_by_name(name)
         if p == None:
-            debug("  Path "+str(name)+" not found")
+            debug("  Path %s not found", name)
             return False
         return p
 
 
+    def get_toolpath_ends(self):
+        # every pass returns to the start of the path
+        if not self.draw_list:
+            return None
+        return (self.draw_list[0].start, self.draw_list[0].start)
+
+    def get_contour(self):
+        if not self.draw_list:
+            return None
+        if pt_to_pt_dist(self.draw_list[0].start, self.draw_list[-1].end) > 0.001:
+            return None
+        return PolygonUtils(linearize_to_segments(self.draw_list, self.tool.tolerance))
+
+    def cache_params(self):
+        # everything besides the path elements the draw list depends on
+        return {"diameter": self.tool.diameter, "tolerance": self.tool.tolerance}
+
+    def cache_key(self, path):
+        return mk_key(self.name, self.cache_params(), path.ordered_elements)
+
+    def toolpath_data(self):
+        # operations that were never applied lack both
+        if not getattr(self, "draw_list", None) or getattr(self, "path", None) == None:
+            return None
+        return {"checksum": self.cache_key(self.path), "elements": encode_elements(self.draw_list)}
+
+    def restore_toolpath(self, data, path, lt):
+        """Takes the saved toolpath if it was computed from path as it is now."""
+        saved = data.get("toolpath")
+        if saved == None or not path.ordered_elements:
+            return False
+        if saved["checksum"] != self.cache_key(path):
+            debug("  saved toolpath of %s is stale", path.name)
+            return False
+        self.draw_list = decode_elements(saved["elements"], lt)
+        return True
+
+    @traced
     def process_el_to_gcode(self, e, step):
-        dbgfname()
-        out = ""
+        pp = self.state.settings.default_pp
+        z = -step*self.tool.diameter/2.0
+        new_pos = [e.end[0], e.end[1], z]
         if type(e).__name__ == "ELine":
-            new_pos = [e.start[0], e.start[1], -step*Singleton.state.get_tool().diameter/2.0]
-            out+= Singleton.state.settings.default_pp.move_to(new_pos)
-            Singleton.state.get_tool().current_position = new_pos
-
-            new_pos = [e.end[0], e.end[1], -step*Singleton.state.get_tool().diameter/2.0]
-            out+= Singleton.state.settings.default_pp.move_to(new_pos)
-            Singleton.state.get_tool().current_position = new_pos
+            out = pp.move_to([e.start[0], e.start[1], z])
+            out+= pp.move_to(new_pos)
         elif type(e).__name__ == "EArc":
+            out = pp.move_to([e.start[0], e.start[1], z])
             if e.turnaround:
-                new_pos = [e.start[0], e.start[1], -step*Singleton.state.get_tool().diameter/2.0]
-                out+= Singleton.state.settings.default_pp.move_to(new_pos)
-                Singleton.state.get_tool().current_position = new_pos
-                new_pos = [e.end[0], e.end[1], -step*Singleton.state.get_tool().diameter/2.0]
-                out+= Singleton.state.settings.default_pp.mk_ccw_arc(e.radius, new_pos)
-                Singleton.state.get_tool().current_position = new_pos
-
+                out+= pp.mk_ccw_arc(e.radius, new_pos)
             else:
-                new_pos = [e.start[0], e.start[1], -step*Singleton.state.get_tool().diameter/2.0]
-                out+= Singleton.state.settings.default_pp.move_to(new_pos)
-                Singleton.state.get_tool().current_position = new_pos
-                new_pos = [e.end[0], e.end[1], -step*Singleton.state.get_tool().diameter/2.0]
-                out+= Singleton.state.settings.default_pp.mk_cw_arc(e.radius, new_pos)
-                Singleton.state.get_tool().current_position = new_pos
+                out+= pp.mk_cw_arc(e.radius, new_pos)
         elif type(e).__name__ == "ECircle":
-            new_pos = [e.start[0], e.start[1], -step*Singleton.state.get_tool().diameter/2.0]
-            out+= Singleton.state.settings.default_pp.move_to(new_pos)
-            Singleton.state.get_tool().current_position = new_pos
-            new_pos = [e.end[0], e.end[1], -step*Singleton.state.get_tool().diameter/2.0]
+            out = pp.move_to([e.start[0], e.start[1], z])
             rel_center = [e.center[0]-e.end[0], e.center[1]-e.end[1], 0]
-            out+= Singleton.state.settings.default_pp.mk_cw_ijk_arc(rel_center, new_pos)
-            Singleton.state.get_tool().current_position = new_pos
-            
+            out+= pp.mk_cw_ijk_arc(rel_center, new_pos)
         else:
-            debug("unsuported element type: "+str(type(e).__name__))
+            debug("unsuported element type: %s", type(e).__name__)
+            return ""
+        self.tool.current_position = new_pos
         return out
 
-
-    def get_gcode_base(self, path):
+    def __lines_to_gcode(self, pts, z):
+        self.tool.current_position = [pts[-1][0], pts[-1][1], z]
+        return self.state.settings.compressor.gen_polyline_gcode(self.state.settings.default_pp, pts, z)
+
+    def gen_elements_gcode(self, elements, step):
+        # runs of lines go through the compressor and reach the
+        # postprocessor as one batch, nearly straight arcs join them
+        compressor = self.state.settings.compressor
+        z = -step*self.tool.diameter/2.0
+        pts = []
+        for e in elements:
+            name = type(e).__name__
+            if name == "ELine" or (name == "EArc" and compressor.is_flat(e)):
+                pts.append((e.start[0], e.start[1]))
+                pts.append((e.end[0], e.end[1]))
+            else:
+                if len(pts) > 0:
+                    for chunk in self.__lines_to_gcode(pts, z):
+                        yield chunk
+                    pts = []
+                yield self.process_el_to_gcode(e, step)
+        if len(pts) > 0:
+            for chunk in self.__lines_to_gcode(pts, z):
+                yield chunk
+
+    def gen_gcode_base(self, path):
+        pp = self.state.settings.default_pp
         cp = self.tool.current_position
-        out = ""
         new_pos = [cp[0], cp[1], self.tool.default_height]
-        out+= Singleton.state.settings.default_pp.move_to_rapid(new_pos)
+        yield pp.move_to_rapid(new_pos)
         self.tool.current_position = new_pos
 
         start = path[0].start
 
         new_pos = [start[0], start[1], new_pos[2]]
-        out+= Singleton.state.settings.default_pp.move_to_rapid(new_pos)
+        yield pp.move_to_rapid(new_pos)
         self.tool.current_position = new_pos
 
         for step in range(int(self.depth/(self.tool.diameter/2.0))+1):
-            for e in path:
-                out += self.process_el_to_gcode(e, step)
+            for chunk in self.gen_elements_gcode(path, step):
+                yield chunk
 
             new_pos = [self.tool.current_position[0], self.tool.current_position[1], self.tool.default_height]
-            out+= Singleton.state.settings.default_pp.move_to_rapid(new_pos)
+            yield pp.move_to_rapid(new_pos)
             self.tool.current_position = new_pos
 
             new_pos = [start[0], start[1], self.tool.default_height]
-            out+= Singleton.state.settings.default_pp.move_to_rapid(new_pos)
+            yield pp.move_to_rapid(new_pos)
             self.tool.current_position = new_pos
 
         new_pos = [self.tool.current_position[0], self.tool.current_position[1], self.tool.default_height]
-        out+= Singleton.state.settings.default_pp.move_to_rapid(new_pos)
+        yield pp.move_to_rapid(new_pos)
         self.tool.current_position = new_pos
-        return out
@@ -1,6 +1,5 @@
 from __future__ import absolute_import, division, print_function
 
-import math
 from bcam.tool_operation import ToolOperation, TOEnum
 from bcam.generalized_setting import TOSetting
 
@@ -31,37 +30,6 @@ class TODrill(ToolOperation):
         self.depth = data["depth"]
         self.index = data["index"]
 
-    def set_lt(self, ctx):
-        if self.selected:
-            self.set_selected_lt(ctx)
-        else:
-            ctx.set_source_rgba(1, 0, 0, 0.5)
-            ctx.set_line_width(0.1)
-
-    def set_fill_lt(self, ctx):
-        if self.selected:
-            self.set_selected_fill_lt(ctx)
-        else:
-            ctx.set_source_rgba(0.8, 0.1, 0.1, 0.5)
-            ctx.set_line_width(0.0)
-
-    def set_selected_lt(self, ctx):
-        ctx.set_source_rgba(1, 0, 0, 1.0)
-        ctx.set_line_width(0.1)
-
-    def set_selected_fill_lt(self, ctx):
-        ctx.set_source_rgba(0.8, 0.1, 0.1, 1.0)
-        ctx.set_line_width(0.0)
-
-    def draw(self, ctx):
-        if self.display:
-            self.set_lt(ctx)
-            ctx.arc(self.center[0], self.center[1], (self.tool.diameter/2.0), 0, 2*math.pi);
-            ctx.stroke()
-            self.set_fill_lt(ctx)
-            ctx.arc(self.center[0], self.center[1], (self.tool.diameter/2.0), 0, 2*math.pi);
-            ctx.fill()
-
     def apply(self, element, depth=0):
         self.depth = depth
         if (element.operations[self.name]):
@@ -84,26 +52,29 @@ class TODrill(ToolOperation):
     def set_center_y_s(self, setting):
         self.center[1] = setting.new_value
 
-    def get_gcode(self):
+    def gen_gcode(self):
         cp = self.tool.current_position
-        out = ""
         new_pos = [cp[0], cp[1], self.tool.default_height]
-        out+= self.state.settings.default_pp.move_to_rapid(new_pos)
+        yield self.state.settings.default_pp.move_to_rapid(new_pos)
         self.tool.current_position = new_pos
         new_pos = [self.center[0], self.center[1], new_pos[2]]
-        out+= self.state.settings.default_pp.move_to_rapid(new_pos)
+        yield self.state.settings.default_pp.move_to_rapid(new_pos)
         self.tool.current_position = new_pos
 
         for step in range(int(self.depth/(self.tool.diameter/2.0))+1):
             new_pos = [self.center[0], self.center[1], -step*self.tool.diameter/2.0]
-            out+= self.state.settings.default_pp.move_to(new_pos)
+            yield self.state.settings.default_pp.move_to(new_pos)
             new_pos = [self.center[0], self.center[1], self.tool.diameter]
-            out+= self.state.settings.default_pp.move_to_rapid(new_pos)
+            yield self.state.settings.default_pp.move_to_rapid(new_pos)
             
         new_pos = [self.center[0], self.center[1], self.tool.default_height]
-        out+= self.state.settings.default_pp.move_to_rapid(new_pos)
+        yield self.state.settings.default_pp.move_to_rapid(new_pos)
         self.tool.current_position = new_pos
-        return out
+
+    def get_toolpath_ends(self):
+        if self.center == None:
+            return None
+        return (self.center, self.center)
 
     def __repr__(self):
         return "<Drill at "+str(self.center)+">"
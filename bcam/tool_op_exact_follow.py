@@ -5,7 +5,6 @@ from bcam.tool_operation import ToolOperation, TOEnum
 from bcam.tool_abstract_follow import TOAbstractFollow
 from bcam.generalized_setting import TOSetting
 
-import cairo
 import json
 
 class TOExactFollow(TOAbstractFollow):
@@ -31,6 +30,10 @@ class TOExactFollow(TOAbstractFollow):
         if p:
             self.apply(p)
 
+    def toolpath_data(self):
+        # the toolpath is the path itself
+        return None
+
     def get_settings_list(self):
         settings_lst = [TOSetting("float", 0, self.state.settings.material.thickness, self.depth, "Depth, mm: ", self.set_depth_s),]
         return settings_lst
@@ -46,8 +49,8 @@ class TOExactFollow(TOAbstractFollow):
                 return True
         return False
 
-    def get_gcode(self):
-        return self.get_gcode_base(self.path.ordered_elements)
+    def gen_gcode(self):
+        return self.gen_gcode_base(self.path.ordered_elements)
 
     def __repr__(self):
         return "<Exact follow>"
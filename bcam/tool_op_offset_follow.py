@@ -8,12 +8,13 @@ from bcam.calc_utils import (find_vect_normal, mk_vect, normalize, vect_sum,
                              vect_len, scale_vect, pt_to_pt_dist)
 from bcam.elements import ELine, EArc, ECircle
 from bcam.singleton import Singleton
+from bcam.toolpath_cache import cache
 
 from logging import debug, info, warning, error, critical
-from bcam.util import dbgfname
+from bcam.util import dbgfname, traced
+from bcam import util
+from bcam.profiling import profiled
 
-
-import cairo
 import json
 
 class TOOffsetFollow(TOAbstractFollow):
@@ -42,7 +43,11 @@ class TOOffsetFollow(TOAbstractFollow):
 
         p = self.try_load_path_by_name(data["path_ref"], Singleton.state)
         if p:
-            self.apply(p)
+            if p.ordered_elements and self.restore_toolpath(data, p, p.ordered_elements[0].lt):
+                self.path = p
+                self.offset_path = self.draw_list
+            else:
+                self.apply(p)
 
     def get_settings_list(self):
         settings_lst = [TOSetting("float", 0, Singleton.state.settings.material.thickness, self.depth, "Depth, mm: ", self.set_depth_s),
@@ -54,9 +59,25 @@ class TOOffsetFollow(TOAbstractFollow):
 
     def set_offset_s(self, setting):
         self.offset = setting.new_value
-        self.offset_path = self.__build_offset_path(self.path)
+        self.offset_path = self.__cached_offset_path(self.path)
         self.draw_list = self.offset_path
 
+    def cache_params(self):
+        params = super(TOOffsetFollow, self).cache_params()
+        params["offset"] = self.offset
+        return params
+
+    def __cached_offset_path(self, p):
+        if len(p.ordered_elements) == 0:
+            return self.__build_offset_path(p)
+        key = self.cache_key(p)
+        offset_path = cache.get(key, p.ordered_elements[0].lt)
+        if offset_path == None:
+            offset_path = self.__build_offset_path(p)
+            if offset_path != None:
+                cache.put(key, offset_path)
+        return offset_path
+
     def __remove_intersected_parts(self, p):
         dbgfname()
         return p
@@ -71,8 +92,8 @@ class TOOffsetFollow(TOAbstractFollow):
         debug("  offset path is None")
         return None
 
+    @traced
     def __two_point_offset(self, prev, next):
-        dbgfname()
         nsc = next.start
         nec = next.end
         sc = prev.start
@@ -95,11 +116,13 @@ class TOOffsetFollow(TOAbstractFollow):
         if ((e_dx == 0) and (ne_dy == 0)):
             x = e_e_pt[0]
             y = ne_e_pt[1]
-            debug("  case 1, x: "+str(x)+" y: "+str(y))
+            if util.tracing:
+                debug("  case 1, x: %s y: %s", x, y)
         elif((e_dy == 0) and (ne_dx == 0)):
             x = ne_e_pt[0]
             y = e_e_pt[1]
-            debug("  case 2, x: "+str(x)+" y: "+str(y))
+            if util.tracing:
+                debug("  case 2, x: %s y: %s", x, y)
         elif (((e_dy == 0) and (ne_dy == 0)) or ((e_dx == 0) and (ne_dx == 0))): #parallel lines
             x = e_e_pt[0]
             y = e_e_pt[1]
@@ -107,19 +130,21 @@ class TOOffsetFollow(TOAbstractFollow):
             a = (ne_e_pt[0]*ne_s_pt[1]-ne_s_pt[0]*ne_e_pt[1])
             b = (e_e_pt[0]*e_s_pt[1]-e_s_pt[0]*e_e_pt[1])
 
-            debug("  a: "+str(a)+" b: "+str(b)+" e_dx: "+str(e_dx)+" e_dy: "+str(e_dy)+" ne_dx: "+str(ne_dx)+" ne_dy: "+str(ne_dy))
+            if util.tracing:
+                debug("  a: %s b: %s e_dx: %s e_dy: %s ne_dx: %s ne_dy: %s", a, b, e_dx, e_dy, ne_dx, ne_dy)
             
             x = (a*e_dx-b*ne_dx)/(e_dy*ne_dx-ne_dy*e_dx)
             if e_dx == 0:
                 y = (x*ne_dy+a)/ne_dx
             else:
                 y = (x*e_dy+b)/e_dx
-            debug("  case 3, x: "+str(x)+" y: "+str(y))
+            if util.tracing:
+                debug("  case 3, x: %s y: %s", x, y)
         e_pt = [x, y]
         return e_pt
 
+    @traced
     def __build_offset_path_normals(self, p):
-        dbgfname()
         new_elements = []
         elements = p.get_ordered_elements()
         if len(elements)==0:
@@ -146,26 +171,7 @@ class TOOffsetFollow(TOAbstractFollow):
             converted_elements = []
             for i, e in enumerate(elements):
                 if type(e).__name__ == "EArc":
-                    sa = e.startangle
-                    ea = e.endangle
-                    if sa > ea:
-                        ea+=math.pi*2
-                    da = (ea - sa)
-
-                    
-                    n_steps = int(da/0.1)
-                    s_pt = (e.center[0]+math.cos(sa)*e.radius, e.center[1]+math.sin(sa)*e.radius)
-                    debug("  splitting arc, start angle: "+str(sa)+" start_pt: "+str(s_pt))
-                    for i in range(1,n_steps):
-                        a = sa+i*0.1
-                        e_pt = (e.center[0]+math.cos(a)*e.radius, e.center[1]+math.sin(a)*e.radius)
-                        ne = ELine(s_pt, e_pt, e.lt, e.color)
-                        debug("  angle: "+str(a)+" line: "+str(s_pt)+" "+str(e_pt))
-                        s_pt = e_pt
-                        converted_elements.append(ne)
-                    e_pt = e.end
-                    ne = ELine(s_pt, e_pt, e.lt, e.color)
-                    converted_elements.append(ne)
+                    converted_elements += e.to_line_sequence(self.tool.tolerance)
                 else:
                     converted_elements.append(e)
 
@@ -208,23 +214,24 @@ class TOOffsetFollow(TOAbstractFollow):
                 s_pt = e_pt
                 e_pt = None
         offset_path = new_elements
-        debug("  offset_path: "+str(offset_path))
+        debug("  offset_path: %s", offset_path)
         return offset_path
 
+    @traced
+    @profiled("offset follow")
     def apply(self, path):
-        dbgfname()
-        debug("  apply path: "+str(path))
+        debug("  apply path: %s", path)
         if path.operations[self.name]:
-            debug("  path ordered elements: "+str(path.ordered_elements))
+            debug("  path ordered elements: %s", path.ordered_elements)
             if path.ordered_elements!=None:
                 self.path = path
-                self.offset_path = self.__build_offset_path(path)
+                self.offset_path = self.__cached_offset_path(path)
                 self.draw_list = self.offset_path
                 return True
         return False
 
-    def get_gcode(self):
-        return self.get_gcode_base(self.draw_list)
+    def gen_gcode(self):
+        return self.gen_gcode_base(self.draw_list)
 
     def __repr__(self):
         return "<Offset follow>"
@@ -5,266 +5,230 @@ from bcam.tool_operation import ToolOperation, TOEnum, TOResult
 from bcam.tool_abstract_follow import TOAbstractFollow
 from bcam.generalized_setting import TOSetting, TOSTypes
 from bcam.calc_utils import (find_vect_normal, mk_vect, normalize, vect_sum,
-                             vect_len, linearized_path_aabb,
-                             find_center_of_mass, sign, LineUtils)
-from bcam.elements import ELine, EArc, EPoint
+                             vect_len, segments_aabb,
+                             find_center_of_mass, sign, LineUtils,
+                             PolygonUtils, find_true_runs, find_iso_contours,
+                             simplify_polyline, pt_to_pt_dist,
+                             pts_to_segments_dist)
+from bcam.elements import ELine, EArc, EPoint, linearize_to_segments
 from bcam.singleton import Singleton
+from bcam.toolpath_cache import cache
 
 from logging import debug, info, warning, error, critical
-from bcam.util import dbgfname
+from bcam.util import dbgfname, traced
+from bcam import profiling
+from bcam.profiling import profiled
 
 import json
-import cairo
+import numpy as np
 from multiprocessing import Process, Pipe
 
 
+class TOPocketingStrategy(object):
+    radial = "radial"
+    contour = "contour"
+
+
 class TOPocketing(TOAbstractFollow):
+    # contour pockets sample a distance field over their bounding box, at
+    # most this many points of it
+    max_field_points = 1<<21
+
     def __init__(self, state, depth=0, index=0, offset=0, data=None):
         super(TOAbstractFollow, self).__init__(state)
         self.state = state
         self.name = TOEnum.pocket
         self.draw_list = []
         self.process = None
+        # cache key of the draw list being built in the subprocess
+        self.building_key = None
 
         if data == None:
             self.index = index
             self.depth = depth
             self.offset = (offset if offset!=0 else self.state.settings.get_tool().diameter/2.0)
             self.old_offset = offset
+            self.strategy = TOPocketingStrategy.radial
             self.path = None
         else:
             self.deserialize(data)
         self.display_name = TOEnum.pocket+" "+str(self.index)
 
     def serialize(self):
-        return {'type': 'topocketing', 'path_ref': self.path.name, 'depth': self.depth, 'index': self.index, 'offset': self.offset}
-
-    def __draw_elements(self, ctx):
-        if self.draw_list != None:
-            for e in self.draw_list:
-                e.draw_element(ctx)
-                ctx.stroke()
-
-    def draw(self, ctx):
-        if self.display:
-            ctx.set_line_join(cairo.LINE_JOIN_ROUND)
-            ctx.set_line_cap(cairo.LINE_CAP_ROUND)
-            self.set_lt(ctx)
-            self.__draw_elements(ctx)
-
-            self.set_fill_lt(ctx)
-            self.__draw_elements(ctx)
-
-    def __linearize_path(self, path, tolerance):
-        linearized_path = []
-        for e in path:
-            if type(e).__name__ == "EArc":
-                lpath = e.to_line_sequence(tolerance)
-                linearized_path += lpath
-            elif type(e).__name__ == "ECircle":
-                lpath = e.to_line_sequence(tolerance)
-                linearized_path += lpath
-            elif type(e).__name__ == "ELine":
-                linearized_path.append(e)
-        return linearized_path
-
-    # returns tuple [0]: if halfcrosses, [1]: if up
-    def __is_element_halfcrossing(self, el_coords):
-        if abs(el_coords[0][1])<0.0001 and abs(el_coords[1][1])>0.0001:
-            if el_coords[1][1] > 0:
-                return True, True
-            else:
-                return True, False
-        if abs(el_coords[1][1])<0.0001 and abs(el_coords[0][1])>0.0001:
-            if el_coords[0][1] > 0:
-                return True, False
-            else:
-                return True, True
-        return False, False
-
-    def __is_element_crossing(self, el_coords):
-        return sign(el_coords[0][1]) != sign(el_coords[1][1])
-
-    def __is_crossing_up(self, el_coords):
-        if el_coords[1][1] > el_coords[0][1]:
-            return True
-        return False
-
-    def __is_point_at_left(self, pt, element, up):        
-        v1x = element.start[0]-pt[0]
-        v1y = element.start[1]-pt[1]
-
-        v2x = element.end[0]-element.start[0]
-        v2y = element.end[1]-element.start[1]
-
-        cross_product = v1x*v2y-v1y*v2x
-        if (up and (cross_product > 0)):
-            return True
-        elif (not up) and (cross_product < 0):
-            return True
-        return False
-
-    def __is_pt_inside_path_winding(self, pt, path):
-        # if pt[0]<-26 and pt[1]<-16:
-        #     dbgfname()
-        e = path[0]
-
-        turns = 0
-        
-        for e in path:
-            sx = e.start[0] - pt[0]
-            sy = e.start[1] - pt[1]
-            ex = e.end[0] - pt[0]
-            ey = e.end[1] - pt[1]
-            el_coords = [[sx, sy], [ex, ey]]
-            halfcross, up = self.__is_element_halfcrossing(el_coords)
-            # if pt[0]<-26 and pt[1]<-16:
-            #     debug("  e: "+str(el_coords))
-            #     debug("  halfcross: "+str(halfcross)+" up: "+str(up))
-            if halfcross:
-                if self.__is_point_at_left(pt, e, up):
-                    if up:
-                        turns+=0.5
-                    else:
-                        turns-=0.5
-            elif self.__is_element_crossing(el_coords):
-                up = self.__is_crossing_up(el_coords)
-                # if pt[0]<-26 and pt[1]<-16:
-                #     debug("  e: "+str(el_coords))
-                #     debug("  cross: True, up: "+str(up))
-                
-                if self.__is_point_at_left(pt, e, up):
-                    if up:
-                        turns+=1
-                    else:
-                        turns-=1
-
-        # if pt[0]<-26 and pt[1]<-16:
-        #     debug("  turns: %f"%(turns,))
-            
-        if (abs(turns) >= 1):
-            return True
-        return False
+        return {'type': 'topocketing', 'path_ref': self.path.name, 'depth': self.depth, 'index': self.index, 'offset': self.offset, 'strategy': self.strategy}
 
+    @traced
     def build_points(self, path):
-        dbgfname()
         debug("  linearizing path")
-        lpath = self.__linearize_path(path, 0.1)
-        #lpath = path
+        lpath = linearize_to_segments(path, self.tool.tolerance)
+        pu = PolygonUtils(lpath)
 
-        path_aabb = linearized_path_aabb(lpath)
+        path_aabb = segments_aabb(lpath)
         left = path_aabb.left - 10
         right = path_aabb.right + 10
         top = path_aabb.top + 10
         bottom = path_aabb.bottom - 10
-        points = []
         step = 0.5
-        total_points = int(right-left+1)*int(top-bottom+1)//step
-        debug("  AABB: "+str(path_aabb))
-        point_counter = 0
-        x = left
-        while (x<right):
-            y = bottom
-            while (y<top):
-                debug("  checking pt: "+str(x)+" "+str(y)+" "+str(point_counter)+"/"+str(total_points))
-                if self.__is_pt_inside_path_winding((x, y), lpath):
-                    points.append(EPoint(center=[x, y], lt=self.state.settings.get_def_lt()))
-                    debug("  it fits")
-                point_counter += 1
-                y += step
-            x += step
-        debug("  points: "+str(points))
+        debug("  AABB: %s", path_aabb)
+        xs, ys = np.meshgrid(np.arange(left, right, step), np.arange(bottom, top, step), indexing="ij")
+        grid = np.column_stack((xs.ravel(), ys.ravel()))
+        debug("  checking %i points", len(grid))
+        profiling.count("points tested", len(grid))
+        inside = grid[pu.pts_inside(grid)]
+        points = [EPoint(center=pt, lt=self.state.settings.get_def_lt()) for pt in inside.tolist()]
+        debug("  points: %i", len(points))
         return points
 
-    def __check_if_pt_is_close(self, pt, path):
-        offset = self.offset
-        for e in path:
-            cu = e.get_cu()
-            if (cu.distance_to_pt(pt)<=offset):
-                return True
-        return False
-
+    @traced
     def build_circles(self, path):
-        dbgfname()
         debug("  linearizing path")
-        lpath = self.__linearize_path(path, 0.1)
+        lpath = linearize_to_segments(path, self.tool.tolerance)
+        pu = PolygonUtils(lpath)
         #x, y = find_center_of_mass(lpath)
 
-        path_aabb = linearized_path_aabb(lpath)
+        path_aabb = segments_aabb(lpath)
         left = path_aabb.left
         right = path_aabb.right
         top = path_aabb.top
         bottom = path_aabb.bottom
         x = (right-left)/2.0+left
         y = (top-bottom)/2.0+bottom
-        
+
         debug("  building paths")
         tool_paths = []
-        r = 0
         max_r = math.sqrt(((right-left)/2.0)**2+((top-bottom)/2.0)**2)
         tool_radius = self.tool.diameter/2.0
-        while r < max_r:
-            debug("  r: %f"%(r,))
-            r+=tool_radius
-            angle = 0
-            cur_x = x+r*math.cos(angle)
-            cur_y = y+r*math.sin(angle)
-            is_inside = False
-            start_angle = 0
-            end_angle = 0
-            if (self.__is_pt_inside_path_winding([cur_x, cur_y], lpath)):
-                debug("  cx: %f, cy: %f"%(cur_x, cur_y))
-                debug("  s start: "+str(start_angle))
-                is_inside = True
-            if self.__check_if_pt_is_close([cur_x, cur_y], lpath):
-                if is_inside:
-                    is_inside = False
-
-            while angle<=360:
-                cur_x = x+r*math.cos(math.radians(angle))
-                cur_y = y+r*math.sin(math.radians(angle))
-                close = self.__check_if_pt_is_close([cur_x, cur_y], lpath)
-                if not close:
-                    in_winding = self.__is_pt_inside_path_winding([cur_x, cur_y], lpath)
-                    if in_winding and (not is_inside):
-                        debug("  cx: %f, cy: %f"%(cur_x, cur_y))
-                        debug("  start: "+str(start_angle))
-                        start_angle = angle
-                        is_inside = True
-                    elif (not in_winding) and (is_inside):
-                        debug("  cx: %f, cy: %f"%(cur_x, cur_y))
-                        debug("  end: "+str(end_angle))
-                        end_angle = angle
-                        is_inside = False
-                        tool_paths.append(EArc(center=[x, y], radius=r, startangle=start_angle, endangle=end_angle, lt=self.state.settings.get_def_lt()))
-                elif is_inside:
-                    debug("  cx: %f, cy: %f"%(cur_x, cur_y))
-                    debug("  close end: "+str(end_angle))
-                    is_inside = False
-                    end_angle = angle
-                    tool_paths.append(EArc(center=[x, y], radius=r, startangle=start_angle, endangle=end_angle, lt=self.state.settings.get_def_lt()))
-
-                    
-                angle += 0.1
-            if is_inside:
-                debug("  cx: %f, cy: %f"%(cur_x, cur_y))
-                debug("  e end: "+str(angle))
-                tool_paths.append(EArc(center=[x, y], radius=r, startangle=start_angle, endangle=angle-0.1, lt=self.state.settings.get_def_lt()))
-
-                        
+        angles = np.arange(3601)*0.1
+        cos_a = np.cos(np.radians(angles))
+        sin_a = np.sin(np.radians(angles))
+        radii = tool_radius*np.arange(1, int(math.ceil(max_r/tool_radius))+1)
+        # a segment is somewhere between near and far from the center, a
+        # ring outside of that range doesn't cross it and stays further
+        # than the offset away from it once it's offset away from the range
+        segments = pu.segments
+        center = np.array([[x, y]])
+        near = pts_to_segments_dist(np.repeat(center, len(segments), axis=0), segments)
+        far = np.maximum(np.hypot(segments[:, 0]-x, segments[:, 1]-y),
+                         np.hypot(segments[:, 2]-x, segments[:, 3]-y))
+        slack = 1e-9
+        crossing = (radii >= near.min()-slack) & (radii <= far.max()+slack)
+        close = (np.searchsorted(np.sort(near-self.offset), radii+slack, "right") >
+                 np.searchsorted(np.sort(far+self.offset), radii-slack, "left"))
+        # rows of fits are rings, the rings that can't cross the path are
+        # inside if they're closer to the center than the path
+        fits = np.zeros((len(radii), len(angles)), dtype=bool)
+        fits[radii < near.min()] = pu.pt_inside((x, y))
+        rings = np.nonzero(crossing)[0]
+        pts = np.stack((x+np.outer(radii[rings], cos_a), y+np.outer(radii[rings], sin_a)), axis=2)
+        profiling.count("points tested", pts.size//2)
+        fits[rings] = pu.pts_inside(pts).reshape(len(rings), len(angles))
+        # every ring is tested in one go
+        rings = np.nonzero(close)[0]
+        pts = np.stack((x+np.outer(radii[rings], cos_a), y+np.outer(radii[rings], sin_a)), axis=2)
+        test = fits[rings]
+        profiling.count("points tested", int(test.sum()))
+        test[test] = ~pu.pts_close(pts[test], self.offset)
+        fits[rings] = test
+        for r, ring in zip(radii.tolist(), fits):
+            debug("  r: %f", r)
+            for first, last in find_true_runs(ring):
+                end_angle = angles[min(last, len(angles)-1)]
+                debug("  start: %f end: %f", angles[first], end_angle)
+                tool_paths.append(EArc(center=[x, y], radius=r, startangle=angles[first], endangle=end_angle, lt=self.state.settings.get_def_lt()))
+
         return tool_paths
-            
+
+    def __mk_link(self, pu, s, e, level):
+        # links are cut, so they have to stay away from the pocket walls
+        t = np.linspace(0.0, 1.0, 5)[:, None]
+        pts = np.asarray(s)+(np.asarray(e)-np.asarray(s))*t
+        if (pu.signed_distances_to_pts(pts) < level-0.001).any():
+            return None
+        return ELine(s, e, self.state.settings.get_def_lt())
+
+    @traced
+    def build_contours(self, path):
+        debug("  linearizing path")
+        lpath = linearize_to_segments(path, self.tool.tolerance)
+        pu = PolygonUtils(lpath)
+
+        path_aabb = segments_aabb(lpath)
+        stepover = self.tool.diameter/2.0
+        cell = stepover/4.0
+        # big pockets for small tools get a coarser field, up to half a
+        # stepover; margins and the last column add 5 cells, 2.5 stepovers
+        area = (path_aabb.right-path_aabb.left+3*stepover)*(path_aabb.top-path_aabb.bottom+3*stepover)
+        cell = max(cell, math.sqrt(area/self.max_field_points))
+        if cell > stepover/2.0:
+            warning("pocket too big for a %.3f mm tool, the distance field would need %i points, %i is the most",
+                    self.tool.diameter, int(area/(stepover/4.0)**2), self.max_field_points)
+            return None
+        margin = 2*cell
+        xs = np.arange(path_aabb.left-margin, path_aabb.right+margin+cell, cell)
+        ys = np.arange(path_aabb.bottom-margin, path_aabb.top+margin+cell, cell)
+        debug("  building distance field %ix%i", len(xs), len(ys))
+        profiling.count("points tested", len(xs)*len(ys))
+        field = pu.signed_distances_to_grid(xs, ys)
+
+        levels = []
+        level = self.offset
+        max_level = field.max()
+        while level < max_level:
+            levels.append(level)
+            level += stepover
+
+        debug("  building paths")
+        tool_paths = []
+        pos = None
+        # innermost loops first, the last loop finishes the pocket walls
+        for level in reversed(levels):
+            contours = [simplify_polyline(c, 0.01, True) for c in find_iso_contours(field, xs, ys, level)]
+            debug("  level: %f contours: %i", level, len(contours))
+            while len(contours)>0:
+                if pos == None:
+                    ci, vi = 0, 0
+                else:
+                    dists = [np.hypot(c[:, 0]-pos[0], c[:, 1]-pos[1]) for c in contours]
+                    ci = int(np.argmin([d.min() for d in dists]))
+                    vi = int(dists[ci].argmin())
+                contour = np.roll(contours.pop(ci), -vi, axis=0).tolist()
+                if pos != None and pt_to_pt_dist(pos, contour[0]) <= 2*stepover:
+                    link = self.__mk_link(pu, pos, contour[0], level)
+                    if link != None:
+                        tool_paths.append(link)
+                for s_pt, e_pt in zip(contour, contour[1:]+contour[:1]):
+                    tool_paths.append(ELine(s_pt, e_pt, self.state.settings.get_def_lt()))
+                pos = contour[0]
+
+        return tool_paths
+
     def deserialize(self, data):
         self.depth = data["depth"]
         self.index = data["index"]
         self.offset = data["offset"]
         self.old_offset = 0
+        if "strategy" in data:
+            self.strategy = data["strategy"]
+        else:
+            self.strategy = TOPocketingStrategy.radial
         p = self.try_load_path_by_name(data["path_ref"], self.state)
         self.path = p
+        if p and p.ordered_elements and not self.restore_toolpath(data, p, self.state.settings.get_def_lt()):
+            # pockets are recomputed on request only, unless already known
+            draw_list = cache.get(self.cache_key(p), self.state.settings.get_def_lt())
+            if draw_list != None:
+                self.draw_list = draw_list
+
+    def cache_params(self):
+        params = super(TOPocketing, self).cache_params()
+        params["offset"] = self.offset
+        params["strategy"] = self.strategy
+        return params
 
     def get_settings_list(self):            
         settings_lst = [TOSetting(TOSTypes.float, 0, self.state.settings.material.thickness, self.depth, "Depth, mm: ", self.set_depth_s),
                         TOSetting(TOSTypes.float, 0, None, self.offset, "Offset, mm: ", self.set_offset_s),
+                        TOSetting(TOSTypes.button, display_name="Strategy: "+self.strategy, parent_cb=self.clicked_strategy),
                         TOSetting(TOSTypes.button, display_name="Recalculate", parent_cb=self.clicked_recalculate)
         ]
         return settings_lst
@@ -275,10 +239,19 @@ class TOPocketing(TOAbstractFollow):
     def set_offset_s(self, setting):
         self.offset = setting.new_value
 
+    def clicked_strategy(self, setting):
+        if self.strategy == TOPocketingStrategy.contour:
+            self.strategy = TOPocketingStrategy.radial
+        else:
+            self.strategy = TOPocketingStrategy.contour
+        Singleton.mw.new_settings_vbox(self.get_settings_list(), self.display_name+" settings")
+        self.old_offset = None
+        self.clicked_recalculate(setting)
+
     def clicked_recalculate(self, setting):
         dbgfname()
         op = Singleton.state.get_operation_in_progress()
-        debug("  current operation:" + str(op))
+        debug("  current operation:%s", op)
         if op==None:
             if self.offset != self.old_offset:
                 self.old_offset = self.offset
@@ -286,62 +259,129 @@ class TOPocketing(TOAbstractFollow):
                 if self.apply(self.path)!=TOResult.ok:
                     debug("  pushing event to update pocketing state")
                     Singleton.ep.push_event(Singleton.ee.pocket_tool_click, None)
-
-    def build_circles_wrapper(self, pipe, path):
-        draw_list = self.build_circles(path.ordered_elements)
-        pipe.send(draw_list)
+                else:
+                    # known toolpaths come from the cache right away
+                    Singleton.state.unset_operation_in_progress()
+
+    @profiled("pocketing")
+    def build_draw_list(self, path):
+        if self.strategy == TOPocketingStrategy.contour:
+            return self.build_contours(path.ordered_elements)
+        return self.build_circles(path.ordered_elements)
+
+    def build_wrapper(self, pipe, path):
+        # only what this child measures goes back to be merged
+        profiling.reset()
+        draw_list = self.build_draw_list(path)
+        pipe.send((draw_list, profiling.snapshot()))
         pipe.close()
 
+    def receive_draw_list(self):
+        """Takes the draw list from the subprocess, returns a TOResult."""
+        draw_list, measured = self.parent.recv()
+        profiling.merge(measured)
+        key = self.building_key
+        self.building_key = None
+        if draw_list == None:
+            self.draw_list = []
+            return TOResult.failed
+        self.draw_list = draw_list
+        cache.put(key, self.draw_list)
+        return TOResult.ok
+
+    def cached_draw_list(self, path):
+        return cache.get(self.cache_key(path), self.state.settings.get_def_lt())
+
+    def apply_now(self, path):
+        # builds the toolpath in this process, for callers without an
+        # event loop to poll a subprocess from
+        if path != None and path.operations[self.name] and path.ordered_elements!=None:
+            self.path = path
+            self.draw_list = self.cached_draw_list(path)
+            if self.draw_list == None:
+                self.draw_list = self.build_draw_list(path)
+                if self.draw_list == None:
+                    self.draw_list = []
+                    return TOResult.failed
+                cache.put(self.cache_key(path), self.draw_list)
+            return TOResult.ok
+        return TOResult.failed
+
     def apply(self, path):
         #dbgfname()
         if path != None:
             if path.operations[self.name]:
                 if path.ordered_elements!=None:
                     self.path = path
+                    draw_list = self.cached_draw_list(path)
+                    if draw_list != None:
+                        self.draw_list = draw_list
+                        return TOResult.ok
+                    self.building_key = self.cache_key(path)
                     parent, child = Pipe()
                     self.parent = parent
                     debug("  starting subprocess")
-                    self.process = Process(target=self.build_circles_wrapper, args=(child, path))
+                    self.process = Process(target=self.build_wrapper, args=(child, path))
                     self.process.start()
                     if self.process.is_alive():
                         return TOResult.repeat
-                    self.draw_list = self.parent.recv()
-                    debug("  joining: "+str(self.draw_list))
+                    result = self.receive_draw_list()
+                    debug("  joining: %s", self.draw_list)
                     self.process.join()
                     self.process = None
-                    return TOResult.ok
+                    return result
         else:
             if self.process != None:
                 if self.process.is_alive():
                     return TOResult.repeat
-                self.draw_list = self.parent.recv()
-                debug("  joining: "+str(self.draw_list))
+                result = self.receive_draw_list()
+                debug("  joining: %s", self.draw_list)
                 self.process.join()
                 self.process = None
-                return TOResult.ok
+                return result
         return TOResult.failed
 
-    def get_gcode(self):
+    def get_toolpath_ends(self):
+        if not self.draw_list:
+            return None
+        return (self.draw_list[0].start, self.draw_list[-1].end)
+
+    def get_contour(self):
+        return None
+
+    def gen_gcode(self):
+        pp = self.state.settings.default_pp
         cp = self.tool.current_position
-        out = ""
         new_pos = [cp[0], cp[1], self.tool.default_height]
-        out+= self.state.settings.default_pp.move_to_rapid(new_pos)
+        yield pp.move_to_rapid(new_pos)
         self.tool.current_position = new_pos
 
 
         for step in range(int(self.depth/(self.tool.diameter/2.0))+1):
+            run = []
             for e in self.draw_list:
-                start = list(e.start)
-                new_pos = start[:2]+[self.tool.default_height]
-                out+=self.state.settings.default_pp.move_to_rapid(new_pos)
-                self.tool.current_position = new_pos
-
-                out += self.process_el_to_gcode(e, step)
-
-                new_pos = self.tool.current_position[:2]+[self.tool.default_height]
-                out+=self.state.settings.default_pp.move_to_rapid(new_pos)
-                self.tool.current_position = new_pos
-        return out
+                # connected elements are cut without retracting
+                if len(run) > 0 and pt_to_pt_dist(e.start, run[-1].end)<=0.001:
+                    run.append(e)
+                    continue
+                for chunk in self.gen_elements_gcode(run, step):
+                    yield chunk
+                run = [e]
+                if pt_to_pt_dist(e.start, self.tool.current_position)>0.001:
+                    if self.tool.current_position[2] != self.tool.default_height:
+                        new_pos = self.tool.current_position[:2]+[self.tool.default_height]
+                        yield pp.move_to_rapid(new_pos)
+                        self.tool.current_position = new_pos
+                    start = list(e.start)
+                    new_pos = start[:2]+[self.tool.default_height]
+                    yield pp.move_to_rapid(new_pos)
+                    self.tool.current_position = new_pos
+            for chunk in self.gen_elements_gcode(run, step):
+                yield chunk
+
+            new_pos = self.tool.current_position[:2]+[self.tool.default_height]
+            yield pp.move_to_rapid(new_pos)
+            self.tool.current_position = new_pos
 
     def __repr__(self):
         return "<Pocketing>"
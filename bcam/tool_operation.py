@@ -19,14 +19,23 @@ class ToolOperation(object):
         self.display = True
         self.selected = False
 
-    def draw(self, ctx):
-        pass
-
     def apply(self, element):
         pass
 
+    def gen_gcode(self):
+        # G-code is produced in chunks, so long programs can be streamed
+        return iter(())
+
     def get_gcode(self):
-        return ""
+        return "".join(self.gen_gcode())
+
+    def get_toolpath_ends(self):
+        # where the tool enters and leaves the cut, None if it never does
+        return None
+
+    def get_contour(self):
+        # PolygonUtils of the closed outline this operation cuts out
+        return None
 
     def update(self, args):
         pass
@@ -40,6 +49,11 @@ class ToolOperation(object):
     def deserialize(self, data):
         pass
 
+    def toolpath_data(self):
+        # computed toolpath to embed in project files, None when there is
+        # nothing worth saving
+        return None
+
     def set_selected(self):
         self.selected = True
 
@@ -0,0 +1,182 @@
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+from bcam.elements import ELine, EArc, ECircle, EPoint
+from bcam import profiling
+
+from logging import debug, info, warning, error, critical
+
+element_types = {"eline": ELine, "earc": EArc, "ecircle": ECircle, "epoint": EPoint}
+
+def key_data(v):
+    # floats are rounded to a nanometer, so geometry that went through a
+    # project file (arc angles are saved in radians, given in degrees)
+    # still hashes the same
+    if isinstance(v, float):
+        return round(v, 9)
+    if isinstance(v, (list, tuple)):
+        return [key_data(i) for i in v]
+    if isinstance(v, dict):
+        return dict((k, key_data(i)) for k, i in v.items())
+    return v
+
+def mk_key(kind, params, elements):
+    """Content address of a toolpath.
+
+    Hashes the operation kind, the parameters the toolpath depends on and
+    the elements it is computed from, so equal geometry gets the same key
+    whatever path or project it comes from.
+
+    """
+    h = hashlib.sha1()
+    h.update(json.dumps([kind, key_data(params)], sort_keys=True).encode("utf-8"))
+    for e in elements:
+        h.update(json.dumps(key_data(e.serialize()), sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+class ToolpathCache(object):
+    """Computed draw lists of tool operations by content address.
+
+    Draw lists are kept serialized, so every get returns elements of its
+    own.  The most recently used max_entries are kept in memory, with a
+    directory set they are written there too and survive restarts.  Once
+    the entries in the directory take more than max_disk_bytes, the least
+    recently used ones are removed, see prune.
+
+    """
+    format_version = 1
+
+    def __init__(self, max_entries=32, directory=None, max_disk_bytes=256<<20):
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.directory = None
+        self.disk_bytes = 0
+        self.set_directory(directory)
+
+    def set_directory(self, directory, max_disk_bytes=None):
+        if directory != None and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        if max_disk_bytes != None:
+            self.max_disk_bytes = max_disk_bytes
+        self.disk_bytes = sum(size for mtime, size, f in self.__disk_entries())
+        if self.disk_bytes > self.max_disk_bytes:
+            self.prune()
+
+    def __disk_entries(self):
+        # (mtime, size, file) of the entries in the directory
+        if self.directory == None:
+            return []
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            f = os.path.join(self.directory, name)
+            try:
+                st = os.stat(f)
+            except OSError:
+                # removed by another process meanwhile
+                continue
+            found.append((st.st_mtime, st.st_size, f))
+        return found
+
+    def prune(self, max_bytes=None):
+        """Removes the least recently used entries from the directory.
+
+        Goes down to three quarters of max_bytes, max_disk_bytes by
+        default, so not every put has to prune.  Returns the number of
+        entries removed.
+
+        """
+        if max_bytes == None:
+            max_bytes = self.max_disk_bytes
+        found = sorted(self.__disk_entries())
+        total = sum(size for mtime, size, f in found)
+        removed = 0
+        for mtime, size, f in found:
+            if total <= max_bytes*3//4:
+                break
+            try:
+                os.remove(f)
+                removed+= 1
+            except OSError:
+                pass
+            total-= size
+        self.disk_bytes = total
+        debug("  toolpath cache pruned %i entries", removed)
+        return removed
+
+    def clear(self):
+        self.entries.clear()
+
+    def __file(self, key):
+        return os.path.join(self.directory, key+".json")
+
+    def __load(self, key):
+        if self.directory == None or not os.path.exists(self.__file(key)):
+            return None
+        try:
+            f = open(self.__file(key))
+            data = json.loads(f.read())
+            f.close()
+        except (IOError, OSError, ValueError) as e:
+            warning("  unreadable toolpath cache entry %s: %s", key, e)
+            return None
+        if data.get("format_version") != self.format_version:
+            return None
+        return data["elements"]
+
+    def __touch(self, key):
+        # the modification time tells prune when an entry was used last
+        if self.directory == None:
+            return
+        try:
+            os.utime(self.__file(key), None)
+        except OSError:
+            pass
+
+    def __store(self, key, serialized):
+        tmp = self.__file(key)+".tmp"
+        try:
+            f = open(tmp, "w")
+            f.write(json.dumps({"format_version": self.format_version, "elements": serialized}))
+            f.close()
+            self.disk_bytes+= os.path.getsize(tmp)
+            os.rename(tmp, self.__file(key))
+        except (IOError, OSError) as e:
+            warning("  can't write toolpath cache entry %s: %s", key, e)
+        if self.disk_bytes > self.max_disk_bytes:
+            self.prune()
+
+    def __remember(self, key, serialized):
+        self.entries.pop(key, None)
+        self.entries[key] = serialized
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, key, lt):
+        """Fresh elements of the draw list stored under key, None on a miss."""
+        serialized = self.entries.pop(key, None)
+        if serialized == None:
+            serialized = self.__load(key)
+        if serialized == None:
+            profiling.count("toolpath cache misses")
+            return None
+        self.__remember(key, serialized)
+        self.__touch(key)
+        profiling.count("toolpath cache hits")
+        debug("  toolpath cache hit %s", key)
+        return [element_types[e["type"]](lt=lt, data=e) for e in serialized]
+
+    def put(self, key, draw_list):
+        serialized = [e.serialize() for e in draw_list]
+        self.__remember(key, serialized)
+        if self.directory != None:
+            self.__store(key, serialized)
+
+cache = ToolpathCache()
@@ -0,0 +1,68 @@
+from __future__ import absolute_import, division, print_function
+
+import math
+import numpy as np
+
+from bcam.calc_utils import simplify_polyline, fit_arcs
+
+from logging import debug, info, warning, error, critical
+from bcam.util import dbgfname
+
+class ToolpathCompressor(object):
+    """Shrinks cutting moves before they reach the postprocessor.
+
+    Runs of short lines are merged where they are collinear and refitted
+    as G02/G03 arcs where they follow a circle, both within tolerance.
+    The number of blocks saved is counted over a whole program.
+
+    """
+    def __init__(self, tolerance=0):
+        self.reset(tolerance)
+
+    def reset(self, tolerance):
+        self.tolerance = tolerance
+        self.blocks_in = 0
+        self.blocks_out = 0
+
+    def get_removed(self):
+        return self.blocks_in-self.blocks_out
+
+    def is_flat(self, e):
+        # an arc that never leaves its chord by more than tolerance can
+        # be cut as a line and merged with its neighbours
+        if self.tolerance <= 0:
+            return False
+        if e.is_turnaround:
+            sweep = (e.startangle-e.endangle)%(2*math.pi)
+        else:
+            sweep = (e.endangle-e.startangle)%(2*math.pi)
+        return sweep <= math.pi and e.radius*(1-math.cos(sweep/2)) <= self.tolerance
+
+    def __lines(self, pp, pts, z):
+        moves = np.empty((len(pts), 3))
+        moves[:, :2] = pts
+        moves[:, 2] = z
+        self.blocks_out+= len(pts)-1
+        return pp.move_to_batch(moves)
+
+    def gen_polyline_gcode(self, pp, pts, z):
+        pts = np.asarray(pts, dtype=float)
+        step = np.hypot(*np.diff(pts, axis=0).T)
+        pts = pts[np.concatenate(([True], step > 1e-9))]
+        self.blocks_in+= len(pts)-1
+        if self.tolerance <= 0 or len(pts) < 3:
+            yield self.__lines(pp, pts, z)
+            return
+
+        pos = 0
+        for first, last, center, ccw in fit_arcs(pts, self.tolerance):
+            yield self.__lines(pp, simplify_polyline(pts[pos:first+1], self.tolerance), z)
+            end = [pts[last][0], pts[last][1], z]
+            r = math.hypot(end[0]-center[0], end[1]-center[1])
+            if ccw:
+                yield pp.mk_ccw_arc(r, end)
+            else:
+                yield pp.mk_cw_arc(r, end)
+            self.blocks_out+= 1
+            pos = last
+        yield self.__lines(pp, simplify_polyline(pts[pos:], self.tolerance), z)
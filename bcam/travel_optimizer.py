@@ -0,0 +1,185 @@
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+from bcam.calc_utils import pt_to_pt_dist
+from bcam.tool_operation import TOEnum
+from bcam.tool_op_pocketing import TOPocketingStrategy
+
+from logging import debug, info, warning, error, critical
+from bcam.util import traced
+
+def _dist(a, b):
+    d = a-b
+    return np.hypot(d[..., 0], d[..., 1])
+
+def travel_length(entries, exits, order, start):
+    """Rapid travel from start through the items in order, exit to entry."""
+    if len(order) == 0:
+        return 0.0
+    entries = np.asarray(entries, dtype=float)[order]
+    exits = np.asarray(exits, dtype=float)[order]
+    return float(_dist(np.asarray(start[:2], dtype=float), entries[0])+_dist(exits[:-1], entries[1:]).sum())
+
+def order_by_travel(entries, exits, start, max_sweeps=20):
+    """Orders items to shorten the rapid travel between them.
+
+    Every item is entered at entries[i] and left at exits[i], travel
+    starts at start. The tour is built nearest neighbour first and then
+    improved with 2-opt; reversing a stretch of the tour keeps the
+    direction each item is cut in. Returns a list of item indices.
+
+    """
+    entries = np.asarray(entries, dtype=float).reshape(-1, 2)
+    exits = np.asarray(exits, dtype=float).reshape(-1, 2)
+    n = len(entries)
+    if n < 2:
+        return list(range(n))
+
+    start = np.asarray(start[:2], dtype=float)
+    left = np.ones(n, dtype=bool)
+    order = []
+    pos = start
+    for k in range(n):
+        d = _dist(entries, pos)
+        d[~left] = np.inf
+        i = int(d.argmin())
+        order.append(i)
+        left[i] = False
+        pos = exits[i]
+
+    order = np.array(order)
+    for sweep in range(max_sweeps):
+        improved = False
+        en = entries[order]
+        ex = exits[order]
+        fwd = np.concatenate(([0], np.cumsum(_dist(ex[:-1], en[1:]))))
+        bwd = np.concatenate(([0], np.cumsum(_dist(ex[1:], en[:-1]))))
+        for i in range(n-1):
+            # try reversing order[i:j+1] for every j at once
+            prev = start if i == 0 else ex[i-1]
+            js = np.arange(i+1, n)
+            delta = _dist(en[js], prev)-_dist(en[i], prev)
+            delta+= (bwd[js]-bwd[i])-(fwd[js]-fwd[i])
+            nxt = js[:-1]+1
+            delta[:-1]+= _dist(en[nxt], ex[i])-_dist(en[nxt], ex[js[:-1]])
+            k = int(delta.argmin())
+            if delta[k] < -1e-9:
+                j = js[k]
+                order[i:j+1] = order[i:j+1][::-1]
+                improved = True
+                en = entries[order]
+                ex = exits[order]
+                fwd = np.concatenate(([0], np.cumsum(_dist(ex[:-1], en[1:]))))
+                bwd = np.concatenate(([0], np.cumsum(_dist(ex[1:], en[:-1]))))
+        if not improved:
+            break
+    return order.tolist()
+
+def split_runs(elements):
+    """Splits elements into runs that are cut without lifting the tool."""
+    runs = []
+    for e in elements:
+        if len(runs) > 0 and pt_to_pt_dist(e.start, runs[-1][-1].end) <= 0.001:
+            runs[-1].append(e)
+        else:
+            runs.append([e])
+    return runs
+
+class TravelOptimizer(object):
+    """Reorders tool operations, and the runs inside pockets, to cut down
+    rapid travel.
+
+    Features inside a closed contour are cut before the contour itself, so
+    parts are not freed from the stock while they still have work to do.
+    Runs of contour strategy pockets keep their innermost first order, the
+    last loop finishes the pocket walls.
+
+    """
+    def __init__(self, state):
+        self.state = state
+
+    def __pocket_passes(self, op):
+        return int(op.depth/(op.tool.diameter/2.0))+1
+
+    def __pocket_travel(self, op, runs):
+        entries = [r[0].start[:2] for r in runs]
+        exits = [r[-1].end[:2] for r in runs]
+        return travel_length(entries, exits, list(range(len(runs))), entries[0])*self.__pocket_passes(op)
+
+    def __optimize_pocket(self, op):
+        runs = split_runs(op.draw_list)
+        if len(runs) < 3:
+            return 0.0, 0.0
+        if op.strategy == TOPocketingStrategy.contour:
+            travel = self.__pocket_travel(op, runs)
+            return travel, travel
+        before = self.__pocket_travel(op, runs)
+        entries = [r[0].start[:2] for r in runs]
+        exits = [r[-1].end[:2] for r in runs]
+        order = order_by_travel(entries, exits, entries[0])
+        runs = [runs[i] for i in order]
+        after = self.__pocket_travel(op, runs)
+        if after < before:
+            op.draw_list = [e for r in runs for e in r]
+            return before, after
+        return before, before
+
+    def __depths(self, ops, ends):
+        contours = [(op, op.get_contour()) for op in ops]
+        contours = [(op, pu) for op, pu in contours if pu != None]
+        depths = []
+        for op, end in zip(ops, ends):
+            depth = 0
+            for other, pu in contours:
+                if other is not op and pu.pt_inside(end[0][:2]):
+                    depth+= 1
+            depths.append(depth)
+        return depths
+
+    @traced
+    def optimize(self):
+        """Reorders the operations in place, returns the estimated rapid
+        travel in mm before and after."""
+        ops = self.state.tool_operations
+        before = 0.0
+        after = 0.0
+        for op in ops:
+            if op.name == TOEnum.pocket and op.draw_list:
+                b, a = self.__optimize_pocket(op)
+                before+= b
+                after+= a
+
+        origin = [0, 0]
+        ends = [op.get_toolpath_ends() for op in ops]
+        movable = [(op, e) for op, e in zip(ops, ends) if e != None]
+        fixed = [op for op, e in zip(ops, ends) if e == None]
+        if len(movable) == 0:
+            return before, after
+        m_ops = [op for op, e in movable]
+        m_ends = [e for op, e in movable]
+        entries = [e[0][:2] for e in m_ends]
+        exits = [e[1][:2] for e in m_ends]
+        old_travel = travel_length(entries, exits, list(range(len(m_ops))), origin)
+        before+= old_travel
+
+        # deepest nested features first, each level continues where the
+        # previous one left the tool
+        depths = self.__depths(m_ops, m_ends)
+        order = []
+        pos = origin
+        for depth in sorted(set(depths), reverse=True):
+            level = [i for i, d in enumerate(depths) if d == depth]
+            level_order = order_by_travel([entries[i] for i in level], [exits[i] for i in level], pos)
+            order+= [level[i] for i in level_order]
+            pos = exits[order[-1]]
+        new_travel = travel_length(entries, exits, order, origin)
+        nested_ok = all(a >= b for a, b in zip(depths, depths[1:]))
+        if nested_ok and old_travel <= new_travel:
+            order = list(range(len(m_ops)))
+            new_travel = old_travel
+        after+= new_travel
+
+        self.state.tool_operations[:] = [m_ops[i] for i in order]+fixed
+        debug("  travel before: %s after: %s", before, after)
+        return before, after
@@ -1,19 +1,104 @@
 from __future__ import absolute_import, division, print_function
 
 from logging import debug, info, warning, error, critical
-import traceback
+import functools
 import sys
+import time
+import types
 
-# from stackoverflow:: http://stackoverflow.com/questions/251464/how-to-get-the-function-name-as-string-in-python
-
-def who_am_i(depth):
-   stack = traceback.extract_stack()
-   filename, codeline, funcName, text = stack[-depth]
-   return filename, codeline, funcName
+# Tracing is off unless --log is given.  Call sites check the flag first,
+# so a disabled dbgfname costs one function call and functions marked with
+# traced run unwrapped.
+tracing = False
+trace_stats = {}
+traced_functions = []
 
 def dbgfname():
-    fn, cl, func = who_am_i(3)
-    debug("In "+fn+":"+str(cl)+" "+func)
+    if not tracing:
+        return
+    frame = sys._getframe(1)
+    code = frame.f_code
+    debug("In %s:%i %s", code.co_filename, frame.f_lineno, code.co_name)
+
+def traced(f):
+    """Marks f to be timed and logged on entry while tracing.
+
+    f itself is returned, the timing wrapper is only put in its place by
+    set_tracing(True).  Generators would only be timed to their creation,
+    so they shouldn't be marked.
+
+    """
+    traced_functions.append(f)
+    return f
+
+def mk_traced_wrapper(f, name):
+    code = f.__code__
+    where = "%s:%i %s" % (code.co_filename, code.co_firstlineno, f.__name__)
+    stats = trace_stats.setdefault(name, [0, 0.0])
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        debug("In %s", where)
+        t = time.time()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            stats[0]+= 1
+            stats[1]+= time.time()-t
+    wrapper.traced_function = f
+    return wrapper
+
+def traced_namespaces():
+    for mname, m in list(sys.modules.items()):
+        if m == None or not mname.startswith("bcam"):
+            continue
+        yield None, m.__dict__
+        for v in list(m.__dict__.values()):
+            if isinstance(v, type) and v.__module__ == mname:
+                yield mname+"."+v.__name__, v
+
+def set_traced_attr(owner, k, v):
+    if isinstance(owner, dict):
+        owner[k] = v
+    else:
+        setattr(owner, k, v)
+
+def set_tracing(enabled):
+    """Turns tracing on or off, swapping timing wrappers of traced functions in or out."""
+    global tracing
+    tracing = enabled
+    originals = dict((id(f), f) for f in traced_functions)
+    for prefix, owner in traced_namespaces():
+        d = owner if isinstance(owner, dict) else owner.__dict__
+        for k, v in list(d.items()):
+            if not isinstance(v, types.FunctionType):
+                continue
+            f = getattr(v, "traced_function", v)
+            if id(f) not in originals or originals[id(f)] is not f:
+                continue
+            if enabled and v is f:
+                name = (prefix if prefix != None else f.__module__)+"."+f.__name__
+                set_traced_attr(owner, k, mk_traced_wrapper(f, name))
+            elif not enabled and v is not f:
+                set_traced_attr(owner, k, f)
+
+def reset_trace_stats():
+    for stats in trace_stats.values():
+        stats[0] = 0
+        stats[1] = 0.0
+
+def merge_trace_stats(other):
+    for name, (calls, total) in other.items():
+        stats = trace_stats.setdefault(name, [0, 0.0])
+        stats[0]+= calls
+        stats[1]+= total
+
+def trace_report():
+    """Per function timing lines, slowest first."""
+    lines = []
+    for name, (calls, total) in sorted(trace_stats.items(), key=lambda i: -i[1][1]):
+        if calls > 0:
+            lines.append("%10.3fs %9i calls %10.1fus/call  %s" % (total, calls, total/calls*1e6, name))
+    return lines
 
 NOT_SET = False
 SET = True
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Microbenchmark of element allocation and traversal.
+
+Creates the kind of temporary lines pocketing and offsetting produce,
+reports bytes and time per element and the time of a pass reading their
+endpoints and capabilities.
+
+    python benchmarks/bench_elements.py [count]
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import gc
+import os
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2.7, sizes aren't measured
+    tracemalloc = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bcam.elements import ELine, EArc
+from bcam.tool_operation import TOEnum
+
+
+def mk_lines(n):
+    return [ELine((i*0.1, 0.0), (i*0.1+0.1, 0.0)) for i in range(n)]
+
+def mk_arcs(n):
+    return [EArc((i, 0.0), 1.0, 0, 90) for i in range(n)]
+
+def traverse(elements):
+    total = 0.0
+    for e in elements:
+        if e.operations[TOEnum.offset_follow] and e.joinable:
+            total+= e.end[0]-e.start[0]
+    return total
+
+def mk_size(mk, n):
+    if tracemalloc == None:
+        return None
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    elements = mk(n)
+    size = tracemalloc.get_traced_memory()[0]-base
+    tracemalloc.stop()
+    del elements
+    gc.collect()
+    return size/n
+
+def measure(name, mk, n):
+    size = mk_size(mk, n)
+
+    t = time.time()
+    elements = mk(n)
+    t_mk = time.time()-t
+    t = time.time()
+    traverse(elements)
+    t_traverse = time.time()-t
+    print("%-6s %8s bytes/element %8.0f ns/element created %8.0f ns/element traversed" %
+          (name, "%i" % size if size != None else "n/a", t_mk/n*1e9, t_traverse/n*1e9))
+    return size
+
+def run(n):
+    print("%i elements" % n)
+    measure("ELine", mk_lines, n)
+    measure("EArc", mk_arcs, n)
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,54 @@
+import gc
+import pytest
+from bcam import profiling
+from bcam.toolpath_cache import cache
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2.7, peak memory isn't recorded
+    tracemalloc = None
+
+
+@pytest.fixture
+def stage(benchmark):
+    """Benchmarks one stage of toolpath generation.
+
+    stage(f, items, setup) times f(*setup()) with a fresh setup for every
+    round.  The toolpath cache is emptied before every round, memory and
+    directory, unless cached is set, then every round after the untimed
+    one is a cache hit.  One more untimed run records the peak memory of the stage,
+    where tracemalloc is available, and the profiling counters it bumps.
+    Throughput is items per second of the mean round, all of it ends up in
+    the extra_info of the saved results, unless benchmarking is disabled.
+
+    """
+    def run(f, items, setup=None, rounds=5, cached=False):
+        def mk_args():
+            if not cached:
+                cache.clear()
+                if cache.directory != None:
+                    cache.prune(0)
+            return setup() if setup != None else ()
+        args = mk_args()
+        gc.collect()
+        profiling.reset()
+        peak = None
+        if tracemalloc != None:
+            tracemalloc.start()
+        f(*args)
+        if tracemalloc != None:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        counters = profiling.snapshot()["counters"]
+        del args
+
+        result = benchmark.pedantic(f, setup=lambda: (mk_args(), {}), rounds=rounds)
+        benchmark.extra_info["items"] = items
+        if benchmark.stats is not None:
+            # None with --benchmark-disable
+            benchmark.extra_info["items_per_second"] = items/benchmark.stats.stats.mean
+        benchmark.extra_info["peak_bytes"] = peak
+        benchmark.extra_info["counters"] = counters
+        return result
+    return run
@@ -0,0 +1,127 @@
+"""Scaling of every stage from input file to G-code.
+
+    python -m pytest benchmarks --benchmark-sort=name --benchmark-json=out.json
+
+Sizes are picked so that each stage shows how it grows, from a few
+hundred elements to about a hundred thousand.
+
+"""
+import io
+import os
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import workloads
+from bcam import cli
+from bcam.state import State
+from bcam.path import Path
+from bcam.tool_op_offset_follow import TOOffsetFollow
+from bcam.tool_op_pocketing import TOPocketing, TOPocketingStrategy
+from bcam.tool_operation import TOResult
+from bcam.gcode_writer import GCodeWriter, gen_program
+
+gear_dxf = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "gear.dxf")
+teeth = [12, 48, 192, 768]
+polyline_segments = [1000, 10000, 100000]
+holes = [1000, 10000]
+pocket_sizes = [20, 80, 200]
+
+
+def mk_path(elements):
+    return Path(State(), elements, "bench", "default")
+
+def mk_offset_follow(elements):
+    contour = mk_path(elements).mk_contours()[0]
+    to = TOOffsetFollow(contour.state, depth=1)
+    to.offset = 1.0
+    return to, contour
+
+def apply_pocketing(to, contour):
+    assert to.apply_now(contour) == TOResult.ok
+
+def emit(state):
+    f = io.StringIO()
+    GCodeWriter(f).write_all(gen_program(state))
+    return f
+
+def mk_job_state(elements, recipe):
+    state = State()
+    state.add_paths([Path(state, elements, "bench", "default")])
+    cli.apply_recipe(state, recipe)
+    return state
+
+
+# Loading.
+def test_load_gear_dxf_file(stage):
+    pytest.importorskip("dxfgrabber")
+    stage(cli.load_state, 364, lambda: (gear_dxf,))
+
+@pytest.mark.parametrize("n", teeth)
+def test_load_dxf_gear(stage, tmp_path, n):
+    pytest.importorskip("dxfgrabber")
+    path = workloads.write(tmp_path, "gear.dxf", workloads.dxf_text(workloads.gear_elements(n)))
+    stage(cli.load_state, 4*n, lambda: (path,))
+
+@pytest.mark.parametrize("n", polyline_segments)
+def test_load_dxf_polyline(stage, tmp_path, n):
+    pytest.importorskip("dxfgrabber")
+    path = workloads.write(tmp_path, "polyline.dxf", workloads.dxf_text(workloads.dense_polyline(n)))
+    stage(cli.load_state, n, lambda: (path,))
+
+@pytest.mark.parametrize("n", holes)
+def test_load_excellon(stage, tmp_path, n):
+    path = workloads.write(tmp_path, "board.drl", workloads.drill_file(n))
+    stage(cli.load_state, n, lambda: (path,))
+
+
+# Chaining elements into contours.
+@pytest.mark.parametrize("n", teeth)
+def test_contours_gear(stage, n):
+    stage(Path.mk_contours, 4*n, lambda: (mk_path(workloads.gear_elements(n)),))
+
+@pytest.mark.parametrize("n", polyline_segments)
+def test_contours_polyline(stage, n):
+    stage(Path.mk_contours, n, lambda: (mk_path(workloads.dense_polyline(n)),))
+
+
+# Toolpaths.
+@pytest.mark.parametrize("n", teeth)
+def test_offset_follow_gear(stage, n):
+    stage(TOOffsetFollow.apply, 4*n, lambda: mk_offset_follow(workloads.gear_elements(n)))
+
+@pytest.mark.parametrize("n", polyline_segments[:2])
+def test_offset_follow_polyline(stage, n):
+    stage(TOOffsetFollow.apply, n, lambda: mk_offset_follow(workloads.dense_polyline(n)))
+
+@pytest.mark.parametrize("strategy", [TOPocketingStrategy.radial, TOPocketingStrategy.contour])
+@pytest.mark.parametrize("size", pocket_sizes)
+def test_pocketing(stage, size, strategy):
+    def setup():
+        contour = mk_path(workloads.pocket_outline(size)).mk_contours()[0]
+        to = TOPocketing(contour.state, depth=1)
+        to.strategy = strategy
+        return to, contour
+    # throughput is in mm^2 of pocket
+    stage(apply_pocketing, size*size, setup, rounds=3)
+
+@pytest.mark.parametrize("size", pocket_sizes)
+def test_pocketing_cached(stage, size):
+    def setup():
+        contour = mk_path(workloads.pocket_outline(size)).mk_contours()[0]
+        return TOPocketing(contour.state, depth=1), contour
+    # a pocket computed before, in this or an earlier run
+    stage(apply_pocketing, size*size, setup, cached=True)
+
+
+# G-code emission.
+@pytest.mark.parametrize("n", holes)
+def test_emit_drills(stage, tmp_path, n):
+    state = cli.load_state(workloads.write(tmp_path, "board.drl", workloads.drill_file(n)))
+    cli.apply_recipe(state, {"optimize_travel": False, "operations": [{"type": "drill", "depth": 1}]})
+    stage(emit, n, lambda: (state,))
+
+@pytest.mark.parametrize("n", teeth)
+def test_emit_gear(stage, n):
+    state = mk_job_state(workloads.gear_elements(n), {"operations": [{"type": "offset follow", "offset": 1, "depth": 2}]})
+    stage(emit, 4*n, lambda: (state,))
@@ -0,0 +1,95 @@
+"""Generated inputs for the benchmarks.
+
+Every generator is deterministic, so timings of different runs compare.
+Elements come out as plain lists, drawings as DXF text and drill files as
+Excellon text, ready to be written next to the benchmark.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bcam.elements import ELine, EArc
+
+
+def polar(r, a):
+    return (r*math.cos(math.radians(a)), r*math.sin(math.radians(a)))
+
+def gear_elements(teeth, module=1.0):
+    """Closed outline of a spur gear, like gear.dxf.
+
+    Every tooth is a root arc, a straight flank, a tip arc and the other
+    flank, so the outline has 4*teeth elements.
+
+    """
+    pitch = 360.0/teeth
+    tip_r = module*teeth/2.0+module
+    root_r = module*teeth/2.0-1.25*module
+    elements = []
+    for i in range(teeth):
+        a = i*pitch
+        elements.append(EArc((0, 0), root_r, a, a+0.5*pitch))
+        elements.append(ELine(polar(root_r, a+0.5*pitch), polar(tip_r, a+0.6*pitch)))
+        elements.append(EArc((0, 0), tip_r, a+0.6*pitch, a+0.9*pitch))
+        elements.append(ELine(polar(tip_r, a+0.9*pitch), polar(root_r, a+pitch)))
+    return elements
+
+def dense_polyline(segments, radius=50.0):
+    """Closed wavy outline of short lines, like a traced or exported spline."""
+    pts = [polar(radius+2*math.sin(math.radians(7*a)), a)
+           for a in (i*360.0/segments for i in range(segments))]
+    return [ELine(s, e) for s, e in zip(pts, pts[1:]+pts[:1])]
+
+def pocket_outline(size):
+    """Square pocket of side size with rounded corners."""
+    r = size/10.0
+    h = size/2.0
+    return [ELine((-h+r, -h), (h-r, -h)), EArc((h-r, -h+r), r, -90, 0),
+            ELine((h, -h+r), (h, h-r)), EArc((h-r, h-r), r, 0, 90),
+            ELine((h-r, h), (-h+r, h)), EArc((-h+r, h-r), r, 90, 180),
+            ELine((-h, h-r), (-h, -h+r)), EArc((-h+r, -h+r), r, 180, 270)]
+
+def drill_file(holes, pitch=2.54):
+    """Excellon text of a PCB with holes on a square grid."""
+    side = int(math.ceil(math.sqrt(holes)))
+    lines = ["M48", "METRIC,TZ", "%"]
+    for i in range(holes):
+        lines.append("X%.3fY%.3f" % ((i%side)*pitch, (i//side)*pitch))
+    lines.append("M30")
+    return "\n".join(lines)+"\n"
+
+def dxf_text(elements):
+    """Minimal DXF drawing of lines, arcs and circles on layer 0."""
+    out = ["0", "SECTION", "2", "HEADER", "9", "$ACADVER", "1", "AC1009", "0", "ENDSEC",
+           "0", "SECTION", "2", "TABLES",
+           "0", "TABLE", "2", "LAYER", "70", "1",
+           "0", "LAYER", "2", "0", "70", "0", "62", "7", "6", "CONTINUOUS",
+           "0", "ENDTAB", "0", "ENDSEC",
+           "0", "SECTION", "2", "ENTITIES"]
+    for e in elements:
+        name = type(e).__name__
+        if name == "ELine":
+            out+= ["0", "LINE", "8", "0",
+                   "10", repr(e.start[0]), "20", repr(e.start[1]), "30", "0.0",
+                   "11", repr(e.end[0]), "21", repr(e.end[1]), "31", "0.0"]
+        elif name == "EArc":
+            out+= ["0", "ARC", "8", "0",
+                   "10", repr(e.center[0]), "20", repr(e.center[1]), "30", "0.0",
+                   "40", repr(e.radius), "50", repr(math.degrees(e.startangle)), "51", repr(math.degrees(e.endangle))]
+        elif name == "ECircle":
+            out+= ["0", "CIRCLE", "8", "0",
+                   "10", repr(e.center[0]), "20", repr(e.center[1]), "30", "0.0",
+                   "40", repr(e.radius)]
+    out+= ["0", "ENDSEC", "0", "EOF"]
+    return "\n".join(out)+"\n"
+
+def write(directory, name, text):
+    path = os.path.join(str(directory), name)
+    f = open(path, "w")
+    f.write(text)
+    f.close()
+    return path
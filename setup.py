@@ -18,10 +18,10 @@ setup(
     keywords = "CAM, hobby, CNC",
     url = "http://hobbycam.org",
     packages=['bcam'],
-    scripts=['bcam-launcher'],
+    scripts=['bcam-launcher', 'bcam-batch'],
     long_description=read('README.md'),
     dependency_links = ['https://bitbucket.org/snegovick/dxfgrabber/downloads/dxfgrabber-0.7.4.tar.gz#egg=dxfgrabber-0.7.4'],
-    install_requires = ['dxfgrabber'],
+    install_requires = ['dxfgrabber', 'numpy'],
     classifiers=[
         "Development Status :: 4 - Beta",
         "Topic :: Scientific/Engineering :: Human Machine Interfaces",
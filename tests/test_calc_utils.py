@@ -1,4 +1,5 @@
 from math import pi, sqrt
+import numpy as np
 import pytest
 from bcam import calc_utils
 
@@ -83,3 +84,232 @@ def test_circle_distance_to_pt(center, radius, inner_space, pt, distance):
 def test_angle_in_range(startangle, endangle, angle, expected):
    au = calc_utils.ArcUtils((0, 0), 1, startangle * pi/180, endangle * pi/180)
    assert au.check_angle_in_range(angle * pi/180) == expected
+
+
+# Test PolygonUtils.
+def mk_polygon(pts):
+    return [calc_utils.LineUtils(s, e) for s, e in zip(pts, pts[1:]+pts[:1])]
+
+square = [(0, 0), (10, 0), (10, 10), (0, 10)]
+u_shape = [(0, 0), (10, 0), (10, 10), (7, 10), (7, 3), (3, 3), (3, 10), (0, 10)]
+
+@pytest.mark.parametrize('polygon, pt, expected', [
+    (square, (5, 5), True),
+    (square, (-1, 5), False),
+    (square, (5, 11), False),
+    (square, (9.9, 0.1), True),
+    (list(reversed(square)), (5, 5), True),
+    (u_shape, (1.5, 8), True),
+    (u_shape, (5, 8), False),
+    (u_shape, (5, 1.5), True),
+    (u_shape, (8.5, 8), True),
+])
+def test_polygon_pt_inside(polygon, pt, expected):
+    pu = calc_utils.PolygonUtils(mk_polygon(polygon))
+    assert pu.pt_inside(pt) == expected
+
+def test_polygon_pts_inside_batch():
+    pu = calc_utils.PolygonUtils(mk_polygon(u_shape))
+    pts = [(1.5, 8), (5, 8), (5, 1.5), (8.5, 8), (20, 20)]
+    assert pu.pts_inside(pts).tolist() == [True, False, True, True, False]
+
+@pytest.mark.parametrize('pt, distance', [
+    ((5, 5), 5),
+    ((5, -2), 2),
+    ((12, 13), sqrt(13)),
+    ((1, 9), 1),
+])
+def test_polygon_distances_to_pts(pt, distance):
+    pu = calc_utils.PolygonUtils(mk_polygon(square))
+    assert abs(pu.distances_to_pts([pt])[0] - distance) < 1e-9
+
+@pytest.mark.parametrize('mask, runs', [
+    ([False, True, True, False, True], [(1, 3), (4, 5)]),
+    ([True, True], [(0, 2)]),
+    ([False, False], []),
+])
+def test_find_true_runs(mask, runs):
+    assert calc_utils.find_true_runs(mask) == runs
+
+
+# Test iso contours.
+def polygon_area(pts):
+    pts = pts.tolist()
+    return 0.5*sum(x0*y1-x1*y0 for (x0, y0), (x1, y1) in zip(pts, pts[1:]+pts[:1]))
+
+def mk_radial_field(fn):
+    xs = np.linspace(-12, 12, 97)
+    ys = np.linspace(-12, 12, 97)
+    gx, gy = np.meshgrid(xs, ys, indexing='ij')
+    return fn(np.hypot(gx, gy), gx, gy), xs, ys
+
+def test_iso_contours_circle():
+    field, xs, ys = mk_radial_field(lambda r, x, y: 10-r)
+    contours = calc_utils.find_iso_contours(field, xs, ys, 0)
+    assert len(contours) == 1
+    c = contours[0]
+    assert np.abs(np.hypot(c[:, 0], c[:, 1])-10).max() < 0.01
+    assert abs(polygon_area(c)-pi*100) < 1
+
+def test_iso_contours_hole_is_clockwise():
+    field, xs, ys = mk_radial_field(lambda r, x, y: np.minimum(10-r, r-4))
+    areas = sorted(polygon_area(c) for c in calc_utils.find_iso_contours(field, xs, ys, 0))
+    assert areas[0] < 0 < areas[1]
+
+def test_iso_contours_split():
+    field, xs, ys = mk_radial_field(lambda r, x, y: np.maximum(3-np.hypot(x-4, y), 3-np.hypot(x+4, y)))
+    assert len(calc_utils.find_iso_contours(field, xs, ys, 0)) == 2
+
+
+# Test polyline simplification.
+def test_simplify_polyline_closed():
+    pts = [(0, 0), (1, 0), (2, 0), (2, 1), (2, 2), (1, 2), (0, 2), (0, 1)]
+    out = calc_utils.simplify_polyline(pts, 0.01, True)
+    assert out.tolist() == [[0, 0], [2, 0], [2, 2], [0, 2]]
+
+def test_simplify_polyline_open():
+    pts = [(0, 0), (1, 0.005), (2, 0), (3, 1)]
+    out = calc_utils.simplify_polyline(pts, 0.01)
+    assert out.tolist() == [[0, 0], [2, 0], [3, 1]]
+
+def test_simplify_polyline_doubling_back():
+    pts = [(0, 0), (5, 0), (10, 0), (5, 0)]
+    out = calc_utils.simplify_polyline(pts, 0.01)
+    assert out.tolist() == [[0, 0], [10, 0], [5, 0]]
+
+def test_decimate_segments():
+    # a wavy line of 1000 segments, a separate tiny loop and a separate line
+    x = np.linspace(0, 100, 1001)
+    pts = np.column_stack((x, 0.01*np.sin(x*10)))
+    wavy = np.hstack((pts[:-1], pts[1:]))
+    loop = [[50, 50, 50.1, 50], [50.1, 50, 50, 50.1], [50, 50.1, 50, 50]]
+    out = calc_utils.decimate_segments(np.vstack((wavy, loop, [[0, 10, 5, 10]])), 0.5)
+    assert [len(p) for p in out] == [2, 1, 2]
+    assert out[0].tolist() == [[0, 0], pts[-1].tolist()]
+    assert out[1].tolist() == [[50.05, 50.05]]
+    assert calc_utils.decimate_segments(np.zeros((0, 4)), 1) == []
+
+
+# Test arc fitting.
+def mk_arc_pts(center, r, a0, a1, step):
+    a = np.arange(a0, a1, step) if a1 > a0 else -np.arange(-a0, -a1, step)
+    return np.column_stack((center[0]+r*np.cos(a), center[1]+r*np.sin(a)))
+
+@pytest.mark.parametrize('a0, a1, ccw', [(0, 2*pi, True), (2*pi, 0, False)])
+def test_fit_arcs_circle(a0, a1, ccw):
+    pts = mk_arc_pts((3, 4), 20, a0, a1, 0.1)
+    arcs = calc_utils.fit_arcs(pts, 0.01)
+    assert arcs[0][0] == 0 and arcs[-1][1] == len(pts)-1
+    for (first, last, center, arc_ccw), nxt in zip(arcs, arcs[1:]+[None]):
+        assert arc_ccw == ccw
+        assert np.allclose(center, (3, 4))
+        if nxt is not None:
+            assert nxt[0] == last
+
+def test_fit_arcs_rejects_polygons():
+    assert calc_utils.fit_arcs(mk_arc_pts((0, 0), 10, 0, 2*pi, pi/4), 0.01) == []
+    zigzag = [(i, (i%2)*0.5) for i in range(10)]
+    assert calc_utils.fit_arcs(zigzag, 0.01) == []
+    line = [(i, 0) for i in range(10)]
+    assert calc_utils.fit_arcs(line, 0.01) == []
+
+def test_fit_arcs_between_lines():
+    pts = np.vstack(([(-10, 20), (-5, 20)], mk_arc_pts((0, 0), 20, pi/2, 0, 0.05), [(20, -5), (20, -10)]))
+    arcs = calc_utils.fit_arcs(pts, 0.01)
+    assert len(arcs) == 1
+    first, last, center, ccw = arcs[0]
+    assert (first, last, ccw) == (2, len(pts)-3, False)
+
+
+# Test SegmentIndex.
+def mk_zigzag(n):
+    xs = np.arange(n+1, dtype=float)
+    ys = np.where(np.arange(n+1)%2 == 0, 0.0, 3.0)
+    pts = np.column_stack((xs, ys))
+    return np.column_stack((pts[:-1], pts[1:]))
+
+def brute_force_distances(pts, segments):
+    return np.array([calc_utils.pts_to_segments_dist(np.repeat([pt], len(segments), axis=0), segments).min()
+                     for pt in pts])
+
+@pytest.mark.parametrize('n, cell_size', [
+    (1, None),
+    (7, None),
+    (500, None),
+    (500, 0.3),
+])
+def test_segment_index_nearest(n, cell_size):
+    segments = mk_zigzag(n)
+    index = calc_utils.SegmentIndex(segments, cell_size)
+    r = np.random.RandomState(0)
+    # points far away and points among the segments
+    pts = np.vstack((r.uniform(-10, n+10, (200, 2)),
+                     np.column_stack((r.uniform(-1, n+1, 200), r.uniform(-2, 5, 200)))))
+    nearest, dist = index.nearest_to_pts(pts)
+    expected = brute_force_distances(pts, segments)
+    assert np.allclose(dist, expected)
+    assert np.allclose(calc_utils.pts_to_segments_dist(pts, segments[nearest]), expected)
+    assert (index.pts_within(pts, 2.5) == (expected <= 2.5)).all()
+
+@pytest.mark.parametrize('pt, r, expected', [
+    ((5, 5), 5, True),
+    ((5, 5), 4.9, False),
+    ((-1, -1), 1.5, True),
+    ((20, 5), 1, False),
+])
+def test_segment_index_any_within(pt, r, expected):
+    index = calc_utils.SegmentIndex(mk_polygon(square))
+    assert index.any_within(pt, r) == expected
+
+def test_segment_index_nearest_single():
+    index = calc_utils.SegmentIndex(mk_polygon(square))
+    assert index.nearest((5, -2)) == (0, 2.0)
+    assert index.nearest((12, 5)) == (1, 2.0)
+
+@pytest.mark.parametrize('polygon, step', [
+    (square, 0.37),
+    (u_shape, 0.1),
+    (u_shape, 1.0),
+])
+def test_signed_distances_to_grid(polygon, step):
+    pu = calc_utils.PolygonUtils(mk_polygon(polygon))
+    # not a whole number of tiles, with points right on the path
+    xs = np.arange(-2, 12.01, step)
+    ys = np.concatenate(([-3, -1], np.arange(0, 10.01, step), [10.5]))
+    gx, gy = np.meshgrid(xs, ys, indexing="ij")
+    expected = pu.signed_distances_to_pts(np.column_stack((gx.ravel(), gy.ravel())))
+    assert np.allclose(pu.signed_distances_to_grid(xs, ys), expected.reshape(gx.shape))
+
+
+
+# Test arc linearization.
+@pytest.mark.parametrize('r, sweep, tolerance', [
+    (0.25, 2*pi, 0.01),
+    (500, pi/3, 0.01),
+    (10, -pi, 0.001),
+    (1, 2*pi, 5),
+])
+def test_linearize_arcs_within_tolerance(r, sweep, tolerance):
+    pts, bounds = calc_utils.linearize_arcs([(1, 2)], [r], [0.5], [sweep], tolerance)
+    assert list(bounds) == [0, len(pts)]
+    mids = (pts[1:]+pts[:-1])/2
+    sagitta = r-np.hypot(mids[:, 0]-1, mids[:, 1]-2)
+    assert sagitta.max() <= tolerance+1e-12
+    # one chord less would break the tolerance
+    n = len(pts)-1
+    if n > 1:
+        assert r*(1-np.cos(abs(sweep)/(n-1)/2)) > tolerance
+    assert pts[-1] == pytest.approx([1+r*np.cos(0.5+sweep), 2+r*np.sin(0.5+sweep)])
+
+def test_segment_count_follows_size():
+    counts = calc_utils.arc_segment_counts([0.25, 250], [2*pi, 2*pi], 0.01)
+    assert counts[0] < 20 < 300 < counts[1]
+
+def test_linearize_segments_keeps_order():
+    segments, counts = calc_utils.linearize_segments(
+        [(0, 0), (10, 0), (10, 10)], [(10, 0), (10, 10), (0, 0)], [False, True, False],
+        [(0, 0), (10, 5), (0, 0)], [0, 5, 0], [0, -pi/2, 0], [0, pi, 0], 0.01)
+    assert counts[0] == 1 and counts[2] == 1 and counts[1] > 10
+    assert len(segments) == counts.sum()
+    assert (segments[1:, :2] == segments[:-1, 2:]).all()
+    assert list(segments[0]) == [0, 0, 10, 0] and list(segments[-1]) == [10, 10, 0, 0]
@@ -0,0 +1,65 @@
+import json
+import subprocess
+import sys
+import pytest
+from bcam.state import State
+from bcam.path import Path
+from bcam.elements import ELine, ECircle, EPoint
+from bcam.tool_operation import TOEnum
+from bcam import cli
+
+
+def mk_state():
+    state = State()
+    square = [(0, 0), (60, 0), (60, 40), (0, 40)]
+    elements = [ELine(s, e) for s, e in zip(square, square[1:]+square[:1])]
+    elements += [ECircle((20, 20), 8), ECircle((45, 20), 1), EPoint((50, 30))]
+    state.add_paths([Path(state, elements, "drawing", "default")])
+    return state
+
+recipe = {"tool": {"diameter": 2},
+          "material": {"thickness": 3},
+          "operations": [{"type": "offset follow", "select": "outer", "offset": 1},
+                         {"type": "drill", "max_diameter": 2.5},
+                         {"type": "pocket", "select": "holes", "depth": 1}]}
+
+
+def test_apply_recipe():
+    state = mk_state()
+    cli.apply_recipe(state, recipe)
+    names = [op.name for op in state.tool_operations]
+    assert sorted(names) == sorted([TOEnum.offset_follow, TOEnum.drill, TOEnum.drill, TOEnum.pocket])
+    # the outline is cut last, after everything inside it
+    assert names[-1] == TOEnum.offset_follow
+    pocket = [op for op in state.tool_operations if op.name == TOEnum.pocket][0]
+    assert pocket.depth == 1 and len(pocket.draw_list) > 0
+    drills = sorted(op.center for op in state.tool_operations if op.name == TOEnum.drill)
+    assert drills == [[45, 20], [50, 30]]
+
+def test_apply_recipe_unknown_operation():
+    with pytest.raises(ValueError):
+        cli.apply_recipe(mk_state(), {"operations": [{"type": "engrave"}]})
+
+def test_batch_run(tmp_path, capsys):
+    for k in range(3):
+        (tmp_path/("board%i.drl" % k)).write_text("METRIC,TZ\n"+"".join("X%i.0Y%i.5\n" % (i, k) for i in range(5)))
+    (tmp_path/"recipe.json").write_text('{"operations": [{"type": "drill", "depth": 3}]}')
+    out = tmp_path/"out"
+    assert cli.run([str(tmp_path), "-r", str(tmp_path/"recipe.json"), "-o", str(out), "-j", "2"]) == 0
+    printed = capsys.readouterr().out
+    assert printed.count("ok ") == 3 and "3 jobs, 0 failed" in printed
+    assert (out/"board1.ngc").read_text().count("G01 Z-3.000") == 5
+
+def test_no_gui_imports():
+    code = "import sys, bcam.cli; print([m for m in sys.modules if m.split('.')[0] in ('gtk', 'cairo', 'pygtk', 'gobject')])"
+    assert subprocess.check_output([sys.executable, "-c", code]).strip() == b"[]"
+
+def test_batch_profile(tmp_path, capsys):
+    (tmp_path/"board.drl").write_text("METRIC,TZ\nX1.0Y1.0\nX2.0Y2.0\n")
+    (tmp_path/"recipe.json").write_text('{"operations": [{"type": "drill", "depth": 3}]}')
+    profile = tmp_path/"profile.json"
+    assert cli.run([str(tmp_path/"board.drl"), "-r", str(tmp_path/"recipe.json"), "--profile", str(profile)]) == 0
+    report = json.loads(profile.read_text())
+    assert report["spans"]["job"]["calls"] == 1 and report["spans"]["write gcode"]["calls"] == 1
+    assert report["counters"]["gcode lines"] > 0 and report["counters"]["gcode bytes"] > 0
+    assert report["jobs"][str(tmp_path/"board.drl")]["counters"] == report["counters"]
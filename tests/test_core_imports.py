@@ -0,0 +1,43 @@
+import subprocess
+import sys
+import pytest
+
+core_modules = ["bcam.elements", "bcam.settings", "bcam.path", "bcam.state",
+                "bcam.tool_op_drill", "bcam.tool_op_exact_follow",
+                "bcam.tool_op_offset_follow", "bcam.tool_op_pocketing",
+                "bcam.gcode_writer", "bcam.project", "bcam.profiling",
+                "bcam.spatial_index", "bcam.selection"]
+
+
+@pytest.mark.parametrize("module", core_modules)
+def test_core_is_gui_free(module):
+    code = "import sys, %s; print([m for m in sys.modules if m.split('.')[0] in ('gtk', 'cairo', 'pygtk', 'gobject')])" % module
+    assert subprocess.check_output([sys.executable, "-c", code]).strip() == b"[]"
+
+
+class RecordingContext(object):
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args):
+            self.calls.append((name,)+args)
+            if name.endswith("_extents"):
+                return (0, 0, 1, 1)
+        return call
+
+
+def test_record_path():
+    pytest.importorskip("cairo")
+    from bcam import render_cairo
+    from bcam.state import State
+    from bcam.path import Path
+    from bcam.elements import ELine, ECircle
+    state = State()
+    p = Path(state, [ELine((0, 0), (1, 0)), ECircle((5, 5), 2)], "p", "default")
+    ctx = RecordingContext()
+    dl = render_cairo.DisplayList(p, None, None)
+    render_cairo.record_path(ctx, dl, p)
+    # both elements are drawn alike, one path
+    assert len(dl.items) == 1
+    assert ("arc", 5, 5, 2, 0, render_cairo.math.pi*2) in ctx.calls
@@ -0,0 +1,140 @@
+import gc
+import pickle
+import pytest
+from bcam.state import State
+from bcam.path import Path
+from bcam.elements import ELine, EArc, ECircle, EPoint, linearize_to_segments
+from bcam.element_store import encode_elements, decode_elements
+from bcam.tool_operation import TOEnum
+
+
+def mk_elements():
+    return [ELine((0, 0), (10, 0)),
+            EArc((10, 5), 5, -90, 90),
+            ECircle((30, 30), 2),
+            EPoint((-5, 7))]
+
+
+def test_views_keep_identity_and_write_through():
+    state = State()
+    p = Path(state, mk_elements(), "p", "default")
+    line, arc, circle, point = p.elements
+    assert [type(e).__name__ for e in p.elements] == ["ELine", "EArc", "ECircle", "EPoint"]
+    assert p.elements[0] is line and line in p.elements
+    assert line.start == (0, 0) and arc.radius == 5 and point.center == (-5, 7)
+    assert circle.operations[TOEnum.drill] and not circle.joinable
+
+    line.end = (10, 1)
+    arc.toggle_selected()
+    again = Path(state, [line, arc], "q", "default")
+    assert again.elements[0] is line and again.elements[0].end == (10, 1)
+    assert again.elements[1].selected and not line.selected
+    assert len(state.element_store) == 4
+
+def test_paths_share_appended_rows():
+    state = State()
+    p = Path(state, [], "p", "default")
+    for i in range(100):
+        p.add_element(ELine((i, 0), (i+1, 0)))
+    first = p.elements
+    p.add_element(EPoint((0, 0)))
+    assert len(first) == 100 and len(p.elements) == 101
+    rest = p.elements.without(list(first)[:50])
+    assert len(rest) == 51 and rest[0] is first[50]
+    assert p.elements[:100] == first
+
+def test_aabb():
+    p = Path(State(), mk_elements(), "p", "default")
+    box = p.get_aabb()
+    # the arc bulges out to x=15, the point has a 1mm box
+    assert (box.left, box.bottom, box.right, box.top) == pytest.approx((-6, 0, 32, 32))
+    boxes = p.elements.aabbs()
+    assert boxes[1] == pytest.approx([10, 0, 15, 10])
+
+def test_transform():
+    p = Path(State(), mk_elements(), "p", "default")
+    p.elements.transform(offset=(1, 2), scale=(2, 2), rotation=90)
+    line, arc, circle, point = p.elements
+    assert line.end == pytest.approx((1, 22))
+    assert arc.radius == 10 and arc.center == pytest.approx((-9, 22))
+    assert arc.startangle == pytest.approx(0)
+    assert circle.center == pytest.approx((-59, 62)) and circle.radius == 4
+
+def test_version_counts_changes():
+    state = State()
+    p = Path(state, mk_elements(), "p", "default")
+    store = state.element_store
+    v = store.version
+    list(p.elements)
+    p.get_aabb()
+    assert store.version == v
+    p.elements[0].toggle_selected()
+    assert store.version == v and store.selection_version == 1
+    v = store.version
+    p.elements.transform(offset=(1, 0))
+    assert store.version > v
+    v = store.version
+    p.add_element(EPoint((0, 0)))
+    assert store.version > v
+
+def test_linearize_matches_elements():
+    elements = mk_elements()
+    p = Path(State(), elements, "p", "default")
+    fast = linearize_to_segments(p.elements, 0.01)
+    slow = linearize_to_segments(elements, 0.01)
+    assert fast.shape == slow.shape and fast == pytest.approx(slow)
+
+def test_views_pickle_as_elements():
+    p = Path(State(), mk_elements(), "p", "default")
+    arc = pickle.loads(pickle.dumps(p.elements[1]))
+    assert type(arc) is EArc and tuple(arc.center) == (10, 5)
+
+def test_memory_per_segment():
+    tracemalloc = pytest.importorskip("tracemalloc")
+    state = State()
+    n = 20000
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    lines = [ELine((float(i), 0.0), (i+1.0, 1.0), None, [1.0, 1.0, 1.0]) for i in range(n)]
+    objects = tracemalloc.get_traced_memory()[0]-base
+    p = Path(state, [], "p", "default")
+    for e in lines:
+        p.add_element(e)
+    del lines
+    gc.collect()
+    stored = tracemalloc.get_traced_memory()[0]-base
+    tracemalloc.stop()
+    assert len(p.elements) == n
+    # rows are about 4x smaller than slotted elements with their tuples and
+    # color lists, part of that goes to headroom of the growing columns
+    assert state.element_store.nbytes()*4 < objects
+    assert stored*2 < objects
+
+def test_unused_rows_are_reused():
+    state = State()
+    p = Path(state, mk_elements(), "p", "default")
+    for i in range(100):
+        # what loading, joining and undo do, new rows replace old ones
+        p.elements = [e.detach() for e in p.elements]
+        gc.collect()
+    # without reuse there would be 404 rows
+    assert len(state.element_store) <= 64
+    line, arc, circle, point = p.elements
+    assert line.end == (10, 0) and arc.radius == 5 and point.center == (-5, 7)
+    kept = p.elements
+    p.elements = []
+    gc.collect()
+    state.element_store.collect()
+    assert len(state.element_store.free) < len(state.element_store)
+    p.elements = mk_elements()
+    assert kept[0].end == (10, 0) and p.elements[0] is not kept[0]
+
+def test_encode_decode():
+    elements = mk_elements()+[ELine((1, 2), (3, 4), None, [0.5, 0.25, 1.0]), EArc((0, 0), 2, 0, 90).turnaround()]
+    p = Path(State(), elements, "p", "default")
+    decoded = decode_elements(encode_elements(p.elements), "lt")
+    assert [type(e).__name__ for e in decoded] == [type(e).__name__ for e in elements]
+    for a, b in zip(decoded, elements):
+        assert a.serialize() == pytest.approx(b.serialize()) and a.lt == "lt"
+        if type(a).__name__ != "EPoint":
+            assert tuple(a.start) == tuple(b.start) and tuple(a.end) == tuple(b.end)
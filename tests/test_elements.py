@@ -0,0 +1,31 @@
+import pytest
+from bcam.elements import ELine, EArc, ECircle, EPoint
+from bcam.tool_operation import TOEnum
+
+
+def test_capabilities_are_shared():
+    a = ELine((0, 0), (1, 0))
+    b = ELine((1, 0), (2, 0))
+    assert a.operations is b.operations is ELine.operations
+    assert a.operations[TOEnum.offset_follow] and not a.operations[TOEnum.drill]
+    assert EArc((0, 0), 1, 0, 90).operations[TOEnum.drill]
+    assert not ECircle((0, 0), 1).joinable and EPoint((0, 0)).operations[TOEnum.drill]
+    with pytest.raises(TypeError):
+        a.operations[TOEnum.drill] = True
+
+def test_elements_have_no_dict():
+    for e in [ELine((0, 0), (1, 0)), EArc((0, 0), 1, 0, 90), ECircle((0, 0), 1), EPoint((0, 0))]:
+        assert not hasattr(e, "__dict__")
+        with pytest.raises(AttributeError):
+            e.foo = 1
+
+def test_arc_polyline():
+    arc = EArc((0, 0), 10, 0, 90)
+    pts = arc.to_polyline(0.01)
+    assert tuple(pts[0]) == pytest.approx(arc.start) and tuple(pts[-1]) == pytest.approx(arc.end)
+    assert (pts[:, 0] >= -1e-9).all() and (pts[:, 1] >= -1e-9).all()
+    # turned around arcs run back over the same quarter
+    back = arc.turnaround().to_polyline(0.01)
+    assert back[::-1] == pytest.approx(pts)
+    lines = ECircle((0, 0), 0.5).to_line_sequence(0.01)
+    assert 4 < len(lines) < 20 and lines[0].start == lines[-1].end
@@ -0,0 +1,53 @@
+import io
+import pytest
+from bcam.state import State
+from bcam.tool_op_drill import TODrill
+from bcam.gcode_writer import GCodeWriter, gen_program
+
+
+class CountingFile(io.StringIO):
+    def __init__(self):
+        super(CountingFile, self).__init__()
+        self.writes = 0
+
+    def write(self, s):
+        self.writes += 1
+        return super(CountingFile, self).write(s)
+
+
+def mk_state(n_drills):
+    state = State()
+    state.tool_operations = [TODrill(state, center=[i, i], depth=3, index=i) for i in range(n_drills)]
+    return state
+
+
+def test_drill_gcode_matches_chunks():
+    state = mk_state(1)
+    op = state.tool_operations[0]
+    chunks = list(op.gen_gcode())
+    op.tool.current_position = [0, 0, 0]
+    state.settings.default_pp.reset()
+    assert op.get_gcode() == "".join(chunks)
+    assert all(c.endswith("\r\n") for c in chunks if c != "")
+
+
+@pytest.mark.parametrize("buffer_size", [1, 64, 1<<16])
+def test_writer_output(buffer_size):
+    expected = "".join(gen_program(mk_state(50)))
+    f = CountingFile()
+    w = GCodeWriter(f, buffer_size)
+    w.write_all(gen_program(mk_state(50)))
+    assert f.getvalue() == expected
+    assert w.bytes_written == len(expected)
+    assert w.lines_written == expected.count("\n")
+
+
+def test_writer_flushes_header_first():
+    f = CountingFile()
+    w = GCodeWriter(f)
+    chunks = gen_program(mk_state(10))
+    w.write(next(chunks))
+    assert f.writes == 0
+    w.write_all(chunks)
+    assert f.writes == 2
+    assert f.getvalue().startswith("G21\r\n")
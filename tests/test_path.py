@@ -0,0 +1,108 @@
+import random
+import pytest
+from bcam.state import State
+from bcam.path import Path
+from bcam.elements import ELine, EArc
+from bcam.calc_utils import pt_to_pt_dist
+
+
+def mk_lines(pts, closed=True):
+    ends = pts[1:]+(pts[:1] if closed else [])
+    return [ELine(s, e) for s, e in zip(pts, ends)]
+
+def assert_connected(ordered):
+    for prev, cur in zip(ordered, ordered[1:]):
+        assert pt_to_pt_dist(prev.end, cur.start) < 0.001
+
+square = [(0, 0), (10, 0), (10, 10), (0, 10)]
+
+
+# Test chaining.
+@pytest.mark.parametrize('shuffle, flip', [
+    (False, False),
+    (True, False),
+    (True, True),
+])
+def test_chain_single_loop(shuffle, flip):
+    elements = mk_lines(square)
+    if flip:
+        elements = [e.turnaround() if i%2 else e for i, e in enumerate(elements)]
+    if shuffle:
+        random.Random(1).shuffle(elements)
+    p = Path(State(), elements, "test", "default")
+    paths = p.mk_connected_paths()
+    assert len(paths) == 1
+    assert len(paths[0].ordered_elements) == 4
+    assert paths[0].get_closed()
+    assert_connected(paths[0].ordered_elements)
+
+def test_chain_keeps_order():
+    elements = mk_lines(square, closed=False)
+    p = Path(State(), elements, "test", "default")
+    connected = p.mk_connected_path()
+    assert connected.ordered_elements == list(p.elements)
+    assert not connected.get_closed()
+
+def test_chain_grows_backward():
+    elements = mk_lines(square, closed=False)
+    elements = [elements[1], elements[0], elements[2]]
+    p = Path(State(), elements, "test", "default")
+    connected = p.mk_connected_path()
+    assert connected.ordered_elements[0].start == (0, 0)
+    assert_connected(connected.ordered_elements)
+
+def test_chain_all_loops():
+    inner = [(2, 2), (4, 2), (4, 4)]
+    elements = mk_lines(square)+mk_lines(inner)+[ELine((20, 20), (30, 30))]
+    random.Random(2).shuffle(elements)
+    p = Path(State(), elements, "test", "default")
+    paths = p.mk_connected_paths()
+    assert sorted(len(c.ordered_elements) for c in paths) == [1, 3, 4]
+    assert sorted(c.get_closed() for c in paths) == [False, True, True]
+    assert len(set(c.name for c in paths)) == 3
+
+def test_chain_within_tolerance():
+    elements = [ELine((0, 0), (1, 0)), ELine((1.0005, 0.0005), (2, 0)), ELine((2, 0), (0, 0))]
+    p = Path(State(), elements, "test", "default")
+    paths = p.mk_connected_paths()
+    assert len(paths) == 1
+    assert paths[0].get_closed()
+    assert paths[0].ordered_elements[1].start == (1, 0)
+
+def test_chain_long_polyline():
+    pts = [(float(i), float(i%2)) for i in range(20000)]
+    elements = mk_lines(pts, closed=False)
+    random.Random(3).shuffle(elements)
+    p = Path(State(), elements, "test", "default")
+    paths = p.mk_connected_paths()
+    assert len(paths) == 1
+    assert len(paths[0].ordered_elements) == len(elements)
+
+
+# Test contour extraction.
+def test_contours_holes():
+    outer = mk_lines([(0, 0), (100, 0), (100, 100), (0, 100)])
+    hole = mk_lines([(10, 10), (40, 10), (40, 40), (10, 40)])
+    island = mk_lines([(20, 20), (30, 20), (30, 30), (20, 30)])
+    other = mk_lines([(200, 0), (210, 0), (210, 10)], closed=False)
+    elements = outer+hole+island+other
+    random.Random(4).shuffle(elements)
+    p = Path(State(), elements, "test", "default")
+    contours = p.mk_contours()
+    assert len(contours) == 4
+    closed = [c for c in contours if c.get_closed()]
+    assert len(closed) == 3
+    starts = dict((min(e.start[0] for e in c.elements), c) for c in closed)
+    assert starts[0].get_parent() is None and not starts[0].is_hole()
+    assert starts[10].get_parent() is starts[0] and starts[10].is_hole()
+    assert starts[20].get_parent() is starts[10] and not starts[20].is_hole()
+    assert [c for c in contours if not c.get_closed()][0].get_parent() is None
+
+def test_contours_circle():
+    from bcam.elements import ECircle
+    outer = mk_lines([(0, 0), (100, 0), (100, 100), (0, 100)])
+    p = Path(State(), outer+[ECircle((50, 50), 5)], "test", "default")
+    contours = p.mk_contours()
+    assert len(contours) == 2
+    circle = [c for c in contours if len(c.elements) == 1][0]
+    assert circle.get_closed() and circle.is_hole()
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from bcam.pp_grbl import PPGRBL
+from bcam.postprocessor import quantize, fmt_fixed
+
+
+@pytest.mark.parametrize("value,expected", [
+    (0, "0.000"),
+    (1.5, "1.500"),
+    (-1.5, "-1.500"),
+    (-0.0001, "0.000"),
+    (12.3456, "12.346"),
+    (-0.02, "-0.020"),
+    (1234567.891, "1234567.891"),
+])
+def test_fmt_fixed(value, expected):
+    assert fmt_fixed(int(quantize(value))) == expected
+
+
+def test_fmt_fixed_matches_printf():
+    for v in np.random.RandomState(0).uniform(-500, 500, 1000):
+        assert fmt_fixed(int(quantize(v))) == ("%.3f" % v).replace("-0.000", "0.000")
+
+
+def test_modal_suppression():
+    pp = PPGRBL()
+    assert pp.move_to_rapid([0, 0, 20]) == "G00 X0.000Y0.000Z20.000\r\n"
+    assert pp.move_to([0, 0, -1]) == "G01 Z-1.000\r\n"
+    assert pp.move_to([5, 0, -1]) == "G01 X5.000\r\n"
+    assert pp.move_to([5, 0.0001, -1]) == ""
+    pp.reset()
+    assert pp.move_to([5, 0, -1]) == "G01 X5.000Y0.000Z-1.000\r\n"
+
+
+def test_batch_matches_single_moves():
+    pts = np.random.RandomState(1).uniform(-10, 10, (200, 3))
+    pts[50:60] = pts[49]
+    pts[100:120, 2] = 0
+    single = PPGRBL()
+    batch = PPGRBL()
+    assert batch.move_to_batch(pts) == "".join(single.move_to(pt) for pt in pts)
+    assert batch.position == single.position
+
+
+def test_arc_updates_position():
+    pp = PPGRBL()
+    pp.move_to([0, 0, 0])
+    assert pp.mk_cw_arc(5, [10, 0, 0]) == "G02 X10.000Y0.000Z0.000 R5.000\r\n"
+    assert pp.move_to([10, 0, -1]) == "G01 Z-1.000\r\n"
+    assert pp.mk_ccw_ijk_arc([-5, 0, 0], [10, 0, -1]) == "G03 X10.000Y0.000Z-1.000 I-5.000J0.000K0.000\r\n"
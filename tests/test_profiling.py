@@ -0,0 +1,54 @@
+import json
+import pytest
+from bcam import profiling
+from bcam.state import State
+from bcam.path import Path
+from bcam.elements import ELine, ECircle
+from bcam.tool_op_pocketing import TOPocketing
+from bcam.tool_operation import TOResult
+
+
+@pytest.fixture(autouse=True)
+def clean_profile():
+    profiling.reset()
+    yield
+    profiling.reset()
+
+
+def test_spans_and_counters():
+    generation = profiling.generation
+    with profiling.span("outer"):
+        profiling.count("widgets", 3)
+        for i in range(2):
+            with profiling.span("inner"):
+                profiling.count("gadgets")
+    snap = profiling.snapshot()
+    assert snap["spans"]["inner"]["calls"] == 2 and snap["spans"]["outer"]["calls"] == 1
+    assert snap["spans"]["outer"]["total"] >= snap["spans"]["inner"]["total"]
+    assert snap["counters"] == {"widgets": 3, "gadgets": 2}
+    # only the outermost span becomes the last one
+    assert profiling.generation == generation+1
+    assert snap["last"]["name"] == "outer" and snap["last"]["counters"] == {"widgets": 3, "gadgets": 2}
+    assert profiling.summary().startswith("outer: ") and "gadgets 2" in profiling.summary()
+    json.loads(profiling.to_json())
+
+def test_merge():
+    with profiling.span("a"):
+        profiling.count("n", 2)
+    other = profiling.snapshot()
+    other["spans"]["a"]["max"] = 10.0
+    profiling.merge(other)
+    snap = profiling.snapshot()
+    assert snap["spans"]["a"]["calls"] == 2 and snap["spans"]["a"]["max"] == 10.0
+    assert snap["counters"]["n"] == 4
+
+def test_pocketing_is_profiled():
+    state = State()
+    p = Path(state, [ECircle((0, 0), 5)], "p", "default")
+    contour = p.mk_contours()[0]
+    to = TOPocketing(state)
+    assert to.apply_now(contour) == TOResult.ok
+    snap = profiling.snapshot()
+    assert snap["spans"]["pocketing"]["calls"] == 1
+    assert snap["counters"]["points tested"] > 0 and snap["counters"]["segments linearized"] > 0
+    assert snap["last"]["name"] == "pocketing"
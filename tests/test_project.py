@@ -0,0 +1,164 @@
+import json
+from bcam.state import State
+from bcam.path import Path
+from bcam.elements import ELine, EArc
+from bcam.tool_op_drill import TODrill
+from bcam.tool_op_offset_follow import TOOffsetFollow
+from bcam.tool_op_pocketing import TOPocketing
+from bcam.tool_operation import TOResult
+from bcam.gcode_writer import gen_program
+from bcam.project import Project, write, read_step_data
+from bcam.toolpath_cache import cache
+from bcam.singleton import Singleton
+from bcam import profiling
+
+
+def mk_path(state, name, n):
+    lines = [ELine((i, 0), (i+1, 0)) for i in range(n)]
+    return Path(state, lines, name, "default")
+
+def mk_project():
+    state = State()
+    state.add_paths([mk_path(state, "p"+str(i), 100) for i in range(10)])
+    project = Project()
+    project.push_state(state, "initial state")
+    return state, project
+
+
+def test_unchanged_paths_are_shared():
+    state, project = mk_project()
+    state.tool_operations.append(TODrill(state, center=[1, 2], index=0))
+    project.push_state(state, "drill")
+    first, second = project.steps
+    shared = [p for p in state.paths if first.records[id(p)] is second.records[id(p)]]
+    assert len(shared) == len(state.paths)
+    assert first.records[id(state)] is not second.records[id(state)]
+
+def test_undo_redo_operations():
+    state, project = mk_project()
+    drill = TODrill(state, center=[1, 2], index=0)
+    state.tool_operations.append(drill)
+    project.push_state(state, "drill")
+    drill.depth = 5
+    project.push_state(state, "update_settings")
+
+    project.step_back()
+    assert state.tool_operations == [drill] and drill.depth == 0
+    project.step_back()
+    assert state.tool_operations == []
+    project.step_back()
+    assert state.tool_operations == []
+    project.step_forward()
+    project.step_forward()
+    assert state.tool_operations == [drill] and drill.depth == 5
+
+def test_undo_path_edits():
+    state, project = mk_project()
+    p = state.paths[0]
+    elements = p.elements
+    p.elements = elements[:50]
+    state.paths.remove(state.paths[1])
+    state.settings.tool.diameter = 6
+    project.push_state(state, "edit")
+    assert project.steps[-1].restore() == 0
+
+    project.step_back()
+    assert len(state.paths) == 10 and state.paths[0] is p
+    assert p.elements == elements
+    assert state.settings.tool.diameter == 3
+    project.step_forward()
+    assert len(state.paths) == 9 and len(p.elements) == 50
+    assert state.settings.tool.diameter == 6
+
+def test_undo_geometry_edits():
+    state, project = mk_project()
+    p = state.paths[0]
+    p.elements[0].end = (5, 5)
+    p.elements[:10].transform(offset=(0, 1))
+    project.push_state(state, "edit")
+
+    project.step_back()
+    assert p.elements[0].end == (1, 0) and p.elements[9].start == (9, 0)
+    project.step_forward()
+    assert p.elements[0].end == (5, 6) and p.elements[9].start == (9, 1)
+
+def test_only_edited_rows_are_compared():
+    state, project = mk_project()
+    state.paths[3].elements[7].end = (5, 5)
+    profiling.reset()
+    project.push_state(state, "edit")
+    assert profiling.counters["snapshot rows compared"] == 1
+    project.push_state(state, "nothing")
+    project.step_back()
+    assert profiling.counters["snapshot rows compared"] == 1
+    project.step_back()
+    assert state.paths[3].elements[7].end == (8, 0)
+
+def test_branching_drops_redo():
+    state, project = mk_project()
+    state.settings.tool.diameter = 6
+    project.push_state(state, "a")
+    project.step_back()
+    state.settings.tool.feedrate = 100
+    project.push_state(state, "b")
+    assert [s.dsc for s in project.steps] == ["initial state", "b"]
+    project.step_forward()
+    assert state.settings.tool.diameter == 3
+
+def test_undo_new_project():
+    state, project = mk_project()
+    State()
+    project.push_state(Singleton.state, "new_project_click")
+    assert Singleton.state.paths == []
+    project.step_back()
+    assert Singleton.state.paths == state.paths
+
+
+def mk_toolpath_project(tmp_path, toolpaths=True):
+    state = State()
+    elements = [ELine((0, 0), (20, 0)), ELine((20, 0), (20, 10)),
+                EArc((10, 10), 10, 0, 180), ELine((0, 10), (0, 0))]
+    state.add_paths([Path(state, elements, "drawing", "default")])
+    contour = state.paths[0].mk_contours()[0]
+    state.add_paths([contour])
+    offset = TOOffsetFollow(state, index=0, depth=1)
+    offset.offset = 1
+    offset.apply(contour)
+    pocket = TOPocketing(state, index=1, depth=1)
+    assert pocket.apply_now(contour) == TOResult.ok
+    state.tool_operations += [offset, pocket]
+    project_path = str(tmp_path/"p.bcam")
+    write(state, project_path, toolpaths)
+    return state, project_path
+
+def test_saved_toolpaths_load_without_recomputing(tmp_path):
+    state, project_path = mk_toolpath_project(tmp_path)
+    gcode = "".join(gen_program(state))
+    cache.clear()
+    profiling.reset()
+    loaded = State(read_step_data(project_path)["state"])
+    assert profiling.spans == {}
+    assert len(loaded.tool_operations[1].draw_list) == len(state.tool_operations[1].draw_list)
+    assert "".join(gen_program(loaded)) == gcode
+
+def test_stale_toolpaths_are_recomputed(tmp_path):
+    state, project_path = mk_toolpath_project(tmp_path)
+    data = read_step_data(project_path)
+    data["state"]["tool_operations"][0]["offset"] = 2
+    data["state"]["tool_operations"][1]["offset"] = 2
+    cache.clear()
+    profiling.reset()
+    loaded = State(data["state"])
+    # the offset is computed again, pockets wait for Recalculate
+    assert profiling.spans["offset follow"][0] == 1
+    assert loaded.tool_operations[1].draw_list == []
+
+def test_format_2_still_loads(tmp_path):
+    state, project_path = mk_toolpath_project(tmp_path, toolpaths=False)
+    data = json.loads(open(project_path).read())
+    assert "toolpath" not in data["step"]["state"]["tool_operations"][0]
+    data["format_version"] = 2
+    open(project_path, "w").write(json.dumps(data))
+    cache.clear()
+    loaded = State(read_step_data(project_path)["state"])
+    assert len(loaded.tool_operations[0].draw_list) == len(state.tool_operations[0].draw_list)
@@ -0,0 +1,141 @@
+import pytest
+
+cairo = pytest.importorskip("cairo")
+
+from bcam import profiling, render_cairo
+from bcam.render_cairo import SceneCache
+from bcam.state import State
+from bcam.path import Path
+from bcam.elements import ELine, ECircle
+
+
+@pytest.fixture(autouse=True)
+def clean_profiling():
+    profiling.reset()
+    yield
+    profiling.reset()
+
+
+def mk_state():
+    state = State()
+    lt = state.settings.get_def_lt()
+    elements = [ELine((5, 5), (15, 5), lt), ELine((15, 5), (15, 15), lt), ECircle((10, 10), 2, lt)]
+    state.add_paths([Path(state, elements, "p", "default")])
+    return state
+
+def recorded():
+    return profiling.counters.get("display lists recorded", 0)
+
+def rendered():
+    return profiling.counters.get("tiles rendered", 0)
+
+def draw(scene, state, offset, size=(512, 512), scale=(10, 10)):
+    ctx = cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, size[0], size[1]))
+    scene.draw(ctx, (0, 0)+size, offset, scale, state.paths, state.tool_operations)
+
+
+def test_runs_of_alike_elements_are_one_path():
+    state = mk_state()
+    scene = SceneCache()
+    dl, = scene.update(state.paths, [])
+    assert len(dl.items) == 1
+    assert dl.extents[0] < 5 and dl.extents[2] > 15
+
+    state.paths[0].elements[1].selected = True
+    dl, = scene.update(state.paths, [])
+    assert len(dl.items) == 3
+
+def test_display_lists_are_retained():
+    state = mk_state()
+    scene = SceneCache()
+    first, = scene.update(state.paths, [])
+    assert scene.update(state.paths, [])[0] is first and recorded() == 1
+    state.paths[0].display = False
+    hidden, = scene.update(state.paths, [])
+    assert hidden is not first and hidden.items == [] and recorded() == 2
+    assert scene.update([], []) == [] and scene.display_lists == {}
+
+def test_pan_renders_only_new_tiles():
+    state = mk_state()
+    scene = SceneCache()
+    t = scene.tile_size
+    draw(scene, state, (256, 256))
+    # the path is in one of the four tiles around the origin
+    assert rendered() == 1 and len(scene.tiles) == 4
+    draw(scene, state, (256+t//2, 256))
+    assert rendered() == 1 and len(scene.tiles) == 6
+    state.paths[0].elements[0].selected = True
+    draw(scene, state, (256+t//2, 256))
+    assert rendered() == 2
+
+def test_replay_draws_like_stroking_every_element():
+    state = mk_state()
+    size = (64, 64)
+    direct = cairo.ImageSurface(cairo.FORMAT_ARGB32, size[0], size[1])
+    ctx = cairo.Context(direct)
+    ctx.translate(0, 64)
+    ctx.scale(4, -4)
+    for e in state.paths[0].elements:
+        color, lw, round_, fill = render_cairo.element_style(e, None)
+        render_cairo.set_source(ctx, color)
+        ctx.set_line_width(lw)
+        render_cairo.trace_element(ctx, e)
+        ctx.stroke()
+    retained = cairo.ImageSurface(cairo.FORMAT_ARGB32, size[0], size[1])
+    SceneCache().draw(cairo.Context(retained), (0, 0)+size, (0, 64), (4, 4), state.paths, [])
+    assert sum(bytearray(retained.get_data())) > 0
+    assert abs(sum(bytearray(retained.get_data()))-sum(bytearray(direct.get_data()))) < 0.05*sum(bytearray(direct.get_data()))
+
+def test_big_paths_are_chunked():
+    state = State()
+    lt = state.settings.get_def_lt()
+    state.add_paths([Path(state, [ELine((i, 0), (i+1, 0), lt) for i in range(1000)], "p", "default")])
+    dl, = SceneCache().update(state.paths, [])
+    assert len(dl.items) == 4
+    extents = [t.extents for style, t in dl.items]
+    assert extents[0][2] < extents[1][0]+1 and extents[-1][2] > 999
+
+def test_zoomed_out_paths_are_decimated():
+    state = State()
+    lt = state.settings.get_def_lt()
+    elements = [ELine((i*0.01, 0), ((i+1)*0.01, 0), lt) for i in range(1000)]
+    state.add_paths([Path(state, elements, "p", "default")])
+    scene = SceneCache()
+    scene.draw(cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 64, 64)), (0, 0, 64, 64), (0, 32), (1000, 1000), state.paths, [])
+    assert profiling.counters.get("paths decimated", 0) == 0
+    scene.draw(cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 64, 64)), (0, 0, 64, 64), (0, 32), (1, 1), state.paths, [])
+    assert profiling.counters.get("paths decimated", 0) > 0
+
+def test_grid_step():
+    assert render_cairo.grid_step((800, 600), (10, 10)) == 1
+    assert render_cairo.grid_step((800, 600), (0.1, 0.1)) == 100
+
+def test_grid_pattern_is_made_once_per_scale():
+    grid = render_cairo.GridPattern()
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 100, 100)
+    for offset in [(50, 50), (53, 41), (-7, 200)]:
+        grid.paint(cairo.Context(surface), (100, 100), offset, (10, 10))
+    assert profiling.counters["grid patterns made"] == 1
+    # a dot every 10 pixels from the world origin, white on black
+    data = surface.get_data()
+    stride = surface.get_stride()
+    pixel = lambda x, y: bytearray(data[y*stride+x*4:y*stride+x*4+4])
+    assert pixel(3, 0) == bytearray([255, 255, 255, 255])
+    assert pixel(13, 10) == bytearray([255, 255, 255, 255])
+    assert pixel(4, 0) == bytearray([0, 0, 0, 255])
+    grid.paint(cairo.Context(surface), (100, 100), (0, 0), (20, 20))
+    assert profiling.counters["grid patterns made"] == 2
+
+def test_selection_redraws_only_its_chunk_and_tiles():
+    state = State()
+    lt = state.settings.get_def_lt()
+    state.add_paths([Path(state, [ELine((i+10, 5), (i+11, 5), lt) for i in range(1000)], "p", "default")])
+    scene = SceneCache()
+    draw(scene, state, (0, 256), (1024, 512), (1, 1))
+    assert profiling.counters["chunks recorded"] == 4 and rendered() == 4
+    state.paths[0].elements[900].selected = True
+    dl, = scene.update(state.paths, [])
+    assert profiling.counters["chunks recorded"] == 5 and recorded() == 1
+    draw(scene, state, (0, 256), (1024, 512), (1, 1))
+    # x 778 to 1010 is in the fourth tile
+    assert rendered() == 5
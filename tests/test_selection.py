@@ -0,0 +1,17 @@
+from bcam.selection import Selection
+from bcam.state import State
+from bcam.path import Path
+from bcam.elements import ELine
+
+
+def test_selection_keeps_flags_and_order():
+    state = State()
+    lt = state.settings.get_def_lt()
+    state.add_paths([Path(state, [ELine((i, 0), (i+1, 0), lt) for i in range(3)], "p", "default")])
+    a, b, c = state.paths[0].elements
+    s = Selection()
+    assert s.add(c) and s.add(a) and not s.add(c)
+    assert list(s) == [c, a] and len(s) == 2 and c in s and b not in s
+    assert c.selected and not b.selected
+    assert s.remove(c) and not s.remove(c) and not c.selected
+    assert s.clear() == [a] and len(s) == 0 and not a.selected
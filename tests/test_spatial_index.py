@@ -0,0 +1,92 @@
+import random
+import pytest
+from bcam import profiling
+from bcam.state import State
+from bcam.path import Path
+from bcam.elements import ELine, EArc, ECircle, EPoint
+
+
+@pytest.fixture(autouse=True)
+def clean_profiling():
+    profiling.reset()
+    yield
+    profiling.reset()
+
+
+def mk_state(n=300, seed=1):
+    r = random.Random(seed)
+    state = State()
+    lt = state.settings.get_def_lt()
+    elements = []
+    for i in range(n):
+        x, y = r.uniform(0, 100), r.uniform(0, 100)
+        kind = i%4
+        if kind == 0:
+            elements.append(ELine((x, y), (x+r.uniform(-5, 5), y+r.uniform(-5, 5)), lt))
+        elif kind == 1:
+            a = r.uniform(0, 180)
+            elements.append(EArc((x, y), r.uniform(0.5, 5), a, a+r.uniform(10, 170), lt))
+        elif kind == 2:
+            elements.append(ECircle((x, y), r.uniform(0.5, 5), lt))
+        else:
+            elements.append(EPoint((x, y), lt))
+    # one element much bigger than the others
+    elements.append(ELine((-50, -50), (150, 150), lt))
+    state.add_paths([Path(state, elements[:n//2], "a", "default"), Path(state, elements[n//2:], "b", "default")])
+    return state
+
+def elements_of(state):
+    return [e for p in state.paths for e in p.elements]
+
+def touches(b, left, bottom, right, top):
+    corners = [(b[0], b[1]), (b[0], b[3]), (b[2], b[1]), (b[2], b[3])]
+    return any(left <= x <= right and bottom <= y <= top for x, y in corners)
+
+
+def test_near_finds_what_distance_to_pt_finds():
+    state = mk_state()
+    index = state.get_spatial_index()
+    r = random.Random(2)
+    for i in range(200):
+        pt = (r.uniform(-10, 110), r.uniform(-10, 110))
+        expected = [e._i for e in elements_of(state) if e.distance_to_pt(pt) < 1]
+        assert [e._i for e in index.near(pt, 1)] == expected
+    assert profiling.counters["spatial index candidates"] < 200*len(elements_of(state))//4
+
+def test_touching_box_finds_bounding_box_corners():
+    state = mk_state()
+    index = state.get_spatial_index()
+    r = random.Random(3)
+    for i in range(100):
+        x, y = r.uniform(-10, 110), r.uniform(-10, 110)
+        box = (x, y, x+r.uniform(0, 30), y+r.uniform(0, 30))
+        expected = [i for p in state.paths for i, b in zip(p.elements.indices, p.elements.aabbs()) if touches(b, *box)]
+        assert [e._i for e in index.touching_box(*box)] == expected
+
+def test_index_follows_paths_and_elements():
+    state = mk_state(20)
+    index = state.get_spatial_index()
+    assert state.get_spatial_index() is index
+    lt = state.settings.get_def_lt()
+    state.add_paths([Path(state, [ELine((500, 500), (510, 500), lt)], "c", "default")])
+    index = state.get_spatial_index()
+    assert len(index.near((505, 500.5), 1)) == 1
+    line = state.paths[-1].elements[0]
+    line.start = (600, 600)
+    assert state.get_spatial_index() is not index
+    assert state.get_spatial_index().near((505, 500.5), 1) == []
+    # deleting elements replaces the path's sequence
+    state.paths[-1].elements = state.paths[-1].elements.without([line])
+    assert state.get_spatial_index().near((600, 600), 1) == []
+
+def test_shared_elements_are_found_once():
+    state = mk_state(20)
+    shared = state.paths[0].elements
+    state.add_paths([Path(state, shared, "copy", "default")])
+    e = shared[0]
+    pt = e.start if hasattr(e, "start") else e.center
+    assert [f._i for f in state.get_spatial_index().near(pt, 0.001)].count(e._i) == 1
+
+def test_empty_state():
+    index = State().get_spatial_index()
+    assert index.near((0, 0), 1) == [] and index.touching_box(-1, -1, 1, 1) == []
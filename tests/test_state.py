@@ -0,0 +1,10 @@
+from bcam.state import State
+
+
+def test_screen_area():
+    state = State()
+    state.scale = (10, 10)
+    state.set_screen_offset((400, 300))
+    # y goes up in the world and down on screen
+    assert state.screen_area(0, 0, 1, 2) == (399, 279, 12, 22)
+    assert state.screen_area(0, 0, 1, 2, margin=0.5) == (394, 274, 22, 32)
@@ -0,0 +1,46 @@
+from bcam import profiling
+from bcam.state import State
+from bcam.path import Path
+import math
+from bcam.elements import ECircle, ELine, linearize_to_segments
+from bcam.calc_utils import PolygonUtils
+from bcam.tool_op_pocketing import TOPocketing, TOPocketingStrategy
+from bcam.toolpath_cache import cache
+from bcam.tool_operation import TOResult
+
+
+def mk_contour(r):
+    state = State()
+    return Path(state, [ECircle((0, 0), r)], "p", "default").mk_contours()[0]
+
+def test_field_is_capped():
+    cache.clear()
+    profiling.reset()
+    contour = mk_contour(20)
+    to = TOPocketing(contour.state)
+    to.strategy = TOPocketingStrategy.contour
+    to.max_field_points = 5000
+    assert to.apply_now(contour) == TOResult.ok
+    # the field got coarser than a quarter of the stepover
+    assert 0 < profiling.counters["points tested"] <= 5000
+    to.max_field_points = 1000
+    to.offset+= 1
+    assert to.apply_now(contour) == TOResult.failed and to.draw_list == []
+    cache.clear()
+
+def test_rings_keep_off_the_walls():
+    state = State()
+    outline = [(0, 0), (40, 0), (40, 10), (10, 10), (10, 30), (0, 30)]
+    lines = [ELine(s, e) for s, e in zip(outline, outline[1:]+outline[:1])]
+    contour = Path(state, lines, "p", "default").mk_contours()[0]
+    to = TOPocketing(contour.state)
+    arcs = to.build_circles(contour.ordered_elements)
+    assert len(arcs) > 0
+    pu = PolygonUtils(linearize_to_segments(contour.ordered_elements, 0.01))
+    for a in arcs:
+        for t in (0.0, 0.5, 1.0):
+            angle = a.startangle+(a.endangle-a.startangle)*t
+            pt = (a.center[0]+a.radius*math.cos(angle), a.center[1]+a.radius*math.sin(angle))
+            # rings are sampled every 0.1 degrees
+            slack = a.radius*math.radians(0.1)
+            assert pu.pt_inside(pt) and pu.distances_to_pts([pt])[0] > to.offset-slack
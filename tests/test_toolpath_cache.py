@@ -0,0 +1,115 @@
+import json
+import os
+import pytest
+from bcam import profiling
+from bcam.toolpath_cache import ToolpathCache, cache, mk_key
+from bcam.state import State
+from bcam.path import Path
+from bcam.elements import ELine, EArc
+from bcam.tool_op_offset_follow import TOOffsetFollow
+from bcam.tool_op_pocketing import TOPocketing, TOPocketingStrategy
+from bcam.tool_operation import TOResult
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    cache.clear()
+    cache.set_directory(None)
+    profiling.reset()
+    yield
+    cache.clear()
+    cache.set_directory(None)
+
+
+def mk_contour(state=None):
+    state = state or State()
+    pts = [(0, 0), (20, 0), (20, 10)]
+    elements = [ELine(s, e) for s, e in zip(pts, pts[1:])]
+    elements.append(EArc((10, 10), 10, 0, 180))
+    elements.append(ELine((0, 10), (0, 0)))
+    state.add_paths([Path(state, elements, "p", "default")])
+    return state.paths[0].mk_contours()[0]
+
+def hits():
+    return profiling.counters.get("toolpath cache hits", 0)
+
+
+def test_keys():
+    a = [ELine((0, 0), (1, 0)), EArc((1, 1), 1, -90, 0)]
+    b = [ELine((0, 0), (1, 0)), EArc((1, 1), 1, -90, 0)]
+    assert mk_key("pocket", {"offset": 1}, a) == mk_key("pocket", {"offset": 1}, b)
+    assert mk_key("pocket", {"offset": 1}, a) != mk_key("pocket", {"offset": 2}, a)
+    assert mk_key("pocket", {"offset": 1}, a) != mk_key("pocket", {"offset": 1}, a[:1])
+    # what a project file round trip does to arc angles doesn't matter
+    assert mk_key("pocket", {}, [EArc(data=a[1].serialize())]) == mk_key("pocket", {}, a[1:])
+
+def test_lru_and_fresh_elements():
+    c = ToolpathCache(max_entries=2)
+    for k in "abc":
+        c.put(k, [ELine((0, 0), (1, 0))])
+    assert c.get("a", None) == None
+    first = c.get("b", None)
+    assert first[0].end == (1, 0) and c.get("b", None)[0] is not first[0]
+    c.put("d", [])
+    # b was used last, c goes
+    assert c.get("c", None) == None and c.get("b", None) != None
+
+def test_disk_tier(tmp_path):
+    c = ToolpathCache(directory=str(tmp_path/"cache"))
+    c.put("k", [ELine((0, 0), (1, 0)), EArc((1, 1), 1, -90, 0)])
+    again = ToolpathCache(directory=str(tmp_path/"cache"))
+    line, arc = again.get("k", None)
+    assert tuple(line.end) == (1, 0) and arc.radius == 1
+    assert arc.end == pytest.approx((2, 1))
+    (tmp_path/"cache"/"broken.json").write_text("{")
+    assert again.get("broken", None) == None
+
+def test_disk_tier_is_pruned(tmp_path):
+    directory = tmp_path/"cache"
+    c = ToolpathCache(directory=str(directory), max_disk_bytes=2000)
+    lines = [ELine((0, 0), (1, 0))]
+    for i in range(20):
+        c.put(str(i), lines)
+        os.utime(str(directory/(str(i)+".json")), (i, i))
+        if i == 10:
+            # reading an entry keeps it
+            c.get("3", None)
+    size = sum(os.path.getsize(str(f)) for f in directory.iterdir())
+    assert size <= 2000 and size == c.disk_bytes
+    assert c.get("19", None) != None and (directory/"3.json").exists()
+    assert not (directory/"0.json").exists()
+    again = ToolpathCache(directory=str(directory), max_disk_bytes=2000)
+    assert again.disk_bytes == size
+    assert again.prune(0) > 0 and list(directory.iterdir()) == []
+
+def test_offset_follow_reuses_toolpath():
+    contour = mk_contour()
+    first = TOOffsetFollow(contour.state)
+    first.offset = 1
+    assert first.apply(contour) and hits() == 0
+    second = TOOffsetFollow(contour.state)
+    second.offset = 1
+    assert second.apply(contour) and hits() == 1
+    assert [e.serialize() for e in second.draw_list] == [e.serialize() for e in first.draw_list]
+    third = TOOffsetFollow(contour.state)
+    third.offset = 2
+    third.apply(contour)
+    assert hits() == 1
+
+@pytest.mark.parametrize("strategy", [TOPocketingStrategy.radial, TOPocketingStrategy.contour])
+def test_pocket_survives_project_round_trip(tmp_path, strategy):
+    cache.set_directory(str(tmp_path))
+    contour = mk_contour()
+    state = contour.state
+    to = TOPocketing(state, depth=1)
+    to.strategy = strategy
+    assert to.apply_now(contour) == TOResult.ok and len(to.draw_list) > 0
+    path_data = json.loads(json.dumps(contour.serialize()))
+    to_data = json.loads(json.dumps(to.serialize()))
+
+    cache.clear()
+    loaded = State()
+    loaded.add_paths([Path(loaded, data=path_data)])
+    pocket = TOPocketing(loaded, data=to_data)
+    assert hits() == 1
+    assert [e.serialize() for e in pocket.draw_list] == [e.serialize() for e in to.draw_list]
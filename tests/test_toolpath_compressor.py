@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from bcam.pp_grbl import PPGRBL
+from bcam.elements import EArc
+from bcam.toolpath_compressor import ToolpathCompressor
+from bcam.tool import Tool
+
+
+def run(tolerance, pts, z=-1):
+    compressor = ToolpathCompressor(tolerance)
+    pp = PPGRBL()
+    out = "".join(compressor.gen_polyline_gcode(pp, pts, z))
+    return compressor, out
+
+
+def test_disabled_keeps_every_move():
+    pts = [(i, 0) for i in range(10)]
+    compressor, out = run(0, pts)
+    assert out.count("\n") == 10
+    assert compressor.get_removed() == 0
+
+def test_collinear_merge():
+    pts = [(i*0.5, 2*i*0.5) for i in range(100)]+[(49.5, 0)]
+    compressor, out = run(0.01, pts)
+    assert out == "G01 X0.000Y0.000Z-1.000\r\nG01 X49.500Y99.000\r\nG01 Y0.000\r\n"
+    assert (compressor.blocks_in, compressor.get_removed()) == (100, 98)
+
+def test_duplicate_points_are_not_blocks():
+    pts = [(0, 0), (1, 0), (1, 0), (2, 0), (2, 0)]
+    compressor, out = run(0, pts)
+    assert compressor.blocks_in == 2
+
+@pytest.mark.parametrize("direction, code", [(1, "G03"), (-1, "G02")])
+def test_arc_refit(direction, code):
+    a = direction*np.arange(0, 3, 0.1)
+    pts = np.column_stack((10*np.cos(a), 10*np.sin(a)))
+    compressor, out = run(0.01, pts)
+    lines = out.split("\r\n")[:-1]
+    assert lines[0] == "G01 X10.000Y0.000Z-1.000"
+    assert all(l.startswith(code) for l in lines[1:])
+    assert all(l.endswith("R10.000") for l in lines[1:])
+    assert compressor.blocks_out == len(lines)-1
+
+def test_flat_arcs():
+    compressor = ToolpathCompressor(0.01)
+    assert compressor.is_flat(EArc((0, 0), 10, 0, 5))
+    assert compressor.is_flat(EArc((0, 0), 10, 0, 5).turnaround())
+    assert not compressor.is_flat(EArc((0, 0), 10, 0, 30))
+    assert not compressor.is_flat(EArc((0, 0), 10, 5, 0))
+    assert not ToolpathCompressor(0).is_flat(EArc((0, 0), 10, 0, 5))
+
+def test_old_tools_do_not_compress():
+    data = Tool(tolerance=0.05).serialize()
+    assert data["compression_tolerance"] == 0
+    del data["compression_tolerance"]
+    tool = Tool(data=data)
+    assert (tool.tolerance, tool.compression_tolerance) == (0.05, 0)
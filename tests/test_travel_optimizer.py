@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+from bcam.state import State
+from bcam.tool_op_drill import TODrill
+from bcam.tool_op_pocketing import TOPocketing, TOPocketingStrategy
+from bcam.tool_operation import ToolOperation
+from bcam.calc_utils import PolygonUtils
+from bcam.travel_optimizer import order_by_travel, travel_length, split_runs, TravelOptimizer
+from bcam.elements import ELine
+
+
+def nearest_neighbour_length(pts, start):
+    left = list(range(len(pts)))
+    pos = start
+    total = 0
+    while left:
+        d = [np.hypot(*(pts[i]-pos)) for i in left]
+        k = int(np.argmin(d))
+        total += d[k]
+        pos = pts[left.pop(k)]
+    return total
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_order_beats_nearest_neighbour(seed):
+    pts = np.random.RandomState(seed).uniform(0, 100, (200, 2))
+    order = order_by_travel(pts, pts, (0, 0))
+    assert sorted(order) == list(range(200))
+    length = travel_length(pts, pts, order, (0, 0))
+    assert length <= nearest_neighbour_length(pts, np.zeros(2))+1e-9
+    assert length < travel_length(pts, pts, list(range(200)), (0, 0))/4
+
+def test_order_keeps_item_direction():
+    # lines cut left to right, the way back is a rapid
+    entries = [(0, y) for y in range(10)]
+    exits = [(10, y) for y in range(10)]
+    order = order_by_travel(entries, exits, (0, 0))
+    assert travel_length(entries, exits, order, (0, 0)) == pytest.approx(9*np.hypot(10, 1))
+
+def test_order_small():
+    assert order_by_travel([], [], (0, 0)) == []
+    assert order_by_travel([(1, 1)], [(1, 1)], (0, 0)) == [0]
+
+def test_split_runs():
+    lines = [ELine((0, 0), (1, 0)), ELine((1, 0), (1, 1)), ELine((5, 5), (6, 5))]
+    assert [len(r) for r in split_runs(lines)] == [2, 1]
+
+
+class Cutout(ToolOperation):
+    def __init__(self, state, pts):
+        super(Cutout, self).__init__(state)
+        self.name = "cutout"
+        self.pts = pts
+
+    def get_toolpath_ends(self):
+        return (self.pts[0], self.pts[0])
+
+    def get_contour(self):
+        return PolygonUtils([ELine(s, e) for s, e in zip(self.pts, self.pts[1:]+self.pts[:1])])
+
+
+def test_inner_features_first():
+    state = State()
+    outer = Cutout(state, [(0, 0), (50, 0), (50, 50), (0, 50)])
+    inner = Cutout(state, [(20, 20), (30, 20), (30, 30), (20, 30)])
+    drills = [TODrill(state, center=c, index=i) for i, c in enumerate([(25, 25), (10, 10), (40, 40), (70, 10)])]
+    state.tool_operations = [outer, drills[3], inner, drills[0], drills[1], drills[2]]
+    before, after = TravelOptimizer(state).optimize()
+    ops = state.tool_operations
+    assert sorted(map(id, ops)) == sorted(map(id, [outer, inner]+drills))
+    assert ops.index(drills[0]) < ops.index(inner) < ops.index(outer)
+    assert ops.index(drills[1]) < ops.index(outer)
+    assert ops.index(drills[2]) < ops.index(outer)
+
+def test_drills_travel_report():
+    state = State()
+    centers = np.random.RandomState(3).uniform(0, 100, (100, 2)).tolist()
+    state.tool_operations = [TODrill(state, center=c, index=i) for i, c in enumerate(centers)]
+    before, after = TravelOptimizer(state).optimize()
+    ends = [op.get_toolpath_ends()[0] for op in state.tool_operations]
+    assert after == pytest.approx(travel_length(ends, ends, list(range(100)), (0, 0)))
+    assert after < before/3
+    # a second pass has nothing left to gain
+    again = TravelOptimizer(state).optimize()
+    assert again[0] == pytest.approx(after) and again[1] <= again[0]
+
+def mk_pocket(state, strategy):
+    pocket = TOPocketing(state, depth=1)
+    pocket.strategy = strategy
+    # runs bouncing between x 0 and 50, nearest neighbour would group them
+    pocket.draw_list = [ELine((x, 0), (x+1, 0)) for x in (0, 50, 1, 51, 2)]
+    return pocket
+
+@pytest.mark.parametrize("strategy", [TOPocketingStrategy.radial, TOPocketingStrategy.contour])
+def test_contour_pockets_keep_their_order(strategy):
+    state = State()
+    pocket = mk_pocket(state, strategy)
+    lines = list(pocket.draw_list)
+    state.tool_operations = [pocket]
+    TravelOptimizer(state).optimize()
+    assert (pocket.draw_list == lines) == (strategy == TOPocketingStrategy.contour)
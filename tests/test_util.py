@@ -0,0 +1,46 @@
+import logging
+from bcam import util
+from bcam.path import Path
+from bcam.state import State
+from bcam.elements import ELine
+
+
+def mk_path():
+    square = [(0, 0), (10, 0), (10, 10), (0, 10)]
+    return Path(State(), [ELine(s, e) for s, e in zip(square, square[1:]+square[:1])], "p", "default")
+
+
+def test_dbgfname_is_silent_when_disabled(caplog):
+    caplog.set_level(logging.DEBUG)
+    util.dbgfname()
+    assert caplog.records == []
+    util.set_tracing(True)
+    try:
+        util.dbgfname()
+    finally:
+        util.set_tracing(False)
+    assert "test_dbgfname_is_silent_when_disabled" in caplog.records[0].getMessage()
+
+def test_set_tracing_swaps_wrappers():
+    original = Path.__dict__["mk_contours"]
+    assert original in util.traced_functions
+    util.set_tracing(True)
+    try:
+        assert Path.__dict__["mk_contours"].traced_function is original
+        util.reset_trace_stats()
+        mk_path().mk_contours()
+        stats = util.trace_stats["bcam.path.Path.mk_contours"]
+        assert stats[0] == 1 and stats[1] > 0
+        assert util.trace_stats["bcam.path.Path.mk_connected_paths"][0] == 1
+        assert any(l.endswith("bcam.path.Path.mk_contours") for l in util.trace_report())
+    finally:
+        util.set_tracing(False)
+    assert Path.__dict__["mk_contours"] is original
+    mk_path().mk_contours()
+    assert stats[0] == 1
+
+def test_merge_trace_stats():
+    util.reset_trace_stats()
+    util.merge_trace_stats({"a.b": [2, 0.5]})
+    util.merge_trace_stats({"a.b": [1, 0.25]})
+    assert util.trace_stats["a.b"] == [3, 0.75]